@@ -0,0 +1,43 @@
+import numpy as np
+
+
+ASSIGNMENT_METHODS = ("hungarian", "greedy", "none")
+
+
+def greedy_assignment(scores, threshold):
+    # Repeatedly take the highest remaining pair above threshold
+    pairs = []
+    if scores.size == 0:
+        return pairs
+    scores = scores.copy()
+    while True:
+        row, col = np.unravel_index(np.argmax(scores), scores.shape)
+        if scores[row, col] < threshold:
+            return pairs
+        pairs.append((int(row), int(col)))
+        scores[row, :] = -np.inf
+        scores[:, col] = -np.inf
+
+
+def hungarian_assignment(scores, threshold):
+    # One-to-one pairs maximizing the total margin over threshold; pairs
+    # below threshold add nothing and are dropped, so rows may stay
+    # unassigned. Falls back to greedy when scipy is not installed; scipy
+    # is only imported once a frame needs it, keeping it off cold start.
+    if scores.size == 0:
+        return []
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return greedy_assignment(scores, threshold)
+    gains = np.clip(np.nan_to_num(scores - threshold, neginf=-1.0), 0, None)
+    rows, cols = linear_sum_assignment(gains, maximize=True)
+    return [(int(row), int(col)) for row, col in zip(rows, cols) if scores[row, col] >= threshold]
+
+
+def assign(scores, threshold, method="hungarian"):
+    if method not in ASSIGNMENT_METHODS[:2]:
+        raise ValueError(f"Unknown assignment method '{method}', expected one of {list(ASSIGNMENT_METHODS[:2])}")
+    if method == "greedy":
+        return greedy_assignment(scores, threshold)
+    return hungarian_assignment(scores, threshold)
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from metrics import REGISTRY
+
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class MicroBatcher:
+    # Collects face crops from concurrent requests for up to `max_wait_ms`
+    # or `max_items` crops, runs them through `run_batch` as one batch and
+    # fans the per-crop results back out to each waiting request.
+    #
+    # `run_batch` is an async callable taking a list of crops and returning
+    # one result per crop, in order.
+    def __init__(self, run_batch, max_items=32, max_wait_ms=5.0, max_concurrent_batches=1):
+        self.run_batch = run_batch
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._pending_items = 0
+        self._wakeup = None
+        self._full = None
+        self._task = None
+        self._slots = None
+        self._max_concurrent_batches = max_concurrent_batches
+
+        self.batch_size = REGISTRY.histogram(
+            "face_batch_size", BATCH_SIZE_BUCKETS, "Face crops per recognition batch")
+        self.queue_wait = REGISTRY.histogram(
+            "face_batch_queue_wait_ms", QUEUE_WAIT_BUCKETS, "Time a request waited for its batch to start")
+        self.batches = REGISTRY.counter("face_batches_total", "Recognition batches executed")
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._slots = asyncio.Semaphore(self._max_concurrent_batches)
+            self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def submit(self, crops):
+        if not crops:
+            return []
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((crops, future, time.perf_counter()))
+        self._pending_items += len(crops)
+        self._wakeup.set()
+        if self._pending_items >= self.max_items:
+            self._full.set()
+        return await future
+
+    async def _collect(self):
+        while True:
+            await self._wakeup.wait()
+            # Hold the first request for at most max_wait while others join
+            deadline = self._pending[0][2] + self.max_wait
+            remaining = deadline - time.perf_counter()
+            if remaining > 0 and self._pending_items < self.max_items:
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = []
+            items = 0
+            while self._pending and (not batch or items + len(self._pending[0][0]) <= self.max_items):
+                request = self._pending.pop(0)
+                batch.append(request)
+                items += len(request[0])
+            self._pending_items -= items
+            if not self._pending:
+                self._wakeup.clear()
+            if self._pending_items < self.max_items:
+                self._full.clear()
+
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            started = time.perf_counter()
+            crops = [crop for request_crops, _, _ in batch for crop in request_crops]
+            self.batch_size.observe(len(crops))
+            self.batches.inc()
+            for _, _, enqueued in batch:
+                self.queue_wait.observe((started - enqueued) * 1000)
+
+            try:
+                results = await self.run_batch(crops)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            offset = 0
+            for request_crops, future, _ in batch:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(request_crops)])
+                offset += len(request_crops)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "batches": self.batches.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait_ms": self.queue_wait.snapshot(),
+        }
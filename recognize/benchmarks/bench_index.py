@@ -0,0 +1,102 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gallery import FaceGallery, normalize_rows
+from search_index import SEARCH_INDEXES
+
+
+def make_arcface_like(num_people, samples_per_person, num_queries, dim=512, noise=0.05, seed=0):
+    # ArcFace embeddings cluster tightly around a per-identity direction;
+    # isotropic noise around random unit centers reproduces that geometry.
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((num_people, dim)))
+    labels = np.repeat(np.arange(num_people), samples_per_person)
+    gallery = normalize_rows(centers[labels] + noise * rng.standard_normal((len(labels), dim)))
+    query_labels = rng.integers(0, num_people, num_queries)
+    queries = normalize_rows(centers[query_labels] + noise * rng.standard_normal((num_queries, dim)))
+    return gallery, labels, queries
+
+
+def run_backend(kind, vectors, labels, queries, truth, k, options):
+    gallery = FaceGallery(dim=vectors.shape[1], capacity=len(vectors), index=kind, index_options=options)
+
+    start = time.perf_counter()
+    gallery.add_many([f"person_{label}" for label in labels], vectors)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, ids = gallery.index.search(queries, k=k)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries[:min(len(queries), 200)]:
+        start = time.perf_counter()
+        gallery.index.search(query[None, :], k=k)
+        latencies.append(time.perf_counter() - start)
+
+    recall_at_1 = float(np.mean(ids[:, 0] == truth[:, 0]))
+    recall_at_k = float(np.mean([len(set(found) & set(expected)) / k for found, expected in zip(ids, truth)]))
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "backend": kind,
+        "options": options,
+        "build_seconds": build_seconds,
+        "recall@1": recall_at_1,
+        f"recall@{k}": recall_at_k,
+        "batch_qps": len(queries) / batch_seconds,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency benchmark for gallery search backends")
+    parser.add_argument("--people", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=10, help="embeddings per person")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", default=",".join(SEARCH_INDEXES))
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    vectors, labels, queries = make_arcface_like(args.people, args.samples, args.queries, args.dim)
+    print(f"📚 Gallery: {len(vectors)} embeddings of {args.people} people, {args.queries} queries")
+
+    # Ground truth comes from an exhaustive scan
+    truth_gallery = FaceGallery(dim=args.dim, capacity=len(vectors))
+    truth_gallery.add_many(labels, vectors)
+    _, truth = truth_gallery.index.search(queries, k=args.k)
+
+    backend_options = {
+        "exact": {},
+        "ivf": {"nprobe": args.nprobe},
+        "hnsw": {"ef_search": args.ef_search},
+    }
+
+    results = []
+    for kind in args.backends.split(","):
+        result = run_backend(kind, vectors, labels, queries, truth, args.k, backend_options.get(kind, {}))
+        results.append(result)
+        print(f"   - {kind:6s} build {result['build_seconds']:8.2f}s  "
+              f"recall@1 {result['recall@1']:.3f}  recall@{args.k} {result[f'recall@{args.k}']:.3f}  "
+              f"{result['batch_qps']:10.1f} q/s  p50 {result['latency_p50_ms']:.3f} ms  "
+              f"p99 {result['latency_p99_ms']:.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
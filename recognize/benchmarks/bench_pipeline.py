@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import platform
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from decoding import DecodedImage
+from gallery import FaceGallery
+from storage import FaceStore
+from bench_index import make_arcface_like
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+
+
+def summarize(seconds):
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if not len(ms):
+        return {"count": 0}
+    return {
+        "count": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "min_ms": float(ms.min()),
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def bundled_images(folders):
+    images = []
+    for folder in folders:
+        images.extend(path for path in sorted(Path(folder).rglob('*'))
+                      if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file())
+    return images
+
+
+def print_stage(name, stats):
+    if stats.get("count"):
+        print(f"   - {name:12s} {stats['mean_ms']:9.2f} ms mean  {stats['p50_ms']:9.2f} ms p50  "
+              f"{stats['p95_ms']:9.2f} ms p95  (n={stats['count']})")
+
+
+def bench_stages(recognizer, images, repeat, gallery_size):
+    # Decode, detection, alignment, embedding and matching timed separately
+    # on the same inputs, so a regression can be pinned to one stage
+    from insightface.utils import face_align
+
+    face_app = recognizer.face_app
+    crop_size = face_app.models['recognition'].input_size[0]
+    vectors, labels, _ = make_arcface_like(max(1, gallery_size // 10), 10, 1)
+    recognizer.known_faces = FaceGallery(index=recognizer.search_index, index_options=recognizer.index_options)
+    recognizer.known_faces.add_many([f"person_{label}" for label in labels], vectors)
+
+    timings = {stage: [] for stage in ("decode", "decode_reduced", "detection", "alignment", "embedding", "matching")}
+    faces_seen = 0
+    for _ in range(repeat):
+        for path in images:
+            data = path.read_bytes()
+            image, seconds = timed(cv2.imdecode, np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            timings["decode"].append(seconds)
+            if image is None:
+                continue
+            # What the server does: reduced-resolution decode for large JPEGs
+            _, seconds = timed(DecodedImage.decode, data, recognizer.det_size)
+            timings["decode_reduced"].append(seconds)
+
+            (bboxes, kpss), seconds = timed(face_app.det_model.detect, image, recognizer.det_size, 0, 'default')
+            timings["detection"].append(seconds)
+
+            start = time.perf_counter()
+            crops = [face_align.norm_crop(image, landmark=kps, image_size=crop_size) for kps in kpss]
+            timings["alignment"].append(time.perf_counter() - start)
+            faces_seen += len(crops)
+            if not crops:
+                continue
+
+            embeddings, seconds = timed(recognizer.embed_crops, crops)
+            timings["embedding"].append(seconds)
+            _, seconds = timed(recognizer.find_frame_matches, embeddings)
+            timings["matching"].append(seconds)
+
+    return {"images": len(images), "faces": faces_seen, "gallery_size": recognizer.known_faces.size,
+            **{stage: summarize(seconds) for stage, seconds in timings.items()}}
+
+
+def bench_db_writes(workdir, rows, dim=512):
+    # Autocommit (one transaction per row) against the batch() unit of work
+    vectors = np.random.default_rng(0).standard_normal((rows, dim)).astype(np.float32)
+    store = FaceStore(str(workdir / "bench_writes.db"))
+    store.init_schema()
+
+    single = []
+    for i, vector in enumerate(vectors):
+        _, seconds = timed(store.save_embedding, "bench", vector, f"image_{i}.jpg")
+        single.append(seconds)
+
+    start = time.perf_counter()
+    with store.batch():
+        for i, vector in enumerate(vectors):
+            store.save_embedding("bench", vector, f"image_{i}.jpg")
+    batched = time.perf_counter() - start
+    store.close()
+    return {
+        "rows": rows,
+        "autocommit": summarize(single),
+        "batched_total_ms": batched * 1000,
+        "batched_per_row_ms": batched * 1000 / rows,
+    }
+
+
+def bench_gallery_scaling(sizes, index, queries=200, batch_size=64, dim=512):
+    results = []
+    for size in sizes:
+        vectors, labels, probe = make_arcface_like(max(1, size // 10), 10, queries, dim)
+        gallery = FaceGallery(dim=dim, capacity=len(vectors), index=index)
+        _, build = timed(gallery.add_many, [f"person_{label}" for label in labels], vectors)
+        single = [timed(gallery.search, query)[1] for query in probe]
+        batched = [timed(gallery.search_batch, probe[i:i + batch_size])[1]
+                   for i in range(0, len(probe), batch_size)]
+        result = {"gallery_size": int(len(vectors)), "index": index, "build_seconds": build,
+                  "single_query": summarize(single),
+                  "batch_per_query_ms": float(np.sum(batched) * 1000 / len(probe))}
+        results.append(result)
+        print(f"   - {result['gallery_size']:8d} rows  {result['single_query']['p50_ms']:8.3f} ms p50/query  "
+              f"{result['batch_per_query_ms']:8.3f} ms/query batched")
+    return results
+
+
+def bench_training(workdir, dataset_folder, workers, model_config):
+    from face_recognition_system import IncrementalFaceRecognition
+
+    # Fresh database and no detection cache so every image is processed
+    run_dir = workdir / f"train_{workers}"
+    run_dir.mkdir()
+    recognizer = IncrementalFaceRecognition(dataset_path=str(run_dir / "dataset"), db_path=str(run_dir / "train.db"),
+                                            detection_cache_entries=0, **model_config)
+    start = time.perf_counter()
+    counts = recognizer.train_on_dataset(dataset_folder, headless=True, workers=workers)
+    elapsed = time.perf_counter() - start
+    recognizer.store.close()
+    images = counts['images'] if counts else 0
+    return {"workers": workers, "images": images, "seconds": elapsed,
+            "images_per_second": images / elapsed if elapsed else 0.0, "counts": counts}
+
+
+async def drive_server(app, payloads, requests, concurrency):
+    import httpx
+
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i):
+            filename, data = payloads[i % len(payloads)]
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/recognize", files={"file": (filename, data, "image/jpeg")})
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests)])
+        elapsed = time.perf_counter() - start
+
+    return {"requests": requests, "concurrency": concurrency, "seconds": elapsed,
+            "requests_per_second": requests / elapsed if elapsed else 0.0,
+            "latency": summarize(latencies), "status_codes": {str(k): v for k, v in statuses.items()}}
+
+
+def bench_server(workdir, images, requests, concurrency):
+    # server.py builds its recognizer at import time from the working
+    # directory, so import it from inside a scratch directory
+    server_dir = workdir / "server"
+    server_dir.mkdir()
+    cwd = os.getcwd()
+    os.chdir(server_dir)
+    try:
+        import server
+        payloads = [(path.name, path.read_bytes()) for path in images]
+        cache = server.recognizer.detection_cache
+        limit = cache.max_entries
+
+        cache.max_entries = 0
+        cold = asyncio.run(drive_server(server.app, payloads, requests, concurrency))
+        cache.max_entries = limit
+        asyncio.run(drive_server(server.app, payloads, len(payloads), concurrency))
+        warm = asyncio.run(drive_server(server.app, payloads, requests, concurrency))
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+    return {"uncached": cold, "cached": warm}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage, training and server benchmarks for the pipeline")
+    parser.add_argument("--images", nargs="*", default=[str(ROOT / "dataset"), str(ROOT / "dataset_arcface")],
+                        help="folders of images used for the stage and server runs")
+    parser.add_argument("--train-folder", default=str(ROOT / "dataset_arcface"),
+                        help="labeled folder used for the headless training run")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the images for stage timings")
+    parser.add_argument("--match-gallery-size", type=int, default=10000,
+                        help="synthetic gallery size for the matching stage")
+    parser.add_argument("--gallery-sizes", default="1000,10000,100000")
+    parser.add_argument("--index", default="exact", help="search index for the gallery runs")
+    parser.add_argument("--db-rows", type=int, default=500)
+    parser.add_argument("--train-workers", default="0,2", help="comma-separated worker counts")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--det-size", type=int, default=640)
+    parser.add_argument("--skip", default="", help="comma-separated sections to skip: "
+                                                   "stages,db,gallery,train,server")
+    parser.add_argument("--profile", help="write cProfile stats of the stage run to this path")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    skip = set(filter(None, args.skip.split(",")))
+    images = bundled_images(args.images)
+    model_config = {"det_size": (args.det_size, args.det_size)}
+    results = {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "numpy": np.__version__, "opencv": cv2.__version__},
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="face_bench_"))
+
+    try:
+        if "stages" not in skip:
+            from face_recognition_system import IncrementalFaceRecognition
+            print(f"📸 Stage timings over {len(images)} images x {args.repeat}")
+            recognizer = IncrementalFaceRecognition(dataset_path=str(workdir / "stages_dataset"),
+                                                    db_path=str(workdir / "stages.db"),
+                                                    search_index=args.index, **model_config)
+            profiler = cProfile.Profile() if args.profile else None
+            if profiler:
+                profiler.enable()
+            results["stages"] = bench_stages(recognizer, images, args.repeat, args.match_gallery_size)
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+                pstats.Stats(args.profile).sort_stats("cumulative").print_stats(15)
+            for stage in ("decode", "decode_reduced", "detection", "alignment", "embedding", "matching"):
+                print_stage(stage, results["stages"][stage])
+            recognizer.store.close()
+
+        if "db" not in skip:
+            print(f"💾 DB writes ({args.db_rows} rows)")
+            results["db_writes"] = bench_db_writes(workdir, args.db_rows)
+            print_stage("autocommit", results["db_writes"]["autocommit"])
+            print(f"   - batched      {results['db_writes']['batched_per_row_ms']:9.3f} ms per row")
+
+        if "gallery" not in skip:
+            print(f"🔎 Matching latency vs gallery size ({args.index})")
+            sizes = [int(size) for size in args.gallery_sizes.split(",")]
+            results["gallery_scaling"] = bench_gallery_scaling(sizes, args.index)
+
+        if "train" not in skip:
+            results["training"] = []
+            for workers in (int(w) for w in args.train_workers.split(",")):
+                print(f"📚 Headless training with {workers} worker(s)")
+                run = bench_training(workdir, args.train_folder, workers, model_config)
+                results["training"].append(run)
+                print(f"   - {run['images']} images in {run['seconds']:.2f}s "
+                      f"({run['images_per_second']:.2f} img/s)")
+
+        if "server" not in skip:
+            os.environ.setdefault("FACE_DET_SIZE", str(args.det_size))
+            print(f"🌐 Server: {args.requests} requests, concurrency {args.concurrency}")
+            results["server"] = bench_server(workdir, images, args.requests, args.concurrency)
+            for mode, run in results["server"].items():
+                print(f"   - {mode:9s} {run['requests_per_second']:8.1f} req/s  "
+                      f"p50 {run['latency'].get('p50_ms', 0):.1f} ms  p95 {run['latency'].get('p95_ms', 0):.1f} ms  "
+                      f"status {run['status_codes']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
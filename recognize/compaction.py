@@ -0,0 +1,272 @@
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from gallery import normalize_rows
+from search_index import spherical_kmeans
+
+
+def cluster_identity(vectors, max_prototypes=32, outliers=4, iterations=10, seed=0):
+    # Spherical k-means over one person's samples. Returns the centroids,
+    # each sample's cluster, and the `outliers` samples the centroids cover
+    # worst (profile shots, unusual lighting), which are kept verbatim so
+    # rare appearances are not averaged away.
+    centroids, assignment = spherical_kmeans(vectors, max_prototypes, iterations, seed)
+    coverage = (vectors @ centroids.T).max(axis=1)
+    return centroids, assignment, np.argsort(coverage)[:outliers]
+
+
+def rank1_correct(probes, probe_labels, vectors, labels, threshold, adjust=None, chunk_size=1024):
+    # Per-probe rank-1 identification result against `vectors`. adjust(scores,
+    # start, end) may rewrite a chunk's scores in place, e.g. to hide the
+    # probe's own row for leave-one-out.
+    correct = np.zeros(len(probes), dtype=bool)
+    if len(vectors) == 0:
+        return correct
+    for start in range(0, len(probes), chunk_size):
+        end = min(start + chunk_size, len(probes))
+        scores = probes[start:end] @ vectors.T
+        if adjust is not None:
+            adjust(scores, start, end)
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(end - start), best]
+        correct[start:end] = (labels[best] == probe_labels[start:end]) & (best_scores > threshold)
+    return correct
+
+
+class CompactionPlan:
+    # Raw rows of the gallery plus, for each compacted identity, its
+    # prototypes: centroid sums over member rows (kept unnormalized so a
+    # member's leave-one-out centroid is cheap) and a representative row.
+    def __init__(self, ids, people, labels, vectors):
+        self.ids = ids
+        self.people = people
+        self.labels = labels
+        self.vectors = vectors
+        self.keep = np.ones(len(ids), dtype=bool)
+        self.member_of = np.full(len(ids), -1, dtype=np.int64)
+        self.prototype_sums = []
+        self.prototype_labels = []
+        self.prototype_rows = []
+
+    def add_identity(self, rows, centroids, assignment, outliers):
+        self.keep[rows] = False
+        self.keep[rows[outliers]] = True
+        for cluster in range(len(centroids)):
+            members = rows[assignment == cluster]
+            if not members.size:
+                continue
+            self.member_of[members] = len(self.prototype_sums)
+            self.prototype_sums.append(self.vectors[members].sum(axis=0))
+            self.prototype_labels.append(int(self.labels[members[0]]))
+            self.prototype_rows.append(int(members[np.argmax(self.vectors[members] @ centroids[cluster])]))
+
+    def drop_identities(self, labels):
+        # Back to the raw rows for these identities
+        dropped = np.isin(self.prototype_labels, list(labels))
+        # member_of == -1 picks the trailing -1
+        remap = np.full(len(dropped) + 1, -1, dtype=np.int64)
+        remap[np.flatnonzero(~dropped)] = np.arange(int((~dropped).sum()))
+        self.member_of = remap[self.member_of]
+        self.prototype_sums = [s for s, d in zip(self.prototype_sums, dropped) if not d]
+        self.prototype_labels = [l for l, d in zip(self.prototype_labels, dropped) if not d]
+        self.prototype_rows = [r for r, d in zip(self.prototype_rows, dropped) if not d]
+        self.keep[np.isin(self.labels, list(labels))] = True
+
+    @property
+    def compacted_labels(self):
+        return sorted(set(self.prototype_labels))
+
+    @property
+    def prototypes(self):
+        if not self.prototype_sums:
+            return np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+        return normalize_rows(np.stack(self.prototype_sums))
+
+    @property
+    def rows_after(self):
+        return int(self.keep.sum()) + len(self.prototype_sums)
+
+
+class GalleryCompactor:
+    # Bounds per-identity gallery growth. On insert, is_redundant() lets the
+    # recognizer skip samples that are already well represented; compact()
+    # is the offline pass that replaces an over-grown identity's rows with
+    # k-means centroids plus a few outlier samples.
+    #
+    # A compaction is only applied if rank-1 identification accuracy over a
+    # sample of stored faces does not drop compared to the raw gallery, both
+    # measured leave-one-out. Identities whose own accuracy drops are left
+    # uncompacted.
+    def __init__(self, store, max_prototypes=32, outliers=4, redundancy_threshold=0.92,
+                 similarity_threshold=0.6, max_probes=5000, seed=0):
+        self.store = store
+        self.max_prototypes = max_prototypes
+        self.outliers = outliers
+        self.redundancy_threshold = redundancy_threshold
+        self.similarity_threshold = similarity_threshold
+        self.max_probes = max_probes
+        self.seed = seed
+
+    @property
+    def max_samples(self):
+        return self.max_prototypes + self.outliers
+
+    def is_redundant(self, gallery, name, embedding):
+        if self.redundancy_threshold is None or name not in gallery:
+            return False
+        samples = gallery.embeddings_for(name)
+        return float((samples @ normalize_rows(embedding)[0]).max()) >= self.redundancy_threshold
+
+    def needs_compaction(self, gallery, name):
+        # Leave headroom so an identity is not re-clustered on every insert
+        return gallery.count(name) > 2 * self.max_samples
+
+    def plan(self, rows, names=None):
+        # rows are (id, person_name, blob) from the store
+        ids = np.array([row_id for row_id, _, _ in rows], dtype=np.int64)
+        people = sorted({person_name for _, person_name, _ in rows})
+        label_of = {name: i for i, name in enumerate(people)}
+        labels = np.array([label_of[person_name] for _, person_name, _ in rows], dtype=np.int64)
+        vectors = normalize_rows(np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows]))
+        plan = CompactionPlan(ids, people, labels, vectors)
+
+        members = defaultdict(list)
+        for index, label in enumerate(labels):
+            members[label].append(index)
+        for name, label in label_of.items():
+            if names is not None and name not in names:
+                continue
+            person_rows = np.asarray(members[label])
+            if len(person_rows) <= self.max_samples:
+                continue
+            centroids, assignment, outliers = cluster_identity(
+                vectors[person_rows], self.max_prototypes, self.outliers, seed=self.seed)
+            plan.add_identity(person_rows, centroids, assignment, outliers)
+        return plan
+
+    def evaluate(self, plan):
+        # Rank-1 accuracy of the raw and the compacted gallery on the same
+        # probes, per probe, so regressions can be attributed to identities
+        rng = np.random.default_rng(self.seed)
+        probe_rows = np.arange(len(plan.vectors))
+        if len(probe_rows) > self.max_probes:
+            probe_rows = np.sort(rng.choice(probe_rows, self.max_probes, replace=False))
+        probes = plan.vectors[probe_rows]
+        probe_labels = plan.labels[probe_rows]
+
+        def hide_own_row(positions):
+            def adjust(scores, start, end):
+                rows = positions[probe_rows[start:end]]
+                own = np.flatnonzero(rows >= 0)
+                scores[own, rows[own]] = -np.inf
+            return adjust
+
+        raw = rank1_correct(probes, probe_labels, plan.vectors, plan.labels, self.similarity_threshold,
+                            hide_own_row(np.arange(len(plan.vectors))))
+
+        kept_rows = np.flatnonzero(plan.keep)
+        positions = np.full(len(plan.vectors), -1, dtype=np.int64)
+        positions[kept_rows] = np.arange(len(kept_rows))
+        sums = np.stack(plan.prototype_sums) if plan.prototype_sums else np.empty((0, probes.shape[1]))
+        hide_kept = hide_own_row(positions)
+
+        def adjust(scores, start, end):
+            hide_kept(scores, start, end)
+            # A probe scores against its own centroid with itself left out
+            rows = probe_rows[start:end]
+            member = np.flatnonzero(plan.member_of[rows] >= 0)
+            prototype = plan.member_of[rows[member]]
+            rest = sums[prototype] - plan.vectors[rows[member]]
+            norms = np.linalg.norm(rest, axis=1)
+            loo = np.where(norms > 1e-6,
+                           np.einsum('ij,ij->i', plan.vectors[rows[member]], rest) / np.maximum(norms, 1e-6),
+                           -np.inf)
+            scores[member, len(kept_rows) + prototype] = loo
+
+        vectors = np.concatenate([plan.vectors[kept_rows], plan.prototypes])
+        labels = np.concatenate([plan.labels[kept_rows], np.asarray(plan.prototype_labels, dtype=np.int64)])
+        compacted = rank1_correct(probes, probe_labels, vectors, labels, self.similarity_threshold, adjust)
+        return probe_labels, raw, compacted
+
+    def compact(self, names=None, dry_run=False, max_rounds=3):
+        rows = self.store.load_embeddings()
+        report = {'rows_before': len(rows), 'rows_after': len(rows), 'removed': 0, 'prototypes': 0,
+                  'raw_accuracy': None, 'compacted_accuracy': None, 'skipped_identities': [], 'applied': False}
+        if not rows:
+            return report
+
+        plan = self.plan(rows, names)
+        skipped = set()
+        for _ in range(max_rounds):
+            if not plan.prototype_sums:
+                break
+            probe_labels, raw, compacted = self.evaluate(plan)
+            report['raw_accuracy'] = float(raw.mean())
+            report['compacted_accuracy'] = float(compacted.mean())
+            regressed = {label for label in plan.compacted_labels
+                         if compacted[probe_labels == label].sum() < raw[probe_labels == label].sum()}
+            if not regressed and compacted.sum() >= raw.sum():
+                break
+            # Restore the identities that got worse and check again
+            regressed = regressed or set(plan.compacted_labels)
+            skipped.update(plan.people[label] for label in regressed)
+            plan.drop_identities(regressed)
+        else:
+            skipped.update(plan.people[label] for label in plan.compacted_labels)
+            plan.drop_identities(set(plan.compacted_labels))
+
+        if not plan.prototype_sums and report['raw_accuracy'] is not None:
+            report['compacted_accuracy'] = report['raw_accuracy']
+
+        removed = plan.ids[~plan.keep]
+        report['skipped_identities'] = sorted(skipped)
+        report['removed'] = int(len(removed))
+        report['prototypes'] = len(plan.prototype_sums)
+        report['rows_after'] = plan.rows_after
+        if len(removed) and not dry_run:
+            # Each prototype row points at the image of its most central member
+            paths = self.store.embedding_paths(plan.ids[plan.prototype_rows].tolist())
+            new_rows = []
+            for index, (prototype, label, row) in enumerate(zip(plan.prototypes, plan.prototype_labels,
+                                                                plan.prototype_rows)):
+                members = plan.vectors[plan.member_of == index]
+                new_rows.append((plan.people[label], prototype, paths.get(int(plan.ids[row])),
+                                 float((members @ prototype).mean())))
+            self.store.replace_embeddings(removed.tolist(), new_rows)
+            report['applied'] = True
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact each person's stored embeddings into prototypes")
+    parser.add_argument("--db-path", default="face_embeddings.db")
+    parser.add_argument("--max-prototypes", type=int, default=32, help="k-means prototypes kept per person")
+    parser.add_argument("--outliers", type=int, default=4, help="poorly covered samples kept as-is per person")
+    parser.add_argument("--similarity-threshold", type=float, default=0.6,
+                        help="match threshold used when checking accuracy")
+    parser.add_argument("--person", action="append", help="only compact this person (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="report without changing the database")
+    args = parser.parse_args()
+
+    from storage import FaceStore
+    store = FaceStore(args.db_path)
+    store.init_schema()
+    compactor = GalleryCompactor(store, max_prototypes=args.max_prototypes, outliers=args.outliers,
+                                 similarity_threshold=args.similarity_threshold)
+    report = compactor.compact(names=set(args.person) if args.person else None, dry_run=args.dry_run)
+
+    print(f"📊 {report['rows_before']} -> {report['rows_after']} embeddings "
+          f"({report['removed']} samples {'would be ' if args.dry_run else ''}replaced by "
+          f"{report['prototypes']} prototypes)")
+    if report['raw_accuracy'] is not None:
+        print(f"   - Rank-1 accuracy: raw {report['raw_accuracy']:.4f}, "
+              f"compacted {report['compacted_accuracy']:.4f}")
+    if report['skipped_identities']:
+        print(f"   - Left uncompacted to preserve accuracy: {', '.join(report['skipped_identities'])}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
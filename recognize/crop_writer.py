@@ -0,0 +1,233 @@
+import atexit
+import os
+import queue
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from detection_cache import content_hash
+from metrics import REGISTRY
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, pack access is unguarded
+    fcntl = None
+
+CROPS_WRITTEN = REGISTRY.counter("face_crops_written_total", "Face crops persisted by the crop writer")
+CROP_WRITE_ERRORS = REGISTRY.counter("face_crop_write_errors_total", "Face crops the crop writer failed to persist")
+
+PACK_NAME = "faces.pack"
+
+# Pack records: 16-byte digest, name length, JPEG length, then the UTF-8
+# name ("<person>/<image name>") and the JPEG bytes
+PACK_RECORD = struct.Struct(">16sHI")
+
+
+def split_reference(reference):
+    # (file path, digest) of a stored crop; digest is None for plain files
+    path, _, digest = str(reference).partition("#")
+    return Path(path), digest or None
+
+
+@contextmanager
+def locked_pack(pack_path, mode="rb"):
+    # The open pack under an advisory lock: exclusive for the writer's
+    # appends, shared for readers, so a reader never sees half a record.
+    # Buffered appends reach the file before the lock is released.
+    with open(pack_path, mode) as pack:
+        if fcntl is not None:
+            fcntl.flock(pack.fileno(), fcntl.LOCK_SH if mode == "rb" else fcntl.LOCK_EX)
+        try:
+            yield pack
+        finally:
+            if mode != "rb":
+                pack.flush()
+            if fcntl is not None:
+                fcntl.flock(pack.fileno(), fcntl.LOCK_UN)
+
+
+def scan_pack(pack, start=0):
+    # ({digest: (offset, length)} of the JPEGs, end of the last complete
+    # record) from `start` on. Only headers are read; payloads are skipped.
+    # A record cut short by a crash mid-append ends the scan.
+    size = os.fstat(pack.fileno()).st_size
+    index = {}
+    offset = start
+    while offset + PACK_RECORD.size <= size:
+        pack.seek(offset)
+        digest, name_length, data_length = PACK_RECORD.unpack(pack.read(PACK_RECORD.size))
+        data_offset = offset + PACK_RECORD.size + name_length
+        if data_offset + data_length > size:
+            break
+        index[digest.hex()] = (data_offset, data_length)
+        offset = data_offset + data_length
+    return index, offset
+
+
+_pack_indexes = {}
+_pack_indexes_lock = threading.Lock()
+
+
+def load_crop(reference):
+    # Encoded JPEG bytes of a crop returned by CropWriter.save(). Pack
+    # indexes are kept per pack and extended with records appended since.
+    path, digest = split_reference(reference)
+    if digest is None:
+        return path.read_bytes()
+    with locked_pack(path) as pack, _pack_indexes_lock:
+        known = _pack_indexes.setdefault(str(path.resolve()), [{}, 0])
+        index = known[0]
+        if digest not in index and os.fstat(pack.fileno()).st_size > known[1]:
+            appended, known[1] = scan_pack(pack, known[1])
+            index.update(appended)
+        if digest not in index:
+            raise FileNotFoundError(f"{digest} not found in {path}")
+        offset, length = index[digest]
+        pack.seek(offset)
+        return pack.read(length)
+
+
+class CropWriter:
+    # Persists face crops on a background thread so enrollment never waits
+    # on JPEG encoding or disk. Crops are named by a hash of their pixels,
+    # which cannot collide the way second-resolution timestamps did, and
+    # writing the same crop twice is a no-op. save() returns the final path
+    # immediately; the bounded queue makes it block instead of buffering
+    # without limit when the disk falls behind.
+    #
+    # With pack=True crops are appended to one pack file in dataset_path
+    # instead of one file each, and referenced as "<pack>#<digest>".
+    #
+    # flush() returns once everything queued is on disk; close() (also run
+    # at interpreter exit) flushes and stops the thread, so the paths stored
+    # in the database point at files that exist.
+    def __init__(self, dataset_path, max_queue=256, pack=False, quality=95, batch_size=32):
+        self.dataset_path = Path(dataset_path)
+        self.pack = pack
+        self.quality = quality
+        self.batch_size = batch_size
+        self.pack_path = self.dataset_path / PACK_NAME
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._packed = set()
+        if pack and self.pack_path.exists():
+            with locked_pack(self.pack_path, "r+b") as pack_file:
+                index, end = scan_pack(pack_file)
+                # Drop a record cut short by a crash, or appends would land
+                # behind it where no scan reaches them
+                pack_file.truncate(end)
+            self._packed = set(index)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="crop-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def save(self, face_img, person_name, image_name):
+        if self._closed:
+            raise RuntimeError("CropWriter is closed")
+        face_img = np.ascontiguousarray(face_img)
+        digest = content_hash(str(face_img.shape).encode() + face_img.tobytes())
+        if self.pack:
+            reference = f"{self.pack_path}#{digest}"
+        else:
+            reference = self.dataset_path / person_name / f"{image_name}_{digest[:16]}.jpg"
+        self._queue.put((reference, digest, f"{person_name}/{image_name}", face_img))
+        return reference
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Whatever else is already waiting goes out in the same batch
+            while len(items) < self.batch_size and items[-1] is not None:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = items[-1] is None
+            crops = items[:-1] if stop else items
+            try:
+                if crops:
+                    self._write(crops)
+            except Exception as e:
+                # Keep the thread alive: a dead writer would block save() forever
+                CROP_WRITE_ERRORS.inc(len(crops))
+                print(f"❌ Crop writer failed: {str(e)}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _encode(self, face_img):
+        try:
+            ok, encoded = cv2.imencode(".jpg", face_img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        except cv2.error:
+            return None
+        return encoded.tobytes() if ok else None
+
+    def _write(self, crops):
+        if self.pack:
+            self._append_to_pack(crops)
+            return
+        for path, _, _, face_img in crops:
+            try:
+                if path.exists():
+                    continue
+                data = self._encode(face_img)
+                if data is None:
+                    raise ValueError("JPEG encoding failed")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Written under a temporary name first: a crash never leaves
+                # a truncated file under the final name
+                partial = path.with_name(path.name + ".part")
+                partial.write_bytes(data)
+                os.replace(partial, path)
+                CROPS_WRITTEN.inc()
+            except (OSError, ValueError) as e:
+                CROP_WRITE_ERRORS.inc()
+                print(f"❌ Could not save face crop {path}: {str(e)}")
+
+    def _append_to_pack(self, crops):
+        records = []
+        digests = set()
+        for _, digest, name, face_img in crops:
+            if digest in self._packed or digest in digests:
+                continue
+            data = self._encode(face_img)
+            if data is None:
+                CROP_WRITE_ERRORS.inc()
+                print(f"❌ Could not encode face crop {name}")
+                continue
+            name = name.encode("utf-8")
+            records.append(PACK_RECORD.pack(bytes.fromhex(digest), len(name), len(data)) + name + data)
+            digests.add(digest)
+        if not records:
+            return
+        try:
+            self.pack_path.parent.mkdir(parents=True, exist_ok=True)
+            # One append and one flush per batch
+            with locked_pack(self.pack_path, "ab") as pack:
+                pack.write(b"".join(records))
+            self._packed |= digests
+            CROPS_WRITTEN.inc(len(records))
+        except OSError as e:
+            CROP_WRITE_ERRORS.inc(len(records))
+            print(f"❌ Could not append {len(records)} face crops to {self.pack_path}: {str(e)}")
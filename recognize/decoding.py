@@ -0,0 +1,56 @@
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def jpeg_size(data):
+    # (width, height) from the JPEG header alone, None for other formats
+    try:
+        with Image.open(BytesIO(data)) as header:
+            return header.size if header.format == "JPEG" else None
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class DecodedImage:
+    # An encoded image decoded for detection. Large JPEGs are decoded at
+    # 1/2, 1/4 or 1/8 resolution by libjpeg itself (IMREAD_REDUCED_*), as
+    # long as the result is still at least as large as what the detector
+    # resizes to; `scale` maps coordinates in `image` back to the original,
+    # which is only decoded if original() is called.
+    def __init__(self, data, image, scale=1.0):
+        self.data = data
+        self.image = image
+        self.scale = scale
+        self._original = image if scale == 1.0 else None
+
+    @classmethod
+    def decode(cls, data, det_size=None):
+        buffer = np.frombuffer(data, np.uint8)
+        size = jpeg_size(data) if det_size else None
+        if size is not None:
+            # Detection fits the image inside det_size, so any reduction up
+            # to that fit loses nothing the detector would have seen
+            limit = max(size[0] / det_size[0], size[1] / det_size[1])
+            factor = max((f for f in REDUCED_FLAGS if f <= limit), default=None)
+            if factor is not None:
+                image = cv2.imdecode(buffer, REDUCED_FLAGS[factor])
+                if image is not None:
+                    # From the decoded size, which already includes any EXIF rotation
+                    return cls(data, image, max(size) / max(image.shape[:2]))
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        return None if image is None else cls(data, image)
+
+    @property
+    def reduced(self):
+        return self.scale != 1.0
+
+    def original(self):
+        if self._original is None:
+            self._original = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        return self._original
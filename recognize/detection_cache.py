@@ -0,0 +1,94 @@
+import hashlib
+import pickle
+import time
+
+import numpy as np
+
+from metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("face_detection_cache_hits_total", "Detection cache lookups served from the cache")
+CACHE_MISSES = REGISTRY.counter("face_detection_cache_misses_total", "Detection cache lookups that missed")
+
+
+def content_hash(data):
+    # blake2b runs at memory speed and is in the standard library
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def read_image_bytes(image_path):
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+class DetectionCache:
+    # Content-addressed cache of detections and embeddings, keyed by a hash
+    # of the encoded image bytes plus the detection settings that produced
+    # them. Entries live in the detection_cache table so every process
+    # sharing the database shares the cache; the least recently used
+    # entries are evicted once max_entries or max_bytes is exceeded.
+    #
+    # Only detections are cached: matching against the gallery always runs
+    # fresh, so cached images pick up newly enrolled people.
+    CACHED_KEYS = ('aligned', 'face_img')
+
+    def __init__(self, store, max_entries=100000, max_bytes=512 * 1024 * 1024,
+                 touch_interval=60.0, evict_every=64):
+        self.store = store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, content_hash, config):
+        if not self.enabled:
+            return None
+        row = self.store.cached_detection(content_hash, config)
+        if row is None:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        faces_blob, last_used = row
+        now = time.time()
+        # Recency only needs to be roughly right; skip most of the writes
+        if now - last_used > self.touch_interval:
+            self.store.touch_cached_detection(content_hash, config, now)
+        self.hits += 1
+        CACHE_HITS.inc()
+        return pickle.loads(faces_blob)
+
+    def contains(self, content_hash, config):
+        return self.enabled and self.store.has_cached_detection(content_hash, config)
+
+    def put(self, content_hash, config, faces):
+        if not self.enabled:
+            return
+        entries = [{key: value for key, value in face_data.items() if key not in self.CACHED_KEYS}
+                   for face_data in faces]
+        for face_data in entries:
+            face_data['embedding'] = np.asarray(face_data['embedding'], dtype=np.float32)
+        self.store.cache_detection(content_hash, config, pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL),
+                                   time.time())
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        return self.store.evict_detections(self.max_entries, self.max_bytes)
+
+    def stats(self):
+        entries, size_bytes = self.store.detection_cache_usage()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_bytes": size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
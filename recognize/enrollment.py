@@ -0,0 +1,280 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from detection_cache import content_hash, read_image_bytes
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+
+_worker = None
+
+
+def collect_images(dataset_folder, manifest=None):
+    # (path, label) pairs. A CSV manifest has `path,label` rows (paths
+    # relative to the manifest); otherwise images inside a sub-folder are
+    # labeled with the folder name and top-level images are unlabeled.
+    dataset_folder = Path(dataset_folder)
+    if manifest:
+        manifest = Path(manifest)
+        entries = []
+        with open(manifest, newline='') as f:
+            for row in csv.reader(f):
+                if not row or row[0].strip().lower() == 'path':
+                    continue
+                label = row[1].strip() if len(row) > 1 and row[1].strip() else None
+                path = Path(row[0].strip())
+                entries.append((path if path.is_absolute() else manifest.parent / path, label))
+        return entries
+
+    entries = []
+    for path in sorted(dataset_folder.rglob('*')):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or not path.is_file():
+            continue
+        relative = path.relative_to(dataset_folder)
+        label = relative.parts[0] if len(relative.parts) > 1 else None
+        entries.append((path, label))
+    return entries
+
+
+def _init_worker(model_config):
+    global _worker
+    from face_recognition_system import IncrementalFaceRecognition
+    _worker = IncrementalFaceRecognition.for_inference(**model_config)
+    _worker.warm_up()
+
+
+def _detect(recognizer, path):
+    faces, image = recognizer.detect_faces(str(path))
+    if image is None:
+        return {'path': str(path), 'error': 'Could not load image'}
+    return {
+        'path': str(path),
+        'faces': [{
+            'bbox': face_data['bbox'],
+            'embedding': face_data['embedding'],
+            'confidence': float(face_data['confidence']),
+            'face_img': face_data['face_img'].copy(),
+        } for face_data in faces]
+    }
+
+
+def _detect_in_worker(path):
+    return _detect(_worker, path)
+
+
+class BulkEnroller:
+    # Headless, resumable enrollment: decoding, detection and embedding run
+    # across a process pool, results are applied in input order, and DB
+    # writes are committed every `commit_every` images. Unlabeled faces
+    # that are not confident matches go to the review_queue table instead
+    # of prompting (resolved with review.py).
+    #
+    # At most `max_pending` images are in flight at once, so memory stays
+    # bounded however large the dataset is.
+    def __init__(self, recognizer, workers=None, commit_every=32, progress_every=10, max_pending=None):
+        if commit_every < 1:
+            raise ValueError("commit_every must be at least 1")
+        self.recognizer = recognizer
+        self.workers = os.cpu_count() if workers is None else workers
+        self.commit_every = commit_every
+        self.max_pending = max_pending or max(1, self.workers) * 4
+        self.progress_every = progress_every
+        self.counts = {'images': 0, 'enrolled': 0, 'auto_confirmed': 0, 'review': 0, 'no_face': 0, 'errors': 0,
+                       'duplicates': 0, 'cached': 0, 'skipped_redundant': 0}
+
+    def run(self, dataset_folder, manifest=None):
+        entries = collect_images(dataset_folder, manifest)
+        # Images are identified by content: copies and renamed files of an
+        # already processed image are skipped, as are repeats within this run
+        pending = []
+        seen = set()
+        for path, label in entries:
+            try:
+                image_hash = content_hash(read_image_bytes(path))
+            except OSError:
+                image_hash = None
+            if image_hash is not None and image_hash in seen:
+                self.counts['duplicates'] += 1
+                continue
+            if not self.recognizer.is_image_processed(path, image_hash):
+                seen.add(image_hash)
+                pending.append((str(path), label, image_hash))
+        if not pending:
+            print("✅ All images have already been processed!")
+            return self.counts
+
+        print(f"📚 Bulk enrolling {len(pending)} images "
+              f"(skipping {len(entries) - len(pending)} already processed or duplicate) "
+              f"with {self.workers} worker(s)")
+
+        start_time = time.perf_counter()
+        labels = {path: (label, image_hash) for path, label, image_hash in pending}
+
+        if self.workers > 0:
+            executor = ProcessPoolExecutor(max_workers=self.workers,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_worker,
+                                           initargs=(self.recognizer.model_config(),))
+        else:
+            executor = None
+        results = self._results(pending, executor)
+
+        try:
+            while True:
+                # One transaction per `commit_every` images
+                with self.recognizer.store.batch():
+                    for _ in range(self.commit_every):
+                        result = next(results, None)
+                        if result is None:
+                            break
+                        self._apply(result, *labels[result['path']])
+                        self.counts['images'] += 1
+                        if self.counts['images'] % self.progress_every == 0:
+                            self._report_progress(len(pending), start_time)
+                if result is None:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        self._report_progress(len(pending), start_time)
+        if self.recognizer.pending_compaction:
+            self.recognizer.compact_gallery(sorted(self.recognizer.pending_compaction))
+        if self.counts['images']:
+            self.recognizer.save_snapshot()
+        return self.counts
+
+    def _results(self, pending, executor):
+        # Detection results in input order. Images already in the detection
+        # cache are served in-process; only the rest go to the worker pool,
+        # and their results are cached here since workers have no database.
+        recognizer = self.recognizer
+        cache = recognizer.detection_cache
+        if executor is None:
+            for path, _, _ in pending:
+                hits = cache.hits
+                try:
+                    result = _detect(recognizer, path)
+                except Exception as e:
+                    result = {'path': path, 'error': str(e), 'retry': True}
+                self.counts['cached'] += cache.hits - hits
+                yield result
+            return
+
+        # A sliding window of submitted images instead of submitting them all
+        config = recognizer.detection_config()
+        window = deque()
+        for path, _, image_hash in pending:
+            if image_hash is not None and cache.contains(image_hash, config):
+                window.append((path, image_hash, None))
+            else:
+                window.append((path, image_hash, executor.submit(_detect_in_worker, path)))
+            while len(window) >= self.max_pending:
+                yield self._collect(*window.popleft(), config)
+        while window:
+            yield self._collect(*window.popleft(), config)
+
+    def _collect(self, path, image_hash, future, config):
+        cache = self.recognizer.detection_cache
+        try:
+            if future is None:
+                self.counts['cached'] += 1
+                return _detect(self.recognizer, path)
+            result = future.result()
+        except Exception as e:
+            # A crashed or failing worker costs this image, not the run; the
+            # image is left unprocessed so the next run retries it
+            return {'path': path, 'error': f"{type(e).__name__}: {e}", 'retry': True}
+        if 'error' not in result and image_hash is not None:
+            cache.put(image_hash, config, result['faces'])
+        return result
+
+    def _report_progress(self, total, start_time):
+        elapsed = time.perf_counter() - start_time
+        rate = self.counts['images'] / elapsed if elapsed > 0 else 0.0
+        print(f"📊 {self.counts['images']}/{total} images ({rate:.1f} img/s) - "
+              f"enrolled {self.counts['enrolled']}, auto-confirmed {self.counts['auto_confirmed']}, "
+              f"already represented {self.counts['skipped_redundant']}, "
+              f"queued for review {self.counts['review']}, no face {self.counts['no_face']}, "
+              f"errors {self.counts['errors']}, served from cache {self.counts['cached']}")
+
+    def _apply(self, result, label, image_hash):
+        recognizer = self.recognizer
+        image_path = result['path']
+        image_name = Path(image_path).stem
+
+        if 'error' in result:
+            print(f"❌ Error processing {image_path}: {result['error']}")
+            self.counts['errors'] += 1
+            recognizer.log_training_action(image_path, label, "ERROR", 0.0)
+            if image_hash is not None and not result.get('retry'):
+                recognizer.mark_image_processed(image_path, image_hash)
+            return
+
+        faces = result['faces']
+        if not faces:
+            self.counts['no_face'] += 1
+            recognizer.log_training_action(image_path, label, "NO_FACE", 0.0)
+        elif label is not None:
+            # A labeled enrollment photo: keep its most prominent face
+            face_data = max(faces, key=lambda f: (f['bbox'][2] - f['bbox'][0]) * (f['bbox'][3] - f['bbox'][1]))
+            if recognizer.record_face(image_path, label, face_data['embedding'], face_data['face_img'],
+                                      f"{image_name}_face1", "BULK_ENROLLED"):
+                self.counts['enrolled'] += 1
+            else:
+                self.counts['skipped_redundant'] += 1
+        else:
+            matches = recognizer.find_frame_matches([face_data['embedding'] for face_data in faces])
+            for i, (face_data, (best_match, similarity)) in enumerate(zip(faces, matches)):
+                if best_match is not None and similarity > recognizer.confidence_threshold:
+                    if recognizer.record_face(image_path, best_match, face_data['embedding'], face_data['face_img'],
+                                              f"{image_name}_face{i+1}", "AUTO_CONFIRMED", similarity):
+                        self.counts['auto_confirmed'] += 1
+                    else:
+                        self.counts['skipped_redundant'] += 1
+                else:
+                    reason = "UNCERTAIN" if similarity > recognizer.similarity_threshold else "UNKNOWN"
+                    face_path = recognizer.save_face_to_dataset(face_data['face_img'], "unknown",
+                                                                f"{image_name}_face{i+1}")
+                    recognizer.store.queue_review(image_path, face_path, face_data['embedding'],
+                                                  best_match, similarity, reason)
+                    self.counts['review'] += 1
+
+        recognizer.mark_image_processed(image_path, image_hash)
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bulk enrollment into the face database")
+    parser.add_argument("dataset_folder", help="folder of images; sub-folder names are used as labels")
+    parser.add_argument("--manifest", help="CSV of path,label rows to use instead of folder names")
+    parser.add_argument("--workers", type=int, default=None, help="detection processes (0 = in-process)")
+    parser.add_argument("--commit-every", type=positive_int, default=32, help="images per DB transaction")
+    parser.add_argument("--db-path", default="face_embeddings.db")
+    parser.add_argument("--dataset-path", default="dataset_arcface")
+    parser.add_argument("--crop-pack", action="store_true",
+                        help="append face crops to one pack file instead of one JPEG per face")
+    args = parser.parse_args()
+
+    from face_recognition_system import IncrementalFaceRecognition
+    recognizer = IncrementalFaceRecognition(dataset_path=args.dataset_path, db_path=args.db_path,
+                                            crop_pack=args.crop_pack)
+    recognizer.train_on_dataset(args.dataset_folder, headless=True, manifest=args.manifest,
+                                workers=args.workers, commit_every=args.commit_every)
+    recognizer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,31 +3,101 @@ import numpy as np
 import os
 import pickle
 import json
+import time
+import threading
+import socket
+from collections import Counter
 from datetime import datetime
-import insightface
-from insightface.app import FaceAnalysis
-import sqlite3
-from sklearn.metrics.pairwise import cosine_similarity
 from pathlib import Path
 import shutil
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-import matplotlib.patches as patches
+from gallery import FaceGallery, normalize_rows
+from assignment import ASSIGNMENT_METHODS
+from storage import FaceStore
+from snapshot import EmbeddingSnapshot
+from tracking import FaceTracker
+from video_pipeline import VideoPipeline
+from enrollment import BulkEnroller
+from detection_cache import DetectionCache, content_hash, read_image_bytes
+from decoding import DecodedImage
+from compaction import GalleryCompactor
+from crop_writer import CropWriter
+from metrics import REGISTRY, LATENCY_BUCKETS
+
+FACE_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50)
+
+DETECTION_LATENCY = REGISTRY.histogram("face_detection_ms", LATENCY_BUCKETS, "Face detector time per image")
+ALIGNMENT_LATENCY = REGISTRY.histogram("face_alignment_ms", LATENCY_BUCKETS, "Crop alignment time per image")
+EMBEDDING_LATENCY = REGISTRY.histogram("face_embedding_ms", LATENCY_BUCKETS, "Recognition model time per batch of crops")
+MATCHING_LATENCY = REGISTRY.histogram("face_matching_ms", LATENCY_BUCKETS, "Gallery search time per batch of faces")
+FACES_PER_IMAGE = REGISTRY.histogram("face_faces_per_image", FACE_COUNT_BUCKETS, "Faces kept per detected image")
+IMAGES_DETECTED = REGISTRY.counter("face_images_detected_total", "Images run through the face detector")
+FACES_EMBEDDED = REGISTRY.counter("face_embeddings_computed_total", "Face crops run through the recognition model")
+
+def crop_face(image, bbox):
+    x1, y1, x2, y2 = bbox
+    return image[max(y1, 0):y2, max(x1, 0):x2]
+
 
 class IncrementalFaceRecognition:
     def __init__(self, dataset_path="dataset_arcface", db_path="face_embeddings.db", 
-                similarity_threshold=0.6, confidence_threshold=0.8):
+                similarity_threshold=0.6, confidence_threshold=0.8, search_index="exact",
+                index_options=None, snapshot_dir=None, snapshot_min_rows=1000, model_name='buffalo_l',
+                providers=None, modules=('detection', 'recognition'), det_size=(640, 640), min_face_size=0,
+                detection_cache_entries=100000, detection_cache_bytes=512 * 1024 * 1024,
+                max_prototypes=32, prototype_outliers=4, redundancy_threshold=0.92, warm_up=False,
+                embedding_precision="float32", rerank_candidates=32, identity_aggregate="max",
+                identity_top_m=3, identity_shortlist=16, crop_queue=256, crop_pack=False,
+                frame_assignment="hungarian", assignment_shortlist=32):
         self.dataset_path = Path(dataset_path)
         self.db_path = db_path
         self.similarity_threshold = similarity_threshold
         self.confidence_threshold = confidence_threshold
+        self.search_index = search_index
+        self.index_options = index_options or {}
+        # float16/int8 shrink the rows the exact search scans; the float32
+        # rows are kept for re-ranking (see quantization.py)
+        self.embedding_precision = embedding_precision
+        self.rerank_candidates = rerank_candidates
+        # Defaults for find_top_identities()
+        self.identity_aggregate = identity_aggregate
+        self.identity_top_m = identity_top_m
+        self.identity_shortlist = identity_shortlist
+        # How faces in one frame share out identities: "hungarian"
+        # (greedy without scipy), "greedy", or "none" to match each face on
+        # its own (see find_frame_matches)
+        if frame_assignment not in ASSIGNMENT_METHODS:
+            raise ValueError(f"Unknown frame assignment '{frame_assignment}', "
+                             f"expected one of {list(ASSIGNMENT_METHODS)}")
+        self.frame_assignment = frame_assignment
+        self.assignment_shortlist = assignment_shortlist
+        self.snapshot = EmbeddingSnapshot(snapshot_dir or Path(db_path).with_suffix(".snapshot"),
+                                          precision=embedding_precision)
+        self.snapshot_min_rows = snapshot_min_rows
+        self.embeddings_watermark = 0
+        self.embeddings_generation = 0
+        self.snapshot_version = None
+        # Guards known_faces against a concurrent refresh_gallery()
+        self.gallery_lock = threading.RLock()
+        # Rows this process added itself since the last reload, so
+        # refresh_gallery() does not add them a second time when it reads
+        # them back
+        self._local_rows = Counter()
+        self.detection_cache_entries = detection_cache_entries
+        self.detection_cache_bytes = detection_cache_bytes
+        self.max_prototypes = max_prototypes
+        self.prototype_outliers = prototype_outliers
+        self.redundancy_threshold = redundancy_threshold
+        self.pending_compaction = set()
+        self._configure_models(model_name, providers, modules, det_size, min_face_size)
         
         self.dataset_path.mkdir(exist_ok=True)
         (self.dataset_path / "unknown").mkdir(exist_ok=True)
+        # Face crops are encoded and written in the background (see crop_writer.py)
+        self.crop_writer = CropWriter(self.dataset_path, max_queue=crop_queue, pack=crop_pack)
         
-        print("Loading ArcFace model...")
-        self.face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-        self.face_app.prepare(ctx_id=0, det_size=(640, 640))
+        # Models load on first inference unless warmed up here
+        if warm_up:
+            self.warm_up()
         
         self.init_database()
         self.known_faces = self.load_embeddings_from_db()
@@ -35,123 +105,357 @@ class IncrementalFaceRecognition:
         
         print(f"System initialized with {len(self.known_faces)} known faces")
     
+    def _configure_models(self, model_name, providers, modules, det_size, min_face_size):
+        self.model_name = model_name
+        self.providers = providers or ['CPUExecutionProvider']
+        # Detection and recognition are always needed; anything else
+        # (landmark_3d_68, genderage, ...) is opt-in
+        self.modules = list(dict.fromkeys(['detection', 'recognition', *(modules or ())]))
+        self.det_size = tuple(det_size)
+        self.min_face_size = min_face_size
+        self._face_app = None
+        self._face_app_lock = threading.Lock()
+    
+    def model_config(self):
+        return {
+            'model_name': self.model_name,
+            'providers': self.providers,
+            'modules': self.modules,
+            'det_size': self.det_size,
+            'min_face_size': self.min_face_size,
+        }
+    
+    def detection_config(self, det_size=None, min_face_size=None, reduced_decode=False):
+        # Identifies the settings a cached detection was produced with.
+        # Detections on a reduced JPEG decode (see DecodedImage) differ
+        # slightly from full-resolution ones, so they are keyed apart.
+        det_size = tuple(det_size) if det_size else self.det_size
+        min_face_size = self.min_face_size if min_face_size is None else min_face_size
+        config = f"{self.model_name}:{','.join(self.modules)}:{det_size[0]}x{det_size[1]}:{min_face_size}"
+        return config + ":reduced" if reduced_decode else config
+    
+    @classmethod
+    def for_inference(cls, model_name='buffalo_l', providers=None, modules=('detection', 'recognition'),
+                      det_size=(640, 640), min_face_size=0):
+        # Models only, no database or gallery: used by worker processes that
+        # just detect and embed
+        recognizer = cls.__new__(cls)
+        recognizer._configure_models(model_name, providers, modules, det_size, min_face_size)
+        recognizer.detection_cache = None
+        return recognizer
+    
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS face_embeddings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                person_name TEXT NOT NULL,
-                embedding BLOB NOT NULL,
-                image_path TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                confidence REAL
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS training_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                image_path TEXT,
-                person_name TEXT,
-                action TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                confidence REAL
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS processed_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                image_path TEXT UNIQUE,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        self.store = FaceStore(self.db_path)
+        self.store.init_schema()
+        self.detection_cache = DetectionCache(self.store, self.detection_cache_entries, self.detection_cache_bytes)
+        self.compactor = GalleryCompactor(self.store, self.max_prototypes, self.prototype_outliers,
+                                          self.redundancy_threshold, self.similarity_threshold)
     def load_embeddings_from_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT person_name, embedding FROM face_embeddings")
-        rows = cursor.fetchall()
-        known_faces = {}
-        for person_name, embedding_blob in rows:
-            embedding = np.frombuffer(embedding_blob, dtype=np.float32)
-            if person_name not in known_faces:
-                known_faces[person_name] = []
-            known_faces[person_name].append(embedding)
-        conn.close()
+        known_faces, self.embeddings_watermark, self.embeddings_generation, self.snapshot_version = \
+            self._load_gallery()
         return known_faces
+    
+    def _load_gallery(self):
+        # A new gallery plus the watermark, generation and snapshot version
+        # it reflects. Leaves the recognizer's attributes alone, so it can run
+        # without gallery_lock
+        known_faces = self._new_gallery()
+        generation = self.store.embeddings_generation()
+        snapshot_version = self.snapshot.version()
+        
+        # Map the snapshot zero-copy, then replay only the rows added after it
+        watermark = 0
+        snapshot = self.snapshot.load(generation)
+        if snapshot is not None:
+            self._attach_snapshot(known_faces, snapshot)
+            watermark = snapshot['watermark']
+        
+        rows = self.store.load_embeddings(after_id=watermark)
+        if rows:
+            names = [person_name for _, person_name, _ in rows]
+            embeddings = np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows])
+            known_faces.add_many(names, embeddings)
+            watermark = rows[-1][0]
+        
+        # Another process may be writing the same snapshot; it is picked up
+        # by refresh_gallery() once written
+        if len(rows) >= self.snapshot_min_rows and self._claim_snapshot_lease():
+            try:
+                self.snapshot.save(known_faces.matrix, known_faces.labels, known_faces.names, watermark, generation)
+            finally:
+                self._release_snapshot_lease()
+            # Serve the replayed rows from the shared mapping too
+            saved_version = self.snapshot.version()
+            snapshot = self.snapshot.load(generation)
+            if snapshot is not None:
+                known_faces = self._new_gallery()
+                self._attach_snapshot(known_faces, snapshot)
+                snapshot_version = saved_version
+        return known_faces, watermark, generation, snapshot_version
+    
+    def _attach_snapshot(self, known_faces, snapshot):
+        # IVF/HNSW are built once per snapshot and then loaded from next to
+        # it; rebuilding an HNSW graph costs far more than mapping the rows
+        index_state = self.snapshot.load_index(snapshot, self.search_index, self.index_options)
+        known_faces.attach_base(snapshot['matrix'], snapshot['labels'], snapshot['names'],
+                                snapshot['codes'], snapshot['scales'], index_state)
+        if index_state is None:
+            index_state = known_faces.index.state()
+            if index_state is not None:
+                self.snapshot.save_index(snapshot, self.search_index, self.index_options, index_state)
+    
+    def _new_gallery(self):
+        return FaceGallery(index=self.search_index, index_options=self.index_options,
+                           precision=self.embedding_precision, rerank=self.rerank_candidates)
+    
+    def refresh_gallery(self):
+        # Catches the in-memory gallery up with rows written by other
+        # processes (server workers, bulk enrollment). Cheap when nothing
+        # changed: one indexed query and a stat() of the snapshot metadata.
+        # Returns the number of rows added, or None after a full reload.
+        if (self.store.embeddings_generation() != self.embeddings_generation
+                or self.snapshot.version() != self.snapshot_version):
+            # Rows were rewritten (compaction) or a newer snapshot exists:
+            # remap it so the private tail shrinks back to the newest rows
+            self.reload_gallery()
+            return None
+        
+        rows = self.store.load_embeddings(after_id=self.embeddings_watermark)
+        if not rows:
+            return 0
+        names, embeddings = [], []
+        with self.gallery_lock:
+            for _, person_name, blob in rows:
+                key = (person_name, content_hash(blob))
+                if self._local_rows[key]:
+                    self._local_rows[key] -= 1
+                    if not self._local_rows[key]:
+                        del self._local_rows[key]
+                    continue
+                names.append(person_name)
+                embeddings.append(np.frombuffer(blob, dtype=np.float32))
+            if names:
+                self.known_faces.add_many(names, np.stack(embeddings))
+            self.embeddings_watermark = rows[-1][0]
+        
+        # Keep per-process memory bounded: once enough rows piled up outside
+        # the shared snapshot, one process rebuilds it and all of them remap
+        if self.known_faces.size - self.known_faces.base_size >= self.snapshot_min_rows:
+            self.save_snapshot()
+        return len(names)
+    
+    def reload_gallery(self):
+        # The new gallery (snapshot mapping, replayed rows, search index) is
+        # built while searches keep running on the old one; only the swap
+        # holds gallery_lock. Samples added locally meanwhile and not in the
+        # new gallery are past its watermark, so the next refresh adds them.
+        known_faces, watermark, generation, snapshot_version = self._load_gallery()
+        with self.gallery_lock:
+            self.known_faces = known_faces
+            self.embeddings_watermark = watermark
+            self.embeddings_generation = generation
+            self.snapshot_version = snapshot_version
+            self._local_rows = Counter()
+    
+    def _snapshot_lease_owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+    
+    def _claim_snapshot_lease(self):
+        return self.store.claim_lease("snapshot_writer", self._snapshot_lease_owner(), ttl=600)
+    
+    def _release_snapshot_lease(self):
+        self.store.release_lease("snapshot_writer", self._snapshot_lease_owner())
+    def save_snapshot(self):
+        # Built from the previous snapshot plus the DB rows after its
+        # watermark, independent of what this process holds in memory.
+        generation = self.store.embeddings_generation()
+        snapshot = self.snapshot.load(generation)
+        if snapshot is None:
+            snapshot = {'matrix': None, 'labels': np.empty(0, dtype=np.int32), 'names': [], 'watermark': 0}
+        rows = self.store.load_embeddings(after_id=snapshot['watermark'])
+        if not rows:
+            return False
+        if not self._claim_snapshot_lease():
+            # Another process is already rebuilding it
+            return False
+        
+        names = list(snapshot['names'])
+        name_ids = {name: i for i, name in enumerate(names)}
+        labels = []
+        for _, person_name, _ in rows:
+            if person_name not in name_ids:
+                name_ids[person_name] = len(names)
+                names.append(person_name)
+            labels.append(name_ids[person_name])
+        vectors = normalize_rows(np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows]))
+        matrix = vectors if snapshot['matrix'] is None else np.concatenate([snapshot['matrix'], vectors])
+        labels = np.concatenate([snapshot['labels'], np.asarray(labels, dtype=np.int32)])
+        try:
+            self.snapshot.save(matrix, labels, names, rows[-1][0], generation)
+        finally:
+            self._release_snapshot_lease()
+        print(f"💾 Embedding snapshot updated ({len(matrix)} embeddings)")
+        return True
     def load_processed_images(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT image_path FROM processed_images")
-        rows = cursor.fetchall()
-        processed = set()
-        for row in rows:
-            processed.add(Path(row[0]).name)
-        conn.close()
-        return processed
-    def mark_image_processed(self, image_path):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO processed_images (image_path)
-            VALUES (?)
-        ''', (str(image_path),))
-        conn.commit()
-        conn.close()
-        self.processed_images.add(Path(image_path).name)
+        # Content hashes, so renamed or copied files are still recognized;
+        # rows written before hashes were recorded fall back to their path
+        return {image_hash or str(image_path) for image_path, image_hash in self.store.load_processed()}
+    def is_image_processed(self, image_path, image_hash):
+        return image_hash in self.processed_images or str(image_path) in self.processed_images
+    def mark_image_processed(self, image_path, image_hash=None):
+        if image_hash is None:
+            image_hash = content_hash(read_image_bytes(image_path))
+        self.store.mark_processed(image_path, image_hash)
+        self.processed_images.add(image_hash)
     def save_embedding_to_db(self, person_name, embedding, image_path, confidence=1.0):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        embedding_blob = embedding.astype(np.float32).tobytes()
-        cursor.execute('''
-            INSERT INTO face_embeddings (person_name, embedding, image_path, confidence)
-            VALUES (?, ?, ?, ?)
-        ''', (person_name, embedding_blob, str(image_path), confidence))
-        conn.commit()
-        conn.close()
+        self.store.save_embedding(person_name, embedding, image_path, confidence)
     def log_training_action(self, image_path, person_name, action, confidence=1.0):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO training_log (image_path, person_name, action, confidence)
-            VALUES (?, ?, ?, ?)
-        ''', (str(image_path), person_name, action, confidence))
-        conn.commit()
-        conn.close()
-    
-    def detect_faces(self, image_path):
-        if isinstance(image_path, str):
-            image = cv2.imread(image_path)
-        else:
-            image = image_path
-            
+        self.store.log_action(image_path, person_name, action, confidence)
+    
+    @property
+    def face_app(self):
+        if self._face_app is None:
+            with self._face_app_lock:
+                if self._face_app is None:
+                    print("Loading ArcFace model...")
+                    self._face_app = self.create_face_app()
+        return self._face_app
+    
+    @property
+    def models_loaded(self):
+        return self._face_app is not None
+    
+    def warm_up(self, face_app=None):
+        # One detection and one embedding on blank input, so ONNX Runtime has
+        # built its sessions and buffers before the first real request
+        face_app = face_app or self.face_app
+        blank = np.zeros((self.det_size[1], self.det_size[0], 3), dtype=np.uint8)
+        face_app.det_model.detect(blank, input_size=self.det_size, max_num=0, metric='default')
+        rec_model = face_app.models['recognition']
+        crop_size = rec_model.input_size[0]
+        rec_model.get_feat([np.zeros((crop_size, crop_size, 3), dtype=np.uint8)])
+        return face_app
+    
+    def create_face_app(self):
+        from insightface.app import FaceAnalysis
+        face_app = FaceAnalysis(name=self.model_name, providers=self.providers, allowed_modules=self.modules)
+        face_app.prepare(ctx_id=0, det_size=self.det_size)
+        return face_app
+    
+    def detect_faces(self, image_path, face_app=None, det_size=None, min_face_size=None, crops=True):
+        if not isinstance(image_path, (str, Path)):
+            return self.detect_faces_batch([image_path], face_app, det_size, min_face_size, crops)[0], image_path
+        
+        try:
+            data = read_image_bytes(image_path)
+        except OSError:
+            data = None
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
         if image is None:
             print(f"Error: Could not load image")
-            return []
-        
-        faces = self.face_app.get(image)
-        
-        results = []
-        for i, face in enumerate(faces):
-            bbox = face.bbox.astype(int)
-            embedding = face.embedding
-            
-            x1, y1, x2, y2 = bbox
-            face_img = image[y1:y2, x1:x2]
-            results.append({
-                'bbox': bbox,
-                'embedding': embedding,
-                'face_img': face_img,
-                'confidence': face.det_score
-            })
-        
-        return results, image
+            return [], None
+        
+        # Files are looked up by content, so re-processing the same bytes
+        # (a rerun, a copy, a renamed file) skips detection and embedding
+        if self.detection_cache is None:
+            return self.detect_faces_batch([image], face_app, det_size, min_face_size, crops)[0], image
+        image_hash = content_hash(data)
+        config = self.detection_config(det_size, min_face_size)
+        faces = self.detection_cache.get(image_hash, config)
+        if faces is not None:
+            if crops:
+                for face_data in faces:
+                    face_data['face_img'] = crop_face(image, face_data['bbox'])
+            return faces, image
+        faces = self.detect_faces_batch([image], face_app, det_size, min_face_size, crops)[0]
+        self.detection_cache.put(image_hash, config, faces)
+        return faces, image
+    
+    def detect_faces_batch(self, images, face_app=None, det_size=None, min_face_size=None, crops=True):
+        # Detection runs per image, then the aligned crops of every face in
+        # every image go through the recognition model as one batch.
+        # face_app lets a worker thread use its own preloaded model instance.
+        faces_per_image = self.align_faces_batch(images, face_app, det_size, min_face_size, crops)
+        all_faces = [face_data for faces in faces_per_image for face_data in faces]
+        embeddings = self.embed_crops([face_data.pop('aligned') for face_data in all_faces], face_app)
+        for face_data, embedding in zip(all_faces, embeddings):
+            face_data['embedding'] = embedding
+        return faces_per_image
+    
+    def align_faces_batch(self, images, face_app=None, det_size=None, min_face_size=None, crops=True):
+        # Detection and alignment only; each face carries its aligned
+        # recognition crop under 'aligned' so embedding can be batched later.
+        # Faces smaller than min_face_size pixels are dropped before alignment.
+        #
+        # Images are arrays or DecodedImages. Detections on a reduced decode
+        # are reported in original coordinates; a face is aligned from the
+        # reduced image when it still spans the recognition crop there, and
+        # from the full-resolution original otherwise. The unaligned
+        # 'face_img' crop is only made when `crops` is set.
+        from insightface.app.common import Face
+        from insightface.utils import face_align
+        face_app = face_app or self.face_app
+        crop_size = face_app.models['recognition'].input_size[0]
+        det_size = tuple(det_size) if det_size else self.det_size
+        min_face_size = self.min_face_size if min_face_size is None else min_face_size
+        extra_models = [model for taskname, model in face_app.models.items()
+                        if taskname not in ('detection', 'recognition')]
+        
+        faces_per_image = []
+        for image in images:
+            if not isinstance(image, DecodedImage):
+                image = DecodedImage(None, image)
+            with DETECTION_LATENCY.time():
+                bboxes, kpss = face_app.det_model.detect(image.image, input_size=det_size, max_num=0,
+                                                         metric='default')
+            IMAGES_DETECTED.inc()
+            if image.reduced:
+                bboxes = np.concatenate([bboxes[:, :4] * image.scale, bboxes[:, 4:]], axis=1)
+                kpss = kpss * image.scale
+            aligned_at = time.perf_counter()
+            results = []
+            for i in range(len(bboxes)):
+                bbox = bboxes[i, 0:4].astype(int)
+                x1, y1, x2, y2 = bbox
+                if min(x2 - x1, y2 - y1) < min_face_size:
+                    continue
+                if image.reduced and min(x2 - x1, y2 - y1) / image.scale >= crop_size:
+                    aligned = face_align.norm_crop(image.image, landmark=kpss[i] / image.scale, image_size=crop_size)
+                else:
+                    aligned = face_align.norm_crop(image.original(), landmark=kpss[i], image_size=crop_size)
+                face_data = {
+                    'bbox': bbox,
+                    'aligned': aligned,
+                    'confidence': bboxes[i, 4]
+                }
+                if crops:
+                    face_data['face_img'] = crop_face(image.original(), bbox)
+                if extra_models:
+                    face = Face(bbox=bboxes[i, 0:4], kps=kpss[i], det_score=bboxes[i, 4])
+                    for model in extra_models:
+                        model.get(image.original(), face)
+                    face_data.update({key: value for key, value in face.items()
+                                      if key not in ('bbox', 'kps', 'det_score')})
+                results.append(face_data)
+            ALIGNMENT_LATENCY.observe((time.perf_counter() - aligned_at) * 1000)
+            FACES_PER_IMAGE.observe(len(results))
+            faces_per_image.append(results)
+        return faces_per_image
+    
+    def embed_crops(self, crops, face_app=None, batch_size=32):
+        if not crops:
+            return np.empty((0, 512), dtype=np.float32)
+        rec_model = (face_app or self.face_app).models['recognition']
+        with EMBEDDING_LATENCY.time():
+            embeddings = np.concatenate([rec_model.get_feat(crops[i:i + batch_size])
+                                         for i in range(0, len(crops), batch_size)])
+        FACES_EMBEDDED.inc(len(crops))
+        return embeddings
     
     def display_image_with_faces(self, image, faces, image_name):
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Rectangle
+        
         plt.figure(figsize=(12, 8))
         
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -178,6 +482,7 @@ class IncrementalFaceRecognition:
     def display_individual_faces(self, faces):
         if not faces:
             return
+        import matplotlib.pyplot as plt
             
         num_faces = len(faces)
         cols = min(4, num_faces)
@@ -198,26 +503,74 @@ class IncrementalFaceRecognition:
         plt.show()
     
     def find_best_match(self, embedding):
-        best_match = None
-        best_similarity = 0
-        
-        for person_name, embeddings in self.known_faces.items():
-            for stored_embedding in embeddings:
-                similarity = cosine_similarity([embedding], [stored_embedding])[0][0]
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = person_name
-        
-        return best_match, best_similarity
+        with MATCHING_LATENCY.time(), self.gallery_lock:
+            return self.known_faces.search(embedding)
+    
+    def find_best_matches(self, embeddings):
+        with MATCHING_LATENCY.time(), self.gallery_lock:
+            return self.known_faces.search_batch(embeddings)
+    
+    def find_frame_matches(self, embeddings, frames=None):
+        # (name, similarity) per embedding, with each person given to at
+        # most one face per frame; `frames` holds a frame id per embedding
+        # (all one frame when None)
+        with MATCHING_LATENCY.time(), self.gallery_lock:
+            if self.frame_assignment == "none":
+                return self.known_faces.search_batch(embeddings)
+            return self.known_faces.search_frames(embeddings, frames, self.similarity_threshold,
+                                                  self.assignment_shortlist, self.frame_assignment)
+    
+    def find_top_identities(self, embeddings, k=5, aggregate=None):
+        # Ranked (name, score) candidates per embedding, one score per person
+        # instead of per stored sample (see FaceGallery.search_identities)
+        with MATCHING_LATENCY.time(), self.gallery_lock:
+            return self.known_faces.search_identities(embeddings, k, aggregate or self.identity_aggregate,
+                                                      self.identity_top_m, self.identity_shortlist)
     
     def save_face_to_dataset(self, face_img, person_name, image_name):
-        person_dir = self.dataset_path / person_name
-        person_dir.mkdir(exist_ok=True)
-        
-        face_path = person_dir / f"{image_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        cv2.imwrite(str(face_path), face_img)
+        # Returns where the crop will be once the crop writer gets to it
+        return self.crop_writer.save(face_img, person_name, image_name)
+    
+    def close(self):
+        # Everything queued reaches disk before the process goes away
+        self.crop_writer.close()
+        self.store.flush()
+    
+    def add_face_sample(self, person_name, embedding, face_img, image_name, confidence=1.0):
+        # Stores a confirmed face. Returns None without storing anything when
+        # the person already has a near-identical sample.
+        if self.compactor.is_redundant(self.known_faces, person_name, embedding):
+            return None
+        face_path = self.save_face_to_dataset(face_img, person_name, image_name)
+        with self.gallery_lock:
+            self.known_faces.add(person_name, embedding)
+            self._local_rows[(person_name, content_hash(np.asarray(embedding, dtype=np.float32).tobytes()))] += 1
+        self.save_embedding_to_db(person_name, embedding, face_path, confidence)
+        if self.compactor.needs_compaction(self.known_faces, person_name):
+            self.pending_compaction.add(person_name)
         return face_path
     
+    def record_face(self, image_path, person_name, embedding, face_img, image_name, action, confidence=1.0):
+        # add_face_sample() plus its training_log row: `action` when the
+        # sample was stored, SKIPPED_REDUNDANT when it was not. Returns
+        # whether it was stored.
+        stored = self.add_face_sample(person_name, embedding, face_img, image_name, confidence) is not None
+        self.log_training_action(image_path, person_name, action if stored else "SKIPPED_REDUNDANT", confidence)
+        return stored
+    
+    def compact_gallery(self, names=None, dry_run=False):
+        # Reduces over-grown identities to prototypes (all identities when
+        # names is None) and reloads the gallery if rows were removed
+        self.store.flush()
+        report = self.compactor.compact(names, dry_run=dry_run)
+        if names is not None:
+            self.pending_compaction -= set(names)
+        if report['applied']:
+            self.reload_gallery()
+            print(f"🗜️ Compacted gallery: {report['rows_before']} -> {report['rows_after']} embeddings "
+                  f"(rank-1 accuracy {report['raw_accuracy']:.4f} -> {report['compacted_accuracy']:.4f})")
+        return report
+    
     def add_new_person(self, embedding, face_img, face_index, image_name):
         print(f"\n📸 New face detected - Face {face_index}")
         print("Enter person's name or 's' to skip:")
@@ -230,16 +583,11 @@ class IncrementalFaceRecognition:
         if not person_name:
             person_name = f"unknown_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        face_path = self.save_face_to_dataset(face_img, person_name, f"{image_name}_face{face_index}")
-        
-        if person_name not in self.known_faces:
-            self.known_faces[person_name] = []
-        self.known_faces[person_name].append(embedding)
-        
-        self.save_embedding_to_db(person_name, embedding, face_path)
-        self.log_training_action(image_name, person_name, "NEW_PERSON")
-        
-        print(f"✅ Added {person_name} to the system")
+        if self.record_face(image_name, person_name, embedding, face_img, f"{image_name}_face{face_index}",
+                            "NEW_PERSON"):
+            print(f"✅ Added {person_name} to the system")
+        else:
+            print(f"⏭️ {person_name} already has a near-identical sample; not stored")
         return person_name
     
     def confirm_match(self, person_name, similarity, embedding, face_img, face_index, image_name):
@@ -252,11 +600,11 @@ class IncrementalFaceRecognition:
             print(f"⏭️ Skipped Face {face_index}")
             return None
         elif response in ['y', 'yes']:
-            self.known_faces[person_name].append(embedding)
-            face_path = self.save_face_to_dataset(face_img, person_name, f"{image_name}_face{face_index}")
-            self.save_embedding_to_db(person_name, embedding, face_path, similarity)
-            self.log_training_action(image_name, person_name, "CONFIRMED", similarity)
-            print(f"✅ Confirmed as {person_name}")
+            if self.record_face(image_name, person_name, embedding, face_img, f"{image_name}_face{face_index}",
+                                "CONFIRMED", similarity):
+                print(f"✅ Confirmed as {person_name}")
+            else:
+                print(f"✅ Confirmed as {person_name} (near-identical sample already stored)")
             return person_name
         else:
             print(f"Who is Face {face_index}? (or 's' to skip):")
@@ -269,15 +617,11 @@ class IncrementalFaceRecognition:
             if not correct_name:
                 correct_name = f"unknown_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             
-            if correct_name not in self.known_faces:
-                self.known_faces[correct_name] = []
-            self.known_faces[correct_name].append(embedding)
-            
-            face_path = self.save_face_to_dataset(face_img, correct_name, f"{image_name}_face{face_index}")
-            self.save_embedding_to_db(correct_name, embedding, face_path)
-            self.log_training_action(image_name, correct_name, "CORRECTED")
-            
-            print(f"✅ Added as {correct_name}")
+            if self.record_face(image_name, correct_name, embedding, face_img, f"{image_name}_face{face_index}",
+                                "CORRECTED"):
+                print(f"✅ Added as {correct_name}")
+            else:
+                print(f"⏭️ {correct_name} already has a near-identical sample; not stored")
             return correct_name
     
     def process_image(self, image_path, show_images=True):
@@ -298,48 +642,63 @@ class IncrementalFaceRecognition:
         results = []
         image_name = Path(image_path).stem
         
-        for i, face_data in enumerate(faces):
-            embedding = face_data['embedding']
-            face_img = face_data['face_img']
-            bbox = face_data['bbox']
-            
-            print(f"\n👤 Processing Face {i+1}/{len(faces)}")
-            
-            if len(self.known_faces) == 0:
-                person_name = self.add_new_person(embedding, face_img, i+1, image_name)
-            else:
-                best_match, similarity = self.find_best_match(embedding)
+        # All faces are matched together, so two faces never get the same
+        # person. Once a face adds to the gallery (a new person, a confirmed
+        # sample) the frame is matched again, so the faces after it see the
+        # addition and cannot take the person an earlier face became.
+        embeddings = [face_data['embedding'] for face_data in faces]
+        matches = self.find_frame_matches(embeddings)
+        gallery_size = self.known_faces.size
+        
+        with self.store.batch():
+            for i, face_data in enumerate(faces):
+                embedding = face_data['embedding']
+                face_img = face_data['face_img']
+                bbox = face_data['bbox']
                 
-                if similarity > self.similarity_threshold:
-                    if similarity > self.confidence_threshold:
-                        self.known_faces[best_match].append(embedding)
-                        face_path = self.save_face_to_dataset(face_img, best_match, f"{image_name}_face{i+1}")
-                        self.save_embedding_to_db(best_match, embedding, face_path, similarity)
-                        self.log_training_action(image_path, best_match, "AUTO_CONFIRMED", similarity)
-                        print(f"✅ Face {i+1}: Auto-confirmed as {best_match} (confidence: {similarity:.2f})")
-                        person_name = best_match
-                    else:
-                        person_name = self.confirm_match(best_match, similarity, embedding, 
-                                                    face_img, i+1, image_name)
-                else:
+                print(f"\n👤 Processing Face {i+1}/{len(faces)}")
+                if self.known_faces.size != gallery_size:
+                    matches = self.find_frame_matches(embeddings)
+                    gallery_size = self.known_faces.size
+                
+                if len(self.known_faces) == 0:
                     person_name = self.add_new_person(embedding, face_img, i+1, image_name)
-            
-            if person_name:
-                results.append({
-                    'person_name': person_name,
-                    'bbox': bbox,
-                    'confidence': similarity if 'similarity' in locals() else 1.0
-                })
+                else:
+                    best_match, similarity = matches[i]
+                    
+                    if best_match is not None and similarity > self.similarity_threshold:
+                        if similarity > self.confidence_threshold:
+                            stored = self.record_face(image_path, best_match, embedding, face_img,
+                                                      f"{image_name}_face{i+1}", "AUTO_CONFIRMED", similarity)
+                            print(f"✅ Face {i+1}: Auto-confirmed as {best_match} (confidence: {similarity:.2f})"
+                                  f"{'' if stored else ', near-identical sample already stored'}")
+                            person_name = best_match
+                        else:
+                            person_name = self.confirm_match(best_match, similarity, embedding,
+                                                             face_img, i+1, image_name)
+                    else:
+                        person_name = self.add_new_person(embedding, face_img, i+1, image_name)
+                
+                if person_name:
+                    results.append({
+                        'person_name': person_name,
+                        'bbox': bbox,
+                        'confidence': similarity if 'similarity' in locals() else 1.0
+                    })
         
         return results
     
-    def train_on_dataset(self, dataset_folder, show_images=True):
+    def train_on_dataset(self, dataset_folder, show_images=True, headless=False, manifest=None,
+                         workers=None, commit_every=32):
         dataset_folder = Path(dataset_folder)
         
         if not dataset_folder.exists():
             print(f"❌ Dataset folder {dataset_folder} does not exist")
             return
         
+        if headless:
+            return BulkEnroller(self, workers=workers, commit_every=commit_every).run(dataset_folder, manifest)
+        
         image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
         image_files = []
         
@@ -351,7 +710,13 @@ class IncrementalFaceRecognition:
             print("❌ No image files found in the dataset folder")
             return
         
-        unprocessed_files = [f for f in image_files if f.name not in self.processed_images]
+        image_hashes = {}
+        for image_file in image_files:
+            try:
+                image_hashes[image_file] = content_hash(read_image_bytes(image_file))
+            except OSError:
+                image_hashes[image_file] = None
+        unprocessed_files = [f for f in image_files if not self.is_image_processed(f, image_hashes[f])]
         
         if not unprocessed_files:
             print("✅ All images in the folder have already been processed!")
@@ -362,13 +727,19 @@ class IncrementalFaceRecognition:
         
         processed_count = 0
         for image_file in sorted(unprocessed_files):
+            image_hash = image_hashes[image_file]
+            if image_hash is not None and image_hash in self.processed_images:
+                print(f"⏭️ Skipping {image_file.name}: identical to an image already processed")
+                continue
             try:
                 print(f"\n{'='*60}")
                 print(f"Image {processed_count + 1}/{len(unprocessed_files)}")
                 print(f"{'='*60}")
                 
-                self.process_image(str(image_file), show_images)
-                self.mark_image_processed(image_file)
+                # One transaction per image: embeddings, log rows and the processed marker
+                with self.store.batch():
+                    self.process_image(str(image_file), show_images)
+                    self.mark_image_processed(image_file, image_hash)
                 processed_count += 1
                 
                 print(f"\n📊 Progress: {processed_count}/{len(unprocessed_files)} images processed")
@@ -383,6 +754,11 @@ class IncrementalFaceRecognition:
                 print(f"❌ Error processing {image_file}: {str(e)}")
                 continue
         
+        if self.pending_compaction:
+            self.compact_gallery(sorted(self.pending_compaction))
+        if processed_count:
+            self.save_snapshot()
+        
         print(f"\n🎉 Training completed!")
         print(f"📊 Final stats:")
         print(f"   - Images processed: {processed_count}")
@@ -390,76 +766,123 @@ class IncrementalFaceRecognition:
         for name, embeddings in self.known_faces.items():
             print(f"   - {name}: {len(embeddings)} face samples")
     
-    def recognize_in_video(self, video_source=0):
-        cap = cv2.VideoCapture(video_source)
+    def recognize_in_video(self, video_source=0, tracking=True, detect_every=5, headless=False,
+                           output_path=None, json_path=None):
+        pipeline = VideoPipeline(self, video_source,
+                                 tracker=FaceTracker(self, detect_every=detect_every) if tracking else None)
         
-        if not cap.isOpened():
+        if not pipeline.is_opened():
             print("❌ Error: Could not open video source")
             return
         
-        print("🎥 Starting video recognition. Press 'q' to quit.")
+        if headless:
+            print("🎥 Starting headless video recognition.")
+        else:
+            print("🎥 Starting video recognition. Press 'q' to quit.")
+        
+        writer = None
+        json_file = open(json_path, "w") if json_path else None
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        def output(frame_id, frame, annotations):
+            nonlocal writer
+            self.draw_annotations(frame, annotations)
             
-            faces, _ = self.detect_faces(frame)
+            if json_file:
+                json_file.write(json.dumps({
+                    "frame": frame_id,
+                    "faces": [{"bbox": [int(v) for v in bbox],
+                               "person_name": best_match if best_match is not None and similarity > self.similarity_threshold else "unknown",
+                               "confidence": float(similarity)}
+                              for bbox, best_match, similarity in annotations]
+                }) + "\n")
             
-            for face_data in faces:
-                bbox = face_data['bbox']
-                embedding = face_data['embedding']
-                
-                if len(self.known_faces) > 0:
-                    best_match, similarity = self.find_best_match(embedding)
-                    
-                    if similarity > self.similarity_threshold:
-                        label = f"{best_match} ({similarity:.2f})"
-                        color = (0, 255, 0)
-                    else:
-                        label = "Unknown"
-                        color = (0, 0, 255)
-                else:
-                    label = "Unknown"
-                    color = (0, 0, 255)
-                
-                x1, y1, x2, y2 = bbox
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 
-                        0.6, color, 2)
+            if output_path:
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"),
+                                             pipeline.fps, (width, height))
+                writer.write(frame)
             
-            cv2.imshow('Face Recognition', frame)
+            if not headless:
+                cv2.imshow('Face Recognition', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    return False
+            return True
+        
+        try:
+            stats = pipeline.run(output)
+        finally:
+            if writer is not None:
+                writer.release()
+            if json_file:
+                json_file.close()
+            if not headless:
+                cv2.destroyAllWindows()
+        
+        print(f"📊 {stats['frames']['output']} frames in {stats['elapsed_seconds']:.1f}s "
+              f"({stats['throughput_fps']['output']:.1f} FPS, {stats['dropped_frames']} dropped)")
+        for stage, latency in stats['mean_latency_ms'].items():
+            print(f"   - {stage}: {latency:.1f} ms mean")
+        if pipeline.tracker:
+            print(f"   - Detection ran on {pipeline.tracker.detections} frames, "
+                  f"{pipeline.tracker.embeddings} faces embedded")
+        return stats
+    
+    def draw_annotations(self, frame, annotations):
+        for bbox, best_match, similarity in annotations:
+            if best_match is not None and similarity > self.similarity_threshold:
+                label = f"{best_match} ({similarity:.2f})"
+                color = (0, 255, 0)
+            else:
+                label = "Unknown"
+                color = (0, 0, 255)
             
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-        
-        cap.release()
-        cv2.destroyAllWindows()
+            x1, y1, x2, y2 = bbox
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 
+                    0.6, color, 2)
+    
+    def _annotate_frame(self, frame, tracker=None):
+        # (bbox, name, similarity) for every face shown in this frame
+        if tracker is None:
+            faces, _ = self.detect_faces(frame, crops=False)
+            matches = self.find_frame_matches([face_data['embedding'] for face_data in faces])
+            return [(face_data['bbox'], best_match, similarity)
+                    for face_data, (best_match, similarity) in zip(faces, matches)]
+        
+        annotations = []
+        for track in tracker.process(frame):
+            best_match, similarity = track.identity
+            annotations.append((track.bbox.astype(int), best_match, similarity))
+        return annotations
     
     def get_statistics(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM face_embeddings")
-        total_embeddings = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(DISTINCT person_name) FROM face_embeddings")
-        unique_people = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT person_name, COUNT(*) FROM face_embeddings GROUP BY person_name")
-        person_counts = cursor.fetchall()
-        
-        cursor.execute("SELECT COUNT(*) FROM processed_images")
-        processed_images_count = cursor.fetchone()[0]
-        
-        conn.close()
+        # Served from the in-memory gallery and processed set, no DB queries
+        person_counts = self.known_faces.counts()
+        stats = {
+            "total_embeddings": sum(person_counts.values()),
+            "unique_people": len(person_counts),
+            "processed_images": len(self.processed_images),
+            "person_counts": person_counts,
+            "search_index": self.search_index,
+            "embedding_precision": self.embedding_precision,
+            "snapshot_rows": self.known_faces.base_size,
+            "embeddings_watermark": self.embeddings_watermark,
+            "pending_compaction": sorted(self.pending_compaction),
+        }
+        if self.detection_cache is not None:
+            stats["detection_cache"] = {"hits": self.detection_cache.hits, "misses": self.detection_cache.misses}
+        return stats
+    
+    def print_statistics(self):
+        stats = self.get_statistics()
         
         print(f"\n📊 System Statistics:")
-        print(f"   - Total face embeddings: {total_embeddings}")
-        print(f"   - Unique people: {unique_people}")
-        print(f"   - Processed images: {processed_images_count}")
+        print(f"   - Total face embeddings: {stats['total_embeddings']}")
+        print(f"   - Unique people: {stats['unique_people']}")
+        print(f"   - Processed images: {stats['processed_images']}")
         print(f"   - Face samples per person:")
-        for name, count in person_counts:
+        for name, count in stats['person_counts'].items():
             print(f"     • {name}: {count} samples")
 
 
@@ -507,9 +930,10 @@ def main():
                 recognizer.recognize_in_video(0)
         
         elif choice == '4':
-            recognizer.get_statistics()
+            recognizer.print_statistics()
         
         elif choice == '5':
+            recognizer.close()
             print("👋 Goodbye!")
             break
         
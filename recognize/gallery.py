@@ -0,0 +1,400 @@
+import numpy as np
+
+from assignment import assign
+from quantization import CODE_DTYPES, PRECISIONS, quantize, quantized_scores
+from search_index import make_index, top_k
+
+
+IDENTITY_AGGREGATES = ("max", "top_m_mean", "centroid")
+
+
+def normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class FaceGallery:
+    # Known faces as one contiguous L2-normalized float32 matrix plus a
+    # parallel array of label ids, so matching is a single matrix product.
+    # Lookups go through a pluggable search index (see search_index.py).
+    #
+    # Rows live in two segments: an optional read-only base (typically the
+    # memory-mapped snapshot, shared between processes) and a growable tail
+    # for embeddings added after startup.
+    #
+    # With precision "float16" or "int8" a compressed copy of every row is
+    # kept next to the float32 one; exact search scans the compressed rows
+    # and re-scores the best `rerank` candidates at full precision. The
+    # memory saving is on the base: its float32 rows stay on disk in the
+    # mapped snapshot and only re-ranked rows are paged in. Tail rows keep
+    # both copies in RAM, since they are the re-rank source; the recognizer
+    # folds the tail into the snapshot once it reaches snapshot_min_rows,
+    # which bounds that overhead.
+    def __init__(self, dim=None, capacity=1024, index="exact", index_options=None, precision="float32",
+                 rerank=32):
+        self.dim = dim
+        self.precision = precision
+        self.rerank = rerank
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision '{precision}', expected one of {list(PRECISIONS)}")
+        self._base = None
+        self._base_codes = None
+        self._base_scales = None
+        self._tail = None
+        self._tail_codes = None
+        self._tail_scales = None
+        self._tail_capacity = capacity
+        self._tail_size = 0
+        self._labels = np.empty(capacity, dtype=np.int32)
+        self.names = []
+        self._name_ids = {}
+        self._counts = []
+        # Per-person bookkeeping for search_identities(): the row ids of each
+        # person's samples and the running sum of their vectors. The base
+        # segment's share is built on first use, so attaching (or reloading)
+        # a large base does not stream it unless identities are searched.
+        self._base_members = []
+        self._tail_members = []
+        self._centroid_sums = np.zeros((0, dim or 0), dtype=np.float32)
+        self._base_sums_pending = False
+        self._centroids = None
+        self.index_kind = index
+        self.index_options = index_options or {}
+        self.index = make_index(index, self, **self.index_options)
+
+    @property
+    def base_size(self):
+        return 0 if self._base is None else len(self._base)
+
+    @property
+    def size(self):
+        return self.base_size + self._tail_size
+
+    @property
+    def matrix(self):
+        # Only concatenates (copies) when both segments are populated; hot
+        # paths use scores() and rows() which work segment by segment.
+        tail = None if self._tail is None else self._tail[:self._tail_size]
+        if self._base is None:
+            return tail if tail is not None else np.empty((0, self.dim or 0), dtype=np.float32)
+        if not self._tail_size:
+            return self._base
+        return np.concatenate([self._base, tail])
+
+    @property
+    def labels(self):
+        return self._labels[:self.size]
+
+    @property
+    def quantized(self):
+        return self.precision != "float32"
+
+    @property
+    def bytes_per_row(self):
+        # Bytes the exact scan reads per embedding
+        dim = self.dim or 0
+        return {"float32": 4 * dim, "float16": 2 * dim, "int8": dim + 4}[self.precision]
+
+    def attach_base(self, matrix, labels, names, codes=None, scales=None, index_state=None):
+        # codes/scales: the base rows already quantized to this gallery's
+        # precision (e.g. mapped from the snapshot); computed here otherwise.
+        # index_state: a saved index over exactly these rows (see
+        # EmbeddingSnapshot.load_index), so IVF/HNSW are not rebuilt
+        if self.size:
+            raise ValueError("A base segment can only be attached to an empty gallery")
+        self._reserve_labels(len(matrix))
+        self.dim = matrix.shape[1]
+        self._base = matrix
+        if self.quantized:
+            if codes is None:
+                codes, scales = quantize(matrix, self.precision)
+            self._base_codes, self._base_scales = codes, scales
+        self._labels[:len(matrix)] = labels
+        for name in names:
+            self._label_id(name)
+        counts = np.bincount(labels, minlength=len(self.names))
+        self._counts = [int(count) for count in counts]
+        self._base_members = None
+        self._reserve_centroids(len(self.names))
+        self._base_sums_pending = True
+        self._centroids = None
+        if index_state is not None:
+            self.index.restore(index_state)
+        else:
+            self.index.add(0, matrix)
+
+    def scores(self, queries):
+        if self._base is None:
+            return queries @ self.matrix.T
+        parts = [queries @ self._base.T]
+        if self._tail_size:
+            parts.append(queries @ self._tail[:self._tail_size].T)
+        return np.concatenate(parts, axis=1) if len(parts) > 1 else parts[0]
+
+    def approximate_scores(self, queries):
+        # Same layout as scores(), computed from the compressed rows
+        scores = np.empty((len(queries), self.size), dtype=np.float32)
+        base_size = self.base_size
+        if base_size:
+            quantized_scores(queries, self._base_codes, self._base_scales, scores[:, :base_size])
+        if self._tail_size:
+            quantized_scores(queries, self._tail_codes[:self._tail_size],
+                             None if self._tail_scales is None else self._tail_scales[:self._tail_size],
+                             scores[:, base_size:])
+        return scores
+
+    def rows(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._base is None:
+            return self._tail[ids]
+        base_size = len(self._base)
+        if self._tail_size == 0 or (ids.size and ids.max() < base_size):
+            return self._base[ids]
+        result = np.empty((len(ids), self.dim), dtype=np.float32)
+        in_base = ids < base_size
+        result[in_base] = self._base[ids[in_base]]
+        result[~in_base] = self._tail[ids[~in_base] - base_size]
+        return result
+
+    def _label_id(self, name):
+        label = self._name_ids.get(name)
+        if label is None:
+            label = len(self.names)
+            self._name_ids[name] = label
+            self.names.append(name)
+            self._counts.append(0)
+            self._tail_members.append([])
+            self._reserve_centroids(len(self.names))
+        return label
+
+    def _reserve_centroids(self, needed):
+        if needed <= len(self._centroid_sums) and self._centroid_sums.shape[1] == self.dim:
+            return
+        sums = np.zeros((max(needed, 2 * len(self._centroid_sums)), self.dim), dtype=np.float32)
+        if self._centroid_sums.shape[1] == self.dim:
+            sums[:len(self._centroid_sums)] = self._centroid_sums
+        self._centroid_sums = sums
+
+    def _reserve_labels(self, needed):
+        if needed <= len(self._labels):
+            return
+        capacity = max(len(self._labels), 1)
+        while capacity < needed:
+            capacity *= 2
+        labels = np.empty(capacity, dtype=np.int32)
+        labels[:self.size] = self._labels[:self.size]
+        self._labels = labels
+
+    def _reserve(self, extra):
+        self._reserve_labels(self.size + extra)
+        needed = self._tail_size + extra
+        if self._tail is not None and needed <= self._tail_capacity:
+            return
+        capacity = max(self._tail_capacity, 1)
+        while capacity < needed:
+            capacity *= 2
+        tail = np.empty((capacity, self.dim), dtype=np.float32)
+        if self._tail is not None:
+            tail[:self._tail_size] = self._tail[:self._tail_size]
+        if self.quantized:
+            tail_codes = np.empty((capacity, self.dim), dtype=CODE_DTYPES[self.precision])
+            tail_scales = np.empty(capacity, dtype=np.float32) if self.precision == "int8" else None
+            if self._tail_codes is not None:
+                tail_codes[:self._tail_size] = self._tail_codes[:self._tail_size]
+                if tail_scales is not None:
+                    tail_scales[:self._tail_size] = self._tail_scales[:self._tail_size]
+            self._tail_codes, self._tail_scales = tail_codes, tail_scales
+        self._tail = tail
+        self._tail_capacity = capacity
+
+    def add(self, name, embedding):
+        self.add_many([name], [embedding])
+
+    def add_many(self, names, embeddings):
+        if len(names) == 0:
+            return
+        vectors = normalize_rows(embeddings)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match gallery dimension {self.dim}")
+
+        self._reserve(len(vectors))
+        start = self.size
+        self._tail[self._tail_size:self._tail_size + len(vectors)] = vectors
+        if self.quantized:
+            codes, scales = quantize(vectors, self.precision)
+            self._tail_codes[self._tail_size:self._tail_size + len(vectors)] = codes
+            if scales is not None:
+                self._tail_scales[self._tail_size:self._tail_size + len(vectors)] = scales
+        for offset, name in enumerate(names):
+            label = self._label_id(name)
+            self._labels[start + offset] = label
+            self._counts[label] += 1
+            self._tail_members[label].append(start + offset)
+        np.add.at(self._centroid_sums, self._labels[start:start + len(vectors)], vectors)
+        self._centroids = None
+        self._tail_size += len(vectors)
+        self.index.add(start, vectors)
+
+    def similarities(self, embeddings):
+        return self.scores(normalize_rows(embeddings))
+
+    def search(self, embedding):
+        return self.search_batch([embedding])[0]
+
+    def search_batch(self, embeddings):
+        if len(embeddings) == 0:
+            return []
+        if self.size == 0:
+            return [(None, 0) for _ in range(len(embeddings))]
+
+        best_scores, best_rows = self.index.search(normalize_rows(embeddings), k=1)
+        return [(self.names[self._labels[row]], float(score)) if row >= 0 and score > 0 else (None, 0)
+                for row, score in zip(best_rows[:, 0], best_scores[:, 0])]
+
+    def search_frames(self, embeddings, frames=None, threshold=0.0, shortlist=32, method="hungarian"):
+        # Like search_batch(), but faces that share a frame id (one frame
+        # when frames is None) are matched one-to-one: a person is given to
+        # at most one face per frame. One index search covers every frame;
+        # each face's best score per person among its `shortlist` nearest
+        # rows forms the face x person matrix that gets assigned. A face
+        # that lost its only above-threshold person to a better-matching
+        # face comes back as (None, its best score).
+        if len(embeddings) == 0:
+            return []
+        if self.size == 0:
+            return [(None, 0) for _ in range(len(embeddings))]
+
+        best_scores, best_rows = self.index.search(normalize_rows(embeddings), k=shortlist)
+        labels = np.where(best_rows >= 0, self._labels[np.maximum(best_rows, 0)], -1)
+        results = [(self.names[labels[i, 0]], float(best_scores[i, 0])) if labels[i, 0] >= 0 else (None, 0)
+                   for i in range(len(embeddings))]
+        frames = np.zeros(len(embeddings), dtype=np.int64) if frames is None else np.asarray(frames)
+        for frame in np.unique(frames):
+            faces = np.flatnonzero(frames == frame)
+            if len(faces) < 2:
+                continue
+            people, columns = np.unique(labels[faces], return_inverse=True)
+            columns = columns.reshape(len(faces), -1)
+            scores = np.full((len(faces), len(people)), -np.inf, dtype=np.float32)
+            np.maximum.at(scores, (np.repeat(np.arange(len(faces)), columns.shape[1]), columns.ravel()),
+                          best_scores[faces].ravel())
+            scores[:, people < 0] = -np.inf
+            assigned = set()
+            for row, col in assign(scores, threshold, method):
+                if scores[row, col] > threshold:
+                    results[faces[row]] = (self.names[people[col]], float(scores[row, col]))
+                    assigned.add(row)
+            for row in range(len(faces)):
+                # Faces left without an above-threshold person keep their
+                # best score, unnamed if someone else took that person
+                if row not in assigned and results[faces[row]][1] > threshold:
+                    results[faces[row]] = (None, results[faces[row]][1])
+        return results
+
+    def search_identities(self, embeddings, k=5, aggregate="max", top_m=3, shortlist=16):
+        # Top-k people per embedding as [(name, score), ...], best first.
+        # A first pass against per-person centroids keeps the `shortlist`
+        # closest people; unless aggregate is "centroid" only those are
+        # scored on their own samples, by the best one ("max") or the mean
+        # of the best `top_m` ("top_m_mean").
+        if aggregate not in IDENTITY_AGGREGATES:
+            raise ValueError(f"Unknown aggregate '{aggregate}', expected one of {list(IDENTITY_AGGREGATES)}")
+        if len(embeddings) == 0:
+            return []
+        if self.size == 0:
+            return [[] for _ in range(len(embeddings))]
+
+        queries = normalize_rows(embeddings)
+        width = k if aggregate == "centroid" else max(k, shortlist)
+        # Names without samples (removed people, unused snapshot names) have
+        # a zero centroid; they must not be ranked, even with a score of 0
+        people_scores = queries @ self.centroids.T
+        people_scores[:, np.asarray(self._counts) == 0] = -np.inf
+        centroid_scores, shortlisted = top_k(people_scores, width)
+        results = []
+        for query, scores, labels in zip(queries, centroid_scores, shortlisted):
+            found = labels >= 0
+            labels, scores = labels[found], scores[found]
+            if aggregate != "centroid":
+                members = [self.member_rows(label) for label in labels]
+                sample_scores = self.rows(np.concatenate(members)) @ query
+                bounds = np.cumsum([0] + [len(rows) for rows in members])
+                for i in range(len(labels)):
+                    person = sample_scores[bounds[i]:bounds[i + 1]]
+                    if not len(person):
+                        scores[i] = -np.inf
+                        continue
+                    m = 1 if aggregate == "max" else min(top_m, len(person))
+                    scores[i] = np.partition(person, len(person) - m)[-m:].mean()
+                order = np.argsort(-scores)[:k]
+                labels, scores = labels[order], scores[order]
+            results.append([(self.names[label], float(score)) for label, score in zip(labels, scores)
+                            if np.isfinite(score)])
+        return results
+
+    @property
+    def centroids(self):
+        # Normalized mean of each person's samples, rebuilt lazily after adds
+        if self._centroids is None:
+            if self._base_sums_pending:
+                self._add_base_sums()
+            self._centroids = normalize_rows(self._centroid_sums[:len(self.names)])
+        return self._centroids
+
+    def _add_base_sums(self):
+        # Chunked so a mapped base is streamed once instead of copied
+        labels = self._labels[:self.base_size]
+        for start in range(0, self.base_size, 65536):
+            chunk_labels = labels[start:start + 65536]
+            order = np.argsort(chunk_labels, kind='stable')
+            people, first = np.unique(chunk_labels[order], return_index=True)
+            self._centroid_sums[people] += np.add.reduceat(self._base[start:start + 65536][order], first)
+        self._base_sums_pending = False
+
+    def member_rows(self, label):
+        if self._base_members is None:
+            labels = self._labels[:self.base_size]
+            counts = np.bincount(labels, minlength=len(self.names))
+            self._base_members = np.split(np.argsort(labels, kind='stable'), np.cumsum(counts)[:-1])
+        base = self._base_members[label] if label < len(self._base_members) else np.empty(0, dtype=np.int64)
+        tail = self._tail_members[label]
+        if not tail:
+            return base
+        return np.concatenate([base, np.asarray(tail, dtype=np.int64)])
+
+    def embeddings_for(self, name):
+        label = self._name_ids.get(name)
+        if label is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self.rows(self.member_rows(label))
+
+    def count(self, name):
+        label = self._name_ids.get(name)
+        return 0 if label is None else self._counts[label]
+
+    def counts(self):
+        return {name: count for name, count in zip(self.names, self._counts) if count}
+
+    # Dict-like view keyed by person name, kept for callers that used to
+    # iterate over the old {name: [embeddings]} mapping.
+    def __len__(self):
+        return sum(1 for count in self._counts if count)
+
+    def __contains__(self, name):
+        label = self._name_ids.get(name)
+        return label is not None and self._counts[label] > 0
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.embeddings_for(name)
+
+    def keys(self):
+        return [name for name, count in zip(self.names, self._counts) if count]
+
+    def items(self):
+        return [(name, self.embeddings_for(name)) for name in self.keys()]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class InferencePool:
+    # Runs blocking decode/ONNX inference off the event loop. Each worker
+    # thread owns one FaceAnalysis instance (ONNX Runtime releases the GIL
+    # while a session runs), loaded on the thread's first job or by
+    # warm_up(), and admission is bounded: at most `workers` jobs run and
+    # `max_queue` wait, anything beyond is rejected.
+    def __init__(self, recognizer, workers=2, max_queue=16, timeout=30.0):
+        self.recognizer = recognizer
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+
+        # The recognizer's own model instance serves the first worker
+        self._shared_claimed = False
+        self._claim_lock = threading.Lock()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def face_app(self):
+        face_app = getattr(self._local, "face_app", None)
+        if face_app is None:
+            with self._claim_lock:
+                shared = not self._shared_claimed
+                self._shared_claimed = True
+            face_app = self.recognizer.face_app if shared else self.recognizer.create_face_app()
+            self._local.face_app = face_app
+        return face_app
+
+    def warm_up(self):
+        # Loads and exercises the model on every worker thread. The barrier
+        # keeps each job on its own thread until all of them have loaded.
+        barrier = threading.Barrier(self.workers)
+
+        def load():
+            try:
+                self.recognizer.warm_up(self.face_app())
+            except BaseException:
+                barrier.abort()
+                raise
+            barrier.wait()
+
+        for future in [self._executor.submit(load) for _ in range(self.workers)]:
+            future.result()
+
+    def _release(self, _future):
+        with self._inflight_lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, timeout=None):
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"Inference queue is full ({self.workers} running, {self.max_queue} queued)")
+        with self._inflight_lock:
+            self._inflight += 1
+
+        future = self._executor.submit(fn, *args)
+        # The slot is freed when the job really ends, not when the caller
+        # stops waiting, so timed-out jobs still count against the bound.
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout if timeout is not None else self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
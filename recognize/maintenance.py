@@ -0,0 +1,205 @@
+import argparse
+import csv
+import gzip
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from crop_writer import locked_pack, scan_pack, split_reference
+from storage import FaceStore
+
+
+def time_queries(store, repeat=5):
+    # Best-of-`repeat` milliseconds for the lookups the recognizer and the
+    # server run
+    conn = store.connection()
+    sample = conn.execute("SELECT person_name, image_path FROM face_embeddings ORDER BY id DESC LIMIT 1").fetchone()
+    person_name, image_path = sample if sample else ("", "")
+    image_hash = conn.execute("SELECT content_hash FROM processed_images ORDER BY id DESC LIMIT 1").fetchone()
+    queries = {
+        "person counts": ("SELECT person_name, COUNT(*) FROM face_embeddings GROUP BY person_name", ()),
+        "embeddings of one person": ("SELECT id FROM face_embeddings WHERE person_name = ?", (person_name,)),
+        "embeddings of one image": ("SELECT id FROM face_embeddings WHERE image_path = ?", (image_path,)),
+        "processed image by hash": ("SELECT 1 FROM processed_images WHERE content_hash = ?",
+                                    (image_hash[0] if image_hash else "",)),
+        "pending reviews": ("SELECT id FROM review_queue WHERE status = 'pending'", ()),
+    }
+
+    timings = {}
+    for title, (sql, params) in queries.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - start)
+        timings[title] = best * 1000
+    return timings
+
+
+def rotate_training_log(store, archive_dir, keep_days, chunk_size, pause, dry_run=False):
+    # Moves rows older than keep_days into a gzipped CSV, one short
+    # transaction per chunk. A chunk is written to the archive before it is
+    # deleted, so an interruption can only duplicate rows, never lose them.
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+    archive_path = Path(archive_dir) / f"training_log-{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz"
+    archived = 0
+    last_id = 0
+    writer = None
+    archive = None
+    try:
+        while True:
+            rows = store.training_log_before(cutoff, last_id, chunk_size)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            archived += len(rows)
+            if dry_run:
+                continue
+            if writer is None:
+                archive_path.parent.mkdir(parents=True, exist_ok=True)
+                archive = gzip.open(archive_path, "wt", newline="")
+                writer = csv.writer(archive)
+                writer.writerow(["id", "image_path", "person_name", "action", "timestamp", "confidence"])
+            writer.writerows(rows)
+            archive.flush()
+            store.delete_training_log([row[0] for row in rows])
+            time.sleep(pause)
+    finally:
+        if archive is not None:
+            archive.close()
+    return archived, (archive_path if archived and not dry_run else None)
+
+
+def prune_missing_images(store, base_dir, chunk_size, pause, dry_run=False, grace_minutes=10):
+    # Embeddings whose dataset image was deleted. Rows without a path are
+    # kept, and crops stored in a pack count as present while their record
+    # is in it. A row is committed before the crop writer has written its
+    # crop, so rows younger than `grace_minutes` are not checked at all;
+    # packs are read under the writer's lock so a half-appended record is
+    # not read either. The generation bump at the end makes every
+    # recognizer reload.
+    base_dir = Path(base_dir)
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=grace_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+    packs = {}
+
+    def exists(image_path):
+        path, digest = split_reference(image_path)
+        path = base_dir / path
+        if digest is None:
+            return path.exists()
+        if not path.exists():
+            return False
+        known = packs.setdefault(path, [{}, 0])
+        if digest not in known[0]:
+            # Pick up records appended since the last look
+            with locked_pack(path) as pack:
+                appended, known[1] = scan_pack(pack, known[1])
+            known[0].update(appended)
+        return digest in known[0]
+
+    removed = 0
+    last_id = 0
+    while True:
+        rows = store.embedding_image_paths(last_id, chunk_size, created_before=cutoff)
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        missing = [row_id for row_id, image_path in rows if image_path and not exists(image_path)]
+        if missing and not dry_run:
+            store.delete_embeddings(missing)
+            time.sleep(pause)
+        removed += len(missing)
+    if removed and not dry_run:
+        store.bump_embeddings_generation()
+    return removed
+
+
+def vacuum_incrementally(store, pages_per_step, pause):
+    page_size, _, free_pages, auto_vacuum = store.page_usage()
+    if auto_vacuum != 2:
+        return None
+    freed = 0
+    while free_pages:
+        store.incremental_vacuum(pages_per_step)
+        remaining = store.page_usage()[2]
+        if remaining >= free_pages:
+            break
+        freed += free_pages - remaining
+        free_pages = remaining
+        time.sleep(pause)
+    return freed * page_size
+
+
+def database_bytes(db_path):
+    return sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Database maintenance: indexes, training_log rotation, pruning and incremental vacuum. "
+                    "Safe to run next to a live server: every step works in short transactions.")
+    parser.add_argument("--db-path", default="face_embeddings.db")
+    parser.add_argument("--archive-dir", help="where rotated training_log rows go (default <db-path>.archive)")
+    parser.add_argument("--keep-log-days", type=float, default=30, help="training_log rows newer than this stay")
+    parser.add_argument("--prune-missing", action="store_true",
+                        help="delete embeddings whose dataset image no longer exists")
+    parser.add_argument("--prune-grace-minutes", type=float, default=10,
+                        help="embeddings newer than this are never pruned (their crop may still be queued)")
+    parser.add_argument("--base-dir", default=".", help="relative image paths are resolved against this")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per transaction")
+    parser.add_argument("--vacuum-pages", type=int, default=1000, help="pages freed per vacuum step")
+    parser.add_argument("--pause", type=float, default=0.01, help="seconds between chunks, to let writers in")
+    parser.add_argument("--full-vacuum", action="store_true",
+                        help="one blocking VACUUM; needed once for databases created without incremental vacuum")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be rotated or pruned")
+    args = parser.parse_args()
+
+    store = FaceStore(args.db_path)
+    store.init_schema()
+    size_before = database_bytes(args.db_path)
+
+    archive_dir = args.archive_dir or Path(args.db_path).with_suffix(".archive")
+    archived, archive_path = rotate_training_log(store, archive_dir, args.keep_log_days, args.chunk_size,
+                                                 args.pause, args.dry_run)
+    if archive_path:
+        print(f"📦 Archived {archived} training_log rows to {archive_path}")
+    else:
+        print(f"📦 {archived} training_log rows {'would be ' if args.dry_run else ''}archived")
+
+    if args.prune_missing:
+        removed = prune_missing_images(store, args.base_dir, args.chunk_size, args.pause, args.dry_run,
+                                       args.prune_grace_minutes)
+        print(f"🧹 {removed} embeddings of deleted images {'would be ' if args.dry_run else ''}removed")
+
+    # Timed on the rotated and pruned tables, so the comparison shows what
+    # the indexes alone bought
+    before = time_queries(store)
+    created = [] if args.dry_run else store.ensure_indexes()
+    print(f"🗂️ Indexes created: {', '.join(created) if created else 'none needed'}")
+    after = time_queries(store) if created else before
+
+    if not args.dry_run:
+        if args.full_vacuum:
+            start = time.perf_counter()
+            store.full_vacuum()
+            print(f"🧽 Full VACUUM took {time.perf_counter() - start:.1f}s")
+        freed = vacuum_incrementally(store, args.vacuum_pages, args.pause)
+        if freed is None:
+            print("🧽 Incremental vacuum is off for this database; run once with --full-vacuum to enable it")
+        else:
+            print(f"🧽 Incremental vacuum freed {freed / 1024 / 1024:.1f} MB")
+        store.connection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    size_after = database_bytes(args.db_path)
+    store.close()
+
+    print(f"\n📊 Database size {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+    print("   Query times before -> after indexing:")
+    for title in before:
+        speedup = before[title] / after[title] if after[title] > 0 else float("inf")
+        print(f"   - {title}: {before[title]:.2f} ms -> {after[title]:.2f} ms ({speedup:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Milliseconds, wide enough for sub-millisecond gallery matches and
+# multi-second CPU detection
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter",
+                f"{self.name} {_format_value(self.value)}"]
+
+
+class Gauge:
+    # A value read at scrape time from `fn`, or set explicitly
+    def __init__(self, name, description="", fn=None):
+        self.name = name
+        self.description = description
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.fn() if self.fn is not None else self.value
+
+    def render(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(self.snapshot())}"]
+
+
+class Histogram:
+    # Cumulative-bucket histogram in the Prometheus style
+    def __init__(self, name, buckets, description=""):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        # Observes the elapsed milliseconds of the with-block
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets, self.bucket_counts):
+                running += count
+                cumulative.append((bound, running))
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "buckets": cumulative,
+            }
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for bound, count in snapshot["buckets"]:
+            lines.append(f'{self.name}_bucket{{le="{_format_value(float(bound))}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+        lines.append(f"{self.name}_sum {_format_value(float(snapshot['sum']))}")
+        lines.append(f"{self.name}_count {snapshot['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = factory()
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, description=""):
+        return self._get_or_create(name, lambda: Counter(name, description))
+
+    def histogram(self, name, buckets, description=""):
+        return self._get_or_create(name, lambda: Histogram(name, buckets, description))
+
+    def gauge(self, name, description="", fn=None):
+        gauge = self._get_or_create(name, lambda: Gauge(name, description, fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render_prometheus(self):
+        # Text exposition format 0.0.4
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,80 @@
+import argparse
+
+from crop_writer import split_reference
+from storage import FaceStore
+
+
+def move_to_person(face_path, person_name):
+    # An accepted crop moves from unknown/ to the person's folder. Pack
+    # crops (pack#digest) stay put: the pack holds everyone's crops.
+    path, digest = split_reference(face_path)
+    if digest is not None or path.parent.name != "unknown" or not path.exists():
+        return face_path
+    target = path.parent.parent / person_name / path.name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    path.replace(target)
+    return target
+
+
+def print_pending(rows):
+    for review_id, image_path, face_path, suggested_name, similarity, reason in rows:
+        suggestion = f"{suggested_name} ({similarity:.2f})" if suggested_name else f"no suggestion ({similarity:.2f})"
+        print(f"#{review_id} [{reason}] {image_path}")
+        print(f"    face: {face_path}")
+        print(f"    suggested: {suggestion}")
+
+
+def review_interactively(store, rows):
+    # Accepted faces are enrolled in face_embeddings; running recognizers
+    # pick them up on their next gallery refresh
+    counts = {'accepted': 0, 'rejected': 0, 'skipped': 0}
+    for review_id, image_path, face_path, suggested_name, similarity, reason in rows:
+        print_pending([(review_id, image_path, face_path, suggested_name, similarity, reason)])
+        prompt = f"Name (Enter = {suggested_name}" if suggested_name else "Name (Enter = skip"
+        answer = input(f"{prompt}, 'r' = reject, 's' = skip, 'q' = quit): ").strip()
+        if answer.lower() == 'q':
+            break
+        if answer.lower() == 's' or (not answer and not suggested_name):
+            counts['skipped'] += 1
+            continue
+        if answer.lower() == 'r':
+            if store.reject_review(review_id):
+                counts['rejected'] += 1
+                print(f"🗑️ Rejected #{review_id}")
+            continue
+        person_name = answer or suggested_name
+        if store.accept_review(review_id, person_name, lambda path: move_to_person(path, person_name)):
+            counts['accepted'] += 1
+            print(f"✅ Enrolled #{review_id} as {person_name}")
+        else:
+            print(f"⏭️ #{review_id} was already resolved")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List and resolve faces that bulk enrollment queued for review")
+    parser.add_argument("--db-path", default="face_embeddings.db")
+    parser.add_argument("--list", action="store_true", help="only list pending reviews")
+    parser.add_argument("--limit", type=int, default=-1, help="at most this many reviews (-1 = all)")
+    args = parser.parse_args()
+
+    store = FaceStore(args.db_path)
+    store.init_schema()
+    rows = store.pending_reviews(args.limit)
+    if not rows:
+        print("✅ No faces waiting for review")
+        store.close()
+        return
+
+    print(f"📋 {len(rows)} face(s) waiting for review")
+    if args.list:
+        print_pending(rows)
+    else:
+        counts = review_interactively(store, rows)
+        print(f"\n📊 Accepted {counts['accepted']}, rejected {counts['rejected']}, skipped {counts['skipped']}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
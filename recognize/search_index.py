@@ -0,0 +1,322 @@
+import heapq
+import math
+
+import numpy as np
+
+
+def top_k(scores, k):
+    # Row-wise top-k of a (queries x candidates) score matrix, best first.
+    # Missing slots are padded with id -1 and score -inf.
+    num_queries, num_candidates = scores.shape
+    ids = np.full((num_queries, k), -1, dtype=np.int64)
+    best = np.full((num_queries, k), -np.inf, dtype=np.float32)
+    if num_candidates == 0:
+        return best, ids
+
+    kk = min(k, num_candidates)
+    if kk == 1:
+        part = np.argmax(scores, axis=1)[:, None]
+    elif kk < num_candidates:
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+    else:
+        part = np.tile(np.arange(num_candidates), (num_queries, 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    ids[:, :kk] = np.take_along_axis(part, order, axis=1)
+    best[:, :kk] = np.take_along_axis(part_scores, order, axis=1)
+    return best, ids
+
+
+def spherical_kmeans(vectors, k, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    assignment = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        # Re-seed empty clusters with random points instead of dropping them
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / norms[:, None]
+    return centroids.astype(np.float32), assignment
+
+
+def rerank(gallery, queries, candidates, k):
+    # Full-precision top-k among each query's candidate rows (-1 = no candidate)
+    valid = candidates >= 0
+    rows = gallery.rows(np.where(valid, candidates, 0).ravel()).reshape(*candidates.shape, -1)
+    scores = np.einsum('qcd,qd->qc', rows, queries)
+    scores[~valid] = -np.inf
+    best, order = top_k(scores, k)
+    ids = np.where(order >= 0, np.take_along_axis(candidates, np.maximum(order, 0), axis=1), -1)
+    return best, ids
+
+
+class BruteForceIndex:
+    # Exact search: one matrix product against the whole gallery. On a
+    # quantized gallery the product runs over the compressed rows and the
+    # best gallery.rerank candidates are re-scored at full precision.
+    name = "exact"
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def add(self, start, vectors):
+        pass
+
+    def state(self):
+        return None
+
+    def search(self, queries, k=1):
+        if not self.gallery.quantized:
+            return top_k(self.gallery.scores(queries), k)
+        _, candidates = top_k(self.gallery.approximate_scores(queries), max(k, self.gallery.rerank))
+        return rerank(self.gallery, queries, candidates, k)
+
+
+class IVFIndex:
+    # Inverted-file index: a k-means coarse quantizer partitions the gallery
+    # and a query only scans the rows of its `nprobe` closest lists.
+    #
+    # Without a fixed `nlist`, the quantizer has ~4*sqrt(N) lists for the N
+    # rows it was trained on, and is retrained once the gallery has grown
+    # `retrain_growth` times past that, so lists stay short as it grows.
+    name = "ivf"
+
+    def __init__(self, gallery, nlist=None, nprobe=8, min_train_size=1024, retrain_growth=2.0, seed=0):
+        self.gallery = gallery
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+        self._arrays = []
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self):
+        matrix = self.gallery.matrix
+        nlist = self.nlist or max(1, int(4 * math.sqrt(len(matrix))))
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(matrix), nlist * 64)
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        self.centroids, _ = spherical_kmeans(sample, nlist, seed=self.seed)
+        self.trained_size = len(matrix)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._arrays = [None] * len(self.centroids)
+        self._assign(0, matrix)
+
+    def _assign(self, start, vectors):
+        # One argmax for the whole block, then the rows are grouped by list
+        # so each touched list is extended once
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        touched, first = np.unique(assignment[order], return_index=True)
+        for list_id, rows in zip(touched.tolist(), np.split(order + start, first[1:])):
+            self._lists[list_id].extend(rows.tolist())
+            self._arrays[list_id] = None
+
+    def _list_ids(self, list_id):
+        array = self._arrays[list_id]
+        if array is None:
+            array = np.asarray(self._lists[list_id], dtype=np.int64)
+            self._arrays[list_id] = array
+        return array
+
+    def add(self, start, vectors):
+        size = self.gallery.size
+        if not self.trained:
+            if size >= self.min_train_size:
+                self.train()
+        elif self.nlist is None and self.retrain_growth and size >= self.trained_size * self.retrain_growth:
+            self.train()
+        else:
+            self._assign(start, vectors)
+
+    def state(self):
+        # Arrays that restore() turns back into this index without retraining
+        if not self.trained:
+            return None
+        assignment = np.empty(sum(len(ids) for ids in self._lists), dtype=np.int32)
+        for list_id in range(len(self._lists)):
+            assignment[self._list_ids(list_id)] = list_id
+        return {"centroids": self.centroids, "assignment": assignment}
+
+    def restore(self, state):
+        self.centroids = np.asarray(state["centroids"], dtype=np.float32)
+        assignment = state["assignment"]
+        # The restored rows are what a retrain would be measured against
+        self.trained_size = len(assignment)
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        self._arrays = np.split(np.argsort(assignment, kind='stable').astype(np.int64), np.cumsum(counts)[:-1])
+        self._lists = [ids.tolist() for ids in self._arrays]
+
+    def search(self, queries, k=1):
+        if not self.trained:
+            return top_k(self.gallery.scores(queries), k)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        _, probes = top_k(queries @ self.centroids.T, nprobe)
+        best = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._list_ids(list_id) for list_id in probes[i]])
+            if len(candidates) == 0:
+                continue
+            scores = self.gallery.rows(candidates) @ query
+            row_best, row_ids = top_k(scores[None, :], k)
+            best[i] = row_best[0]
+            found = row_ids[0] >= 0
+            ids[i, found] = candidates[row_ids[0][found]]
+        return best, ids
+
+
+class HNSWIndex:
+    # Hierarchical navigable small-world graph over the gallery rows.
+    # Vectors are never copied: the graph stores row ids into the gallery.
+    name = "hnsw"
+
+    def __init__(self, gallery, M=16, ef_construction=100, ef_search=64, seed=0):
+        self.gallery = gallery
+        self.M = M
+        self.max_neighbors_0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(M)
+        self._rng = np.random.default_rng(seed)
+        self._layers = []
+        self._entry = None
+        self._max_level = -1
+
+    def _search_layer(self, query, entry_points, ef, layer):
+        graph = self._layers[layer]
+        visited = set(entry_points)
+        entry_scores = self.gallery.rows(entry_points) @ query
+        candidates = [(-float(score), node) for score, node in zip(entry_scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(score), node) for score, node in zip(entry_scores, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in graph.get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            scores = self.gallery.rows(neighbors) @ query
+            for score, neighbor in zip(scores.tolist(), neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _prune(self, node, layer, limit):
+        neighbors = self._layers[layer][node]
+        if len(neighbors) <= limit:
+            return
+        scores = self.gallery.rows(neighbors) @ self.gallery.rows([node])[0]
+        keep = np.argsort(-scores)[:limit]
+        self._layers[layer][node] = [neighbors[i] for i in keep]
+
+    def _insert(self, node, vector):
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        while len(self._layers) <= level:
+            self._layers.append({})
+
+        if self._entry is None:
+            for layer in range(level + 1):
+                self._layers[layer][node] = []
+            self._entry = node
+            self._max_level = level
+            return
+
+        entry_points = [self._entry]
+        for layer in range(self._max_level, level, -1):
+            entry_points = [max(self._search_layer(vector, entry_points, 1, layer))[1]]
+
+        for layer in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(vector, entry_points, self.ef_construction, layer)
+            neighbors = [n for _, n in heapq.nlargest(self.M, found)]
+            self._layers[layer][node] = neighbors
+            limit = self.max_neighbors_0 if layer == 0 else self.M
+            for neighbor in neighbors:
+                self._layers[layer][neighbor].append(node)
+                self._prune(neighbor, layer, limit)
+            entry_points = [n for _, n in found]
+
+        for layer in range(self._max_level + 1, level + 1):
+            self._layers[layer][node] = []
+        if level > self._max_level:
+            self._entry = node
+            self._max_level = level
+
+    def add(self, start, vectors):
+        for offset, vector in enumerate(vectors):
+            self._insert(start + offset, vector)
+
+    def state(self):
+        # Each layer as sorted node ids plus CSR-style neighbor lists
+        if self._entry is None:
+            return None
+        state = {"entry": np.array([self._entry, self._max_level], dtype=np.int64)}
+        for layer, graph in enumerate(self._layers):
+            nodes = sorted(graph)
+            state[f"nodes_{layer}"] = np.asarray(nodes, dtype=np.int64)
+            state[f"offsets_{layer}"] = np.cumsum([0] + [len(graph[node]) for node in nodes], dtype=np.int64)
+            state[f"neighbors_{layer}"] = np.asarray([n for node in nodes for n in graph[node]], dtype=np.int64)
+        return state
+
+    def restore(self, state):
+        self._entry, self._max_level = (int(value) for value in state["entry"])
+        self._layers = []
+        for layer in range(self._max_level + 1):
+            nodes = state[f"nodes_{layer}"].tolist()
+            offsets = state[f"offsets_{layer}"].tolist()
+            neighbors = state[f"neighbors_{layer}"].tolist()
+            self._layers.append({node: neighbors[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)})
+
+    def search(self, queries, k=1):
+        best = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if self._entry is None:
+            return best, ids
+
+        ef = max(self.ef_search, k)
+        for i, query in enumerate(queries):
+            entry_points = [self._entry]
+            for layer in range(self._max_level, 0, -1):
+                entry_points = [max(self._search_layer(query, entry_points, 1, layer))[1]]
+            found = heapq.nlargest(k, self._search_layer(query, entry_points, ef, 0))
+            for j, (score, node) in enumerate(found):
+                best[i, j] = score
+                ids[i, j] = node
+        return best, ids
+
+
+SEARCH_INDEXES = {
+    BruteForceIndex.name: BruteForceIndex,
+    IVFIndex.name: IVFIndex,
+    HNSWIndex.name: HNSWIndex,
+}
+
+
+def make_index(kind, gallery, **options):
+    if kind not in SEARCH_INDEXES:
+        raise ValueError(f"Unknown search index '{kind}', expected one of {sorted(SEARCH_INDEXES)}")
+    return SEARCH_INDEXES[kind](gallery, **options)
@@ -1,12 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 from face_recognition_system import IncrementalFaceRecognition
+from inference_pool import InferencePool, PoolSaturated
+from batching import MicroBatcher
+from metrics import REGISTRY
+from detection_cache import content_hash
+from gallery import IDENTITY_AGGREGATES
+from tracking import FaceTracker
+from decoding import DecodedImage
 import cv2
 import numpy as np
 from io import BytesIO
 from PIL import Image
 import os
+import asyncio
+import itertools
+import struct
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 app = FastAPI()
 
@@ -23,54 +38,401 @@ app.add_middleware(
 recognizer = IncrementalFaceRecognition(
     dataset_path="dataset_arcface",
     similarity_threshold=0.6,
-    confidence_threshold=0.8
+    confidence_threshold=0.8,
+    det_size=(int(os.environ.get("FACE_DET_SIZE", 640)),) * 2,
+    min_face_size=int(os.environ.get("FACE_MIN_FACE_SIZE", 0)),
+    embedding_precision=os.environ.get("FACE_EMBEDDING_PRECISION", "float32")
 )
 
+decode_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("FACE_DECODE_WORKERS", 4)))
+
+# Blocking inference runs on a bounded pool of preloaded model instances
+inference_pool = InferencePool(
+    recognizer,
+    workers=int(os.environ.get("FACE_INFERENCE_WORKERS", 2)),
+    max_queue=int(os.environ.get("FACE_QUEUE_DEPTH", 16)),
+    timeout=float(os.environ.get("FACE_REQUEST_TIMEOUT", 30))
+)
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+# Limits on what one uploaded archive may expand to
+ZIP_MAX_ENTRIES = int(os.environ.get("FACE_ZIP_MAX_ENTRIES", 1000))
+ZIP_MAX_ENTRY_BYTES = int(os.environ.get("FACE_ZIP_MAX_ENTRY_MB", 20)) * 1024 * 1024
+ZIP_MAX_TOTAL_BYTES = int(os.environ.get("FACE_ZIP_MAX_TOTAL_MB", 200)) * 1024 * 1024
+
+# /stream frames are binary messages: a big-endian uint64 frame id followed
+# by the encoded image
+FRAME_HEADER = struct.Struct(">Q")
+
+# Identities are assigned one-to-one per image; micro-batches mix faces from
+# several images, so every image's faces carry their own frame id
+FRAME_IDS = itertools.count()
+
+# Set once every inference worker has loaded and exercised its model
+models_ready = threading.Event()
+
+# With several server processes (FACE_SERVER_WORKERS) each one maps the
+# shared embedding snapshot and polls the database for rows enrolled by the
+# others, so all workers agree within about one poll interval
+GALLERY_POLL_SECONDS = float(os.environ.get("FACE_GALLERY_POLL_SECONDS", 1.0))
+gallery_refresh_stop = threading.Event()
+
+REGISTRY.gauge("face_models_ready", "1 once models are loaded and warm", lambda: int(models_ready.is_set()))
+REGISTRY.gauge("face_gallery_embeddings", "Embeddings in the in-memory gallery", lambda: recognizer.known_faces.size)
+REGISTRY.gauge("face_gallery_people", "People in the in-memory gallery", lambda: len(recognizer.known_faces))
+REGISTRY.gauge("face_gallery_private_rows", "Gallery rows held outside the shared snapshot",
+               lambda: recognizer.known_faces.size - recognizer.known_faces.base_size)
+REGISTRY.gauge("face_gallery_watermark", "Last face_embeddings row id applied to the gallery",
+               lambda: recognizer.embeddings_watermark)
+REGISTRY.gauge("face_inference_inflight", "Inference jobs running or queued", lambda: inference_pool.inflight)
+
+
+def decode_image(contents):
+    nparr = np.frombuffer(contents, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+def decode_upload(contents, det_size=None):
+    # Large JPEGs are decoded at reduced resolution, close to the size the
+    # detector works at; boxes still come back in upload coordinates
+    return DecodedImage.decode(contents, det_size or recognizer.det_size)
+
+
+def format_faces(faces, matches, candidates=None):
+    results = []
+    for i, (face_data, (best_match, similarity)) in enumerate(zip(faces, matches)):
+        bbox = face_data['bbox']
+        confidence = face_data['confidence']
+        
+        if best_match is not None and similarity > recognizer.similarity_threshold:
+            person_name = best_match
+            match_confidence = similarity
+        else:
+            person_name = "unknown"
+            match_confidence = 0.0
+        
+        result = {
+            "person_name": person_name,
+            "confidence": float(match_confidence),
+            "bbox": bbox.tolist(),
+            "detection_confidence": float(confidence)
+        }
+        if candidates is not None:
+            result["candidates"] = [{"person_name": name, "score": score} for name, score in candidates[i]]
+        results.append(result)
+    return results
+
+
+def expand_zip(contents):
+    # (name, bytes) of every file in the archive, within the ZIP_MAX_*
+    # limits. The sizes in the archive's headers can lie, so the
+    # decompressed bytes are counted as they are read.
+    def too_large(detail):
+        return HTTPException(status_code=413, detail=detail)
+
+    entries = []
+    total = 0
+    with zipfile.ZipFile(BytesIO(contents)) as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+        if len(infos) > ZIP_MAX_ENTRIES:
+            raise too_large(f"Zip archive has more than {ZIP_MAX_ENTRIES} files")
+        for info in infos:
+            if info.file_size > ZIP_MAX_ENTRY_BYTES:
+                raise too_large(f"{info.filename} is larger than {ZIP_MAX_ENTRY_BYTES} bytes uncompressed")
+            with archive.open(info) as member:
+                data = member.read(ZIP_MAX_ENTRY_BYTES + 1)
+            if len(data) > ZIP_MAX_ENTRY_BYTES:
+                raise too_large(f"{info.filename} is larger than {ZIP_MAX_ENTRY_BYTES} bytes uncompressed")
+            total += len(data)
+            if total > ZIP_MAX_TOTAL_BYTES:
+                raise too_large(f"Zip archive expands to more than {ZIP_MAX_TOTAL_BYTES} bytes")
+            entries.append((info.filename, data))
+    return entries
+
+
+async def read_uploads(files):
+    # Zip archives are expanded in place so results keep the upload order;
+    # the expansion runs off the event loop
+    loop = asyncio.get_running_loop()
+    uploads = []
+    for file in files:
+        contents = await file.read()
+        if file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip"):
+            uploads.extend(await loop.run_in_executor(decode_executor, expand_zip, contents))
+        else:
+            uploads.append((file.filename, contents))
+    return uploads
+
+
+def parse_det_size(det_size):
+    if det_size is None:
+        return None
+    if det_size % 32 or not 160 <= det_size <= 1280:
+        raise HTTPException(status_code=400, detail="det_size must be a multiple of 32 between 160 and 1280")
+    return (det_size, det_size)
+
+
+def parse_top_k(top_k, aggregate):
+    if top_k is not None and not 1 <= top_k <= 50:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+    if aggregate is not None and aggregate not in IDENTITY_AGGREGATES:
+        raise HTTPException(status_code=400, detail=f"aggregate must be one of {', '.join(IDENTITY_AGGREGATES)}")
+
+
+def detect_image(contents, det_size=None):
+    # Runs on an inference worker thread: decode, detect and align only
+    image = decode_upload(contents, det_size)
+    if image is None:
+        return None
+    return recognizer.align_faces_batch([image], face_app=inference_pool.face_app(), det_size=det_size,
+                                        crops=False)[0]
+
+
+def detect_images(images, det_size=None):
+    return recognizer.align_faces_batch(images, face_app=inference_pool.face_app(), det_size=det_size,
+                                        crops=False)
+
+
+def embed_and_match(items):
+    # One recognition-model batch and one gallery search for (frame id, crop)
+    # items gathered from every request in the current micro-batch
+    embeddings = recognizer.embed_crops([crop for _, crop in items], face_app=inference_pool.face_app())
+    return list(zip(embeddings, recognizer.find_frame_matches(embeddings, [frame for frame, _ in items])))
+
+
+async def match_faces(faces_per_image):
+    # Matches for every face of every image, flattened in order
+    faces = [face_data for image_faces in faces_per_image for face_data in image_faces]
+    items = []
+    for image_faces in faces_per_image:
+        frame = next(FRAME_IDS)
+        items.extend((frame, face_data.pop('aligned')) for face_data in image_faces)
+    results = await batcher.submit(items)
+    for face_data, (embedding, _) in zip(faces, results):
+        face_data['embedding'] = embedding
+    return [match for _, match in results]
+
+
+def load_cached_faces(hashes, config):
+    # Byte-identical uploads reuse their detections and embeddings; only
+    # the gallery match is recomputed. (faces, matches) per hash, or
+    # (None, None) for a miss.
+    results = []
+    for image_hash in hashes:
+        faces = recognizer.detection_cache.get(image_hash, config)
+        if faces is None:
+            results.append((None, None))
+        else:
+            results.append((faces, recognizer.find_frame_matches([face_data['embedding'] for face_data in faces])))
+    return results
+
+
+async def cached_faces(hashes, config):
+    # The cache read, its last-used write and the gallery search stay off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(decode_executor, load_cached_faces, hashes, config)
+
+
+async def cache_faces(entries, config):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(decode_executor, lambda: [
+        recognizer.detection_cache.put(image_hash, config, faces) for image_hash, faces in entries])
+
+
+class StreamSession:
+    # Per-connection state for /stream: the face tracker (boxes and smoothed
+    # identities carried between frames) and a one-frame slot. A frame that
+    # arrives while the previous one is still being processed replaces any
+    # frame still waiting, so a slow connection skips frames instead of
+    # falling further and further behind.
+    def __init__(self, detect_every):
+        self.tracker = FaceTracker(recognizer, detect_every=detect_every)
+        # A timed-out job may still be running when the next frame starts
+        self.tracker_lock = threading.Lock()
+        self.pending = None
+        self.dropped = 0
+        self.closed = False
+        self.frame_ready = asyncio.Event()
+
+    def offer(self, message):
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = message
+        self.frame_ready.set()
+
+    def close(self):
+        # Nobody is left to receive the result of a waiting frame
+        self.closed = True
+        self.pending = None
+        self.frame_ready.set()
+
+    async def next_frame(self):
+        while self.pending is None and not self.closed:
+            self.frame_ready.clear()
+            await self.frame_ready.wait()
+        message, self.pending = self.pending, None
+        return message
+
+    def track(self, contents):
+        # Runs on an inference worker thread
+        image = decode_image(contents)
+        if image is None:
+            return None
+        with self.tracker_lock:
+            tracks = self.tracker.process(image, face_app=inference_pool.face_app())
+        results = []
+        for track in tracks:
+            name, similarity = track.identity
+            results.append({
+                "track_id": track.id,
+                "person_name": name or "unknown",
+                "confidence": float(similarity) if name is not None else 0.0,
+                "bbox": track.bbox.astype(int).tolist()
+            })
+        return results
+
+
+async def run_inference(fn, *args):
+    try:
+        return await inference_pool.run(fn, *args)
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Inference timed out")
+
+
+batcher = MicroBatcher(
+    lambda items: run_inference(embed_and_match, items),
+    max_items=int(os.environ.get("FACE_BATCH_MAX_ITEMS", 32)),
+    max_wait_ms=float(os.environ.get("FACE_BATCH_MAX_WAIT_MS", 5)),
+    max_concurrent_batches=inference_pool.workers
+)
+
+
 @app.post("/recognize")
-async def recognize_face(file: UploadFile = File(...)):
+async def recognize_face(file: UploadFile = File(...), det_size: Optional[int] = None,
+                         top_k: Optional[int] = None, aggregate: Optional[str] = None):
     try:
         # Read the uploaded image
+        det_size = parse_det_size(det_size)
+        parse_top_k(top_k, aggregate)
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image_hash = content_hash(contents)
+        config = recognizer.detection_config(det_size, reduced_decode=True)
+        [(faces, matches)] = await cached_faces([image_hash], config)
         
-        if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image file")
+        if faces is None:
+            faces = await run_inference(detect_image, contents, det_size)
+            if faces is None:
+                raise HTTPException(status_code=400, detail="Invalid image file")
+            matches = await match_faces([faces])
+            await cache_faces([(image_hash, faces)], config)
         
-        # Process the image
-        faces, _ = recognizer.detect_faces(image)
+        # Ranked candidate identities per face, on request
+        candidates = None
+        if top_k is not None:
+            loop = asyncio.get_running_loop()
+            candidates = await loop.run_in_executor(
+                decode_executor, recognizer.find_top_identities,
+                [face_data['embedding'] for face_data in faces], top_k, aggregate)
+        return {"results": format_faces(faces, matches, candidates)}
         
-        results = []
-        for face_data in faces:
-            embedding = face_data['embedding']
-            bbox = face_data['bbox']
-            confidence = face_data['confidence']
-            
-            if len(recognizer.known_faces) > 0:
-                best_match, similarity = recognizer.find_best_match(embedding)
-                
-                if similarity > recognizer.similarity_threshold:
-                    person_name = best_match
-                    match_confidence = similarity
-                else:
-                    person_name = "unknown"
-                    match_confidence = 0.0
-            else:
-                person_name = "unknown"
-                match_confidence = 0.0
-            
-            results.append({
-                "person_name": person_name,
-                "confidence": float(match_confidence),
-                "bbox": bbox.tolist(),
-                "detection_confidence": float(confidence)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/recognize/batch")
+async def recognize_batch(files: List[UploadFile] = File(...), det_size: Optional[int] = None):
+    try:
+        det_size = parse_det_size(det_size)
+        uploads = await read_uploads(files)
+        config = recognizer.detection_config(det_size, reduced_decode=True)
+        loop = asyncio.get_running_loop()
+        hashes = await loop.run_in_executor(decode_executor, lambda: [content_hash(contents)
+                                                                      for _, contents in uploads])
+        cached = await cached_faces(hashes, config)
+        
+        # Only uploads missing from the cache are decoded and run through the models
+        misses = [i for i, (faces, _) in enumerate(cached) if faces is None]
+        images = await asyncio.gather(*[loop.run_in_executor(decode_executor, decode_upload, uploads[i][1], det_size)
+                                        for i in misses])
+        decoded = [i for i, image in zip(misses, images) if image is not None]
+        
+        faces_per_image = []
+        if decoded:
+            faces_per_image = await run_inference(detect_images, [image for image in images if image is not None],
+                                                  det_size)
+        
+        # Every face of every image goes through the scheduler in one submit
+        matches = await match_faces(faces_per_image)
+        
+        offset = 0
+        for i, faces in zip(decoded, faces_per_image):
+            cached[i] = (faces, matches[offset:offset + len(faces)])
+            offset += len(faces)
+        await cache_faces([(hashes[i], cached[i][0]) for i in decoded], config)
+        
+        batch_results = []
+        for (filename, _), (faces, face_matches) in zip(uploads, cached):
+            if faces is None:
+                batch_results.append({"filename": filename, "error": "Invalid image file"})
+                continue
+            batch_results.append({
+                "filename": filename,
+                "results": format_faces(faces, face_matches)
             })
         
-        return {"results": results}
+        return {"results": batch_results}
         
+    except HTTPException:
+        raise
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.websocket("/stream")
+async def stream_frames(websocket: WebSocket, detect_every: int = 5):
+    await websocket.accept()
+    session = StreamSession(detect_every)
+    
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    session.offer(message["bytes"])
+        finally:
+            session.close()
+    
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            message = await session.next_frame()
+            if message is None:
+                break
+            if len(message) <= FRAME_HEADER.size:
+                await websocket.send_json({"error": "Expected a frame id followed by an encoded image"})
+                continue
+            frame_id = FRAME_HEADER.unpack_from(message)[0]
+            try:
+                faces = await run_inference(session.track, message[FRAME_HEADER.size:])
+            except HTTPException:
+                # Saturated or timed out: skip this frame like any other stale one
+                session.dropped += 1
+                continue
+            if faces is None:
+                await websocket.send_json({"frame_id": frame_id, "error": "Invalid image"})
+                continue
+            await websocket.send_json({"frame_id": frame_id, "faces": faces, "dropped": session.dropped})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
 @app.get("/stats")
 async def get_statistics():
     try:
@@ -79,5 +441,55 @@ async def get_statistics():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+async def readiness():
+    # For orchestrator readiness probes: 503 until the models are warm
+    if not models_ready.is_set():
+        raise HTTPException(status_code=503, detail="Models are loading", headers={"Retry-After": "1"})
+    return {"status": "ready", "workers": inference_pool.workers}
+
+def warm_up_models():
+    try:
+        inference_pool.warm_up()
+        models_ready.set()
+        print("✅ Models loaded and warm")
+    except Exception as e:
+        print(f"❌ Model warm-up failed: {str(e)}")
+
+def refresh_gallery():
+    while not gallery_refresh_stop.wait(GALLERY_POLL_SECONDS):
+        try:
+            recognizer.refresh_gallery()
+        except Exception as e:
+            print(f"❌ Gallery refresh failed: {str(e)}")
+
+@app.on_event("startup")
+def startup():
+    if GALLERY_POLL_SECONDS > 0:
+        threading.Thread(target=refresh_gallery, name="gallery-refresh", daemon=True).start()
+    if os.environ.get("FACE_WARM_UP", "1") == "0":
+        # Models load on the first request instead
+        models_ready.set()
+        return
+    threading.Thread(target=warm_up_models, name="model-warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown():
+    gallery_refresh_stop.set()
+    inference_pool.shutdown()
+    decode_executor.shutdown(wait=False)
+    recognizer.close()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    workers = int(os.environ.get("FACE_SERVER_WORKERS", 1))
+    if workers > 1:
+        # Bring the snapshot up to date first so every worker maps it instead
+        # of replaying the table into private memory
+        recognizer.save_snapshot()
+        uvicorn.run("server:app", host="0.0.0.0", port=5000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
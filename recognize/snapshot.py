@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from quantization import quantize
+
+
+class EmbeddingSnapshot:
+    # On-disk copy of the gallery: a flat float32 .npy of normalized
+    # embeddings, a parallel int32 label array, and meta.json holding the
+    # label names plus the last face_embeddings row id it covers (watermark).
+    #
+    # Loading maps the .npy read-only, so every process that opens the same
+    # snapshot shares the same page-cache pages instead of private copies.
+    #
+    # With a precision other than float32 the quantized rows (and int8
+    # scales) are written and mapped alongside the float32 ones.
+    #
+    # A search index built over the snapshot rows (IVF lists, HNSW graph)
+    # can be saved next to it with save_index(); it is keyed on the
+    # snapshot's data files and the index settings, and removed with them.
+    def __init__(self, directory, precision="float32"):
+        self.directory = Path(directory)
+        self.precision = precision
+
+    @property
+    def meta_path(self):
+        return self.directory / "meta.json"
+
+    def version(self):
+        # Changes whenever save() swaps in a new meta.json; cheap enough to
+        # poll (one stat, no parsing)
+        try:
+            stat = os.stat(self.meta_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def load(self, generation=None):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            # Rows were deleted or rewritten since this snapshot was taken
+            if generation is not None and meta.get("generation") != generation:
+                return None
+            matrix = np.load(self.directory / meta["embeddings"], mmap_mode="r")
+            labels = np.load(self.directory / meta["labels"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(matrix) != len(labels) or len(matrix) != meta.get("count"):
+            return None
+        codes = scales = None
+        if self.precision != "float32" and meta.get("precision") == self.precision:
+            try:
+                codes = np.load(self.directory / meta["codes"], mmap_mode="r")
+                if meta.get("scales"):
+                    scales = np.load(self.directory / meta["scales"], mmap_mode="r")
+            except (OSError, ValueError, KeyError):
+                codes = scales = None
+        return {
+            "matrix": matrix,
+            "labels": labels,
+            "names": meta["names"],
+            "watermark": meta["watermark"],
+            "generation": meta.get("generation"),
+            "codes": codes,
+            "scales": scales,
+            "key": Path(meta["embeddings"]).stem,
+        }
+
+    def _index_path(self, snapshot, kind, options):
+        settings = hashlib.blake2b(json.dumps(options, sort_keys=True).encode(), digest_size=4).hexdigest()
+        return self.directory / f"index-{kind}-{settings}-{snapshot['key']}.npz"
+
+    def load_index(self, snapshot, kind, options):
+        # Saved index state for a loaded snapshot, None if there is none
+        try:
+            with np.load(self._index_path(snapshot, kind, options)) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, snapshot, kind, options, state):
+        path = self._index_path(snapshot, kind, options)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        try:
+            np.savez(tmp_path, **state)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Only a startup-time optimization; the next load rebuilds it
+            pass
+
+    def save(self, matrix, labels, names, watermark, generation=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Versioned data files plus an atomic meta.json swap: readers that
+        # still map an older file keep a valid view until they reopen.
+        suffix = f"{watermark}-{os.getpid()}"
+        embeddings_name = f"embeddings-{suffix}.npy"
+        labels_name = f"labels-{suffix}.npy"
+        np.save(self.directory / embeddings_name, np.ascontiguousarray(matrix, dtype=np.float32))
+        np.save(self.directory / labels_name, np.asarray(labels, dtype=np.int32))
+        keep = {embeddings_name, labels_name}
+
+        codes_name = scales_name = None
+        if self.precision != "float32":
+            codes, scales = quantize(matrix, self.precision)
+            codes_name = f"codes-{self.precision}-{suffix}.npy"
+            np.save(self.directory / codes_name, codes)
+            keep.add(codes_name)
+            if scales is not None:
+                scales_name = f"scales-{suffix}.npy"
+                np.save(self.directory / scales_name, scales)
+                keep.add(scales_name)
+
+        meta = {
+            "embeddings": embeddings_name,
+            "labels": labels_name,
+            "names": list(names),
+            "watermark": int(watermark),
+            "generation": generation,
+            "count": int(len(matrix)),
+            "dim": int(matrix.shape[1]) if len(matrix) else None,
+            "precision": self.precision,
+            "codes": codes_name,
+            "scales": scales_name,
+        }
+        tmp_path = self.directory / f"meta.json.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self._remove_stale(keep)
+
+    def _remove_stale(self, keep):
+        # Saved indexes belong to the data files they were built over
+        for path in [*self.directory.glob("*.npy"), *self.directory.glob("index-*.npz")]:
+            if path.name not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
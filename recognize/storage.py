@@ -0,0 +1,424 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from metrics import REGISTRY, LATENCY_BUCKETS
+
+TRANSACTION_LATENCY = REGISTRY.histogram("face_db_transaction_ms", LATENCY_BUCKETS,
+                                         "Write transaction time from BEGIN to COMMIT")
+QUERY_LATENCY = REGISTRY.histogram("face_db_query_ms", LATENCY_BUCKETS, "Read query time")
+ROWS_WRITTEN = REGISTRY.counter("face_db_rows_written_total", "Rows written through FaceStore")
+
+
+INSERT_EMBEDDING = '''
+    INSERT INTO face_embeddings (person_name, embedding, image_path, confidence)
+    VALUES (?, ?, ?, ?)
+'''
+
+INSERT_LOG = '''
+    INSERT INTO training_log (image_path, person_name, action, confidence)
+    VALUES (?, ?, ?, ?)
+'''
+
+INSERT_PROCESSED = '''
+    INSERT OR IGNORE INTO processed_images (image_path, content_hash)
+    VALUES (?, ?)
+'''
+
+INSERT_REVIEW = '''
+    INSERT INTO review_queue (image_path, face_path, embedding, suggested_name, similarity, reason)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Created by maintenance.py rather than init_schema(): building them on a
+# large existing database takes a while and should not stall a startup
+MAINTENANCE_INDEXES = {
+    "idx_face_embeddings_person": "face_embeddings (person_name)",
+    "idx_face_embeddings_image_path": "face_embeddings (image_path)",
+    "idx_training_log_timestamp": "training_log (timestamp)",
+    "idx_review_queue_status": "review_queue (status)",
+}
+
+INSERT_CACHED_DETECTION = '''
+    INSERT OR REPLACE INTO detection_cache (content_hash, config, faces, size_bytes, last_used)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+class FaceStore:
+    # Owns the SQLite connections for the recognizer. Each thread gets one
+    # long-lived WAL-mode connection (a small pool for the FastAPI server),
+    # and writes made inside batch() are committed together in a single
+    # transaction instead of one fsync per row.
+    def __init__(self, db_path, timeout=30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                                   isolation_level=None, check_same_thread=False)
+            # Only takes effect on a new database file; lets maintenance.py
+            # return free pages in small steps instead of a full VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        self.flush()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        if getattr(self._local, "in_transaction", False):
+            yield conn
+            return
+        with self._write_lock, TRANSACTION_LATENCY.time():
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.in_transaction = True
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._local.in_transaction = False
+
+    @contextmanager
+    def batch(self):
+        # Queue writes in memory and commit them in one transaction on exit.
+        # Nothing is held open while the caller works (e.g. waits on input()).
+        # If the body raises, the queued writes are dropped, not committed.
+        if getattr(self._local, "pending", None) is not None:
+            yield
+            return
+        self._local.pending = []
+        try:
+            yield
+        except BaseException:
+            self._local.pending = None
+            raise
+        self.flush()
+
+    def flush(self):
+        pending = getattr(self._local, "pending", None)
+        self._local.pending = None
+        if not pending:
+            return
+        with self.transaction() as conn:
+            # Consecutive writes of the same kind go through one executemany
+            start = 0
+            while start < len(pending):
+                sql = pending[start][0]
+                end = start
+                while end < len(pending) and pending[end][0] == sql:
+                    end += 1
+                conn.executemany(sql, [params for _, params in pending[start:end]])
+                start = end
+        ROWS_WRITTEN.inc(len(pending))
+
+    def _write(self, sql, params):
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            pending.append((sql, params))
+            return
+        with self.transaction() as conn:
+            conn.execute(sql, params)
+        ROWS_WRITTEN.inc()
+
+    def _query(self, sql, params=(), one=False):
+        with QUERY_LATENCY.time():
+            cursor = self.connection().execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS face_embeddings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    person_name TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    image_path TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    confidence REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS training_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    image_path TEXT,
+                    person_name TEXT,
+                    action TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    confidence REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS processed_images (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    image_path TEXT UNIQUE,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(processed_images)")}
+            if "content_hash" not in columns:
+                # Older databases only recorded the path
+                conn.execute("ALTER TABLE processed_images ADD COLUMN content_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_images_hash ON processed_images (content_hash)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS review_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    image_path TEXT,
+                    face_path TEXT,
+                    embedding BLOB NOT NULL,
+                    suggested_name TEXT,
+                    similarity REAL,
+                    reason TEXT,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS detection_cache (
+                    content_hash TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    faces BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, config)
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_detection_cache_last_used ON detection_cache (last_used)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+
+    def save_embedding(self, person_name, embedding, image_path, confidence=1.0):
+        embedding_blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        self._write(INSERT_EMBEDDING, (person_name, embedding_blob, str(image_path), float(confidence)))
+
+    def log_action(self, image_path, person_name, action, confidence=1.0):
+        self._write(INSERT_LOG, (str(image_path), person_name, action, float(confidence)))
+
+    def mark_processed(self, image_path, content_hash=None):
+        self._write(INSERT_PROCESSED, (str(image_path), content_hash))
+
+    def queue_review(self, image_path, face_path, embedding, suggested_name, similarity, reason):
+        embedding_blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        self._write(INSERT_REVIEW, (str(image_path), str(face_path), embedding_blob,
+                                    suggested_name, float(similarity), reason))
+
+    def pending_reviews(self, limit=-1):
+        return self._query('''
+            SELECT id, image_path, face_path, suggested_name, similarity, reason
+            FROM review_queue WHERE status = 'pending' ORDER BY id LIMIT ?
+        ''', (limit,))
+
+    def accept_review(self, review_id, person_name, relocate=None):
+        # Enrolls the queued face under person_name and closes the review.
+        # Returns False if it was not pending (e.g. resolved by someone else).
+        # relocate(face_path) may move the crop and return its new path; it
+        # runs inside the transaction, so a failed move leaves it pending.
+        with self.transaction() as conn:
+            row = conn.execute("SELECT image_path, face_path, embedding FROM review_queue "
+                               "WHERE id = ? AND status = 'pending'", (int(review_id),)).fetchone()
+            if row is None:
+                return False
+            image_path, face_path, embedding_blob = row
+            if relocate is not None:
+                face_path = str(relocate(face_path))
+            conn.execute(INSERT_EMBEDDING, (person_name, embedding_blob, face_path, 1.0))
+            conn.execute(INSERT_LOG, (image_path, person_name, "REVIEW_ACCEPTED", 1.0))
+            conn.execute("UPDATE review_queue SET status = 'accepted' WHERE id = ?", (int(review_id),))
+        ROWS_WRITTEN.inc(3)
+        return True
+
+    def reject_review(self, review_id):
+        with self.transaction() as conn:
+            updated = conn.execute("UPDATE review_queue SET status = 'rejected' WHERE id = ? AND status = 'pending'",
+                                   (int(review_id),)).rowcount
+        ROWS_WRITTEN.inc(updated)
+        return bool(updated)
+
+    def load_embeddings(self, after_id=0):
+        return self._query(
+            "SELECT id, person_name, embedding FROM face_embeddings WHERE id > ? ORDER BY id", (after_id,))
+
+    def get_meta(self, key, default=None):
+        row = self._query("SELECT value FROM store_meta WHERE key = ?", (key,), one=True)
+        return default if row is None else row[0]
+
+    def embeddings_generation(self):
+        # Bumped by anything that deletes or rewrites face_embeddings rows, so
+        # readers of derived data (e.g. the mmap snapshot) know to rebuild.
+        return int(self.get_meta("embeddings_generation", 0))
+
+    def replace_embeddings(self, delete_ids, rows):
+        # Atomically swaps a set of rows for new ones (person_name, embedding,
+        # image_path, confidence); derived data is invalidated by the bump
+        params = [(name, np.asarray(embedding, dtype=np.float32).tobytes(),
+                   None if path is None else str(path), float(confidence))
+                  for name, embedding, path, confidence in rows]
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM face_embeddings WHERE id = ?", [(int(row_id),) for row_id in delete_ids])
+            conn.executemany(INSERT_EMBEDDING, params)
+            self.bump_embeddings_generation()
+        ROWS_WRITTEN.inc(len(delete_ids) + len(params))
+
+    def embedding_paths(self, ids):
+        ids = [int(row_id) for row_id in ids]
+        paths = {}
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            paths.update(self._query(
+                f"SELECT id, image_path FROM face_embeddings WHERE id IN ({placeholders})", chunk))
+        return paths
+
+    def bump_embeddings_generation(self):
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT INTO store_meta (key, value) VALUES ('embeddings_generation', '1')
+                ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            ''')
+
+    def claim_lease(self, key, owner, ttl):
+        # Cross-process mutual exclusion through store_meta: succeeds if the
+        # lease is free, expired or already held by `owner`
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                holder, _, expires = row[0].rpartition("@")
+                if holder != owner and float(expires) > now:
+                    return False
+            conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+                         (key, f"{owner}@{now + ttl}"))
+        return True
+
+    def release_lease(self, key, owner):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM store_meta WHERE key = ? AND value LIKE ?", (key, f"{owner}@%"))
+
+    def load_processed(self):
+        return self._query("SELECT image_path, content_hash FROM processed_images")
+
+    def cached_detection(self, content_hash, config):
+        return self._query(
+            "SELECT faces, last_used FROM detection_cache WHERE content_hash = ? AND config = ?",
+            (content_hash, config), one=True)
+
+    def has_cached_detection(self, content_hash, config):
+        return self._query(
+            "SELECT 1 FROM detection_cache WHERE content_hash = ? AND config = ?",
+            (content_hash, config), one=True) is not None
+
+    def cache_detection(self, content_hash, config, faces_blob, last_used):
+        with self.transaction() as conn:
+            conn.execute(INSERT_CACHED_DETECTION, (content_hash, config, faces_blob, len(faces_blob), last_used))
+        ROWS_WRITTEN.inc()
+
+    def touch_cached_detection(self, content_hash, config, last_used):
+        with self.transaction() as conn:
+            conn.execute("UPDATE detection_cache SET last_used = ? WHERE content_hash = ? AND config = ?",
+                         (last_used, content_hash, config))
+
+    def evict_detections(self, max_entries, max_bytes):
+        # Drop least recently used entries until both limits hold
+        with self.transaction() as conn:
+            return conn.execute('''
+                DELETE FROM detection_cache WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid,
+                               ROW_NUMBER() OVER (ORDER BY last_used DESC) AS position,
+                               SUM(size_bytes) OVER (ORDER BY last_used DESC
+                                                     ROWS UNBOUNDED PRECEDING) AS running_bytes
+                        FROM detection_cache
+                    ) WHERE position > ? OR running_bytes > ?
+                )
+            ''', (max_entries, max_bytes)).rowcount
+
+    def detection_cache_usage(self):
+        return self._query("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM detection_cache", one=True)
+
+    def ensure_indexes(self):
+        # Names of the indexes that had to be created
+        existing = {row[0] for row in self._query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        created = []
+        for name, target in MAINTENANCE_INDEXES.items():
+            if name not in existing:
+                with self.transaction() as conn:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+                created.append(name)
+        if created:
+            self.connection().execute("ANALYZE")
+        return created
+
+    def training_log_before(self, cutoff, after_id=0, limit=1000):
+        # cutoff is an SQLite datetime string (UTC, like CURRENT_TIMESTAMP)
+        return self._query('''
+            SELECT id, image_path, person_name, action, timestamp, confidence FROM training_log
+            WHERE id > ? AND timestamp < ? ORDER BY id LIMIT ?
+        ''', (after_id, cutoff, limit))
+
+    def delete_training_log(self, ids):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM training_log WHERE id = ?", [(int(row_id),) for row_id in ids])
+        ROWS_WRITTEN.inc(len(ids))
+
+    def embedding_image_paths(self, after_id=0, limit=1000, created_before=None):
+        # created_before is an SQLite datetime string (UTC); newer rows are left out
+        if created_before is None:
+            return self._query(
+                "SELECT id, image_path FROM face_embeddings WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        return self._query('''
+            SELECT id, image_path FROM face_embeddings WHERE id > ? AND created_at < ? ORDER BY id LIMIT ?
+        ''', (after_id, created_before, limit))
+
+    def delete_embeddings(self, ids):
+        # Callers bump the embeddings generation once they are done
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM face_embeddings WHERE id = ?", [(int(row_id),) for row_id in ids])
+        ROWS_WRITTEN.inc(len(ids))
+
+    def page_usage(self):
+        # (page_size, page_count, freelist_count, auto_vacuum mode)
+        conn = self.connection()
+        return tuple(conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                     for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"))
+
+    def full_vacuum(self):
+        # Rewrites the whole file, blocking writers until done. Also switches
+        # a database created before incremental auto-vacuum over to it.
+        with self._write_lock:
+            conn = self.connection()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+    def incremental_vacuum(self, pages):
+        # Frees at most `pages` pages in one short write transaction
+        with self.transaction() as conn:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+import cv2
+import numpy as np
+import websockets
+
+
+FRAME_HEADER = struct.Struct(">Q")
+
+
+async def send_frames(websocket, capture, fps, quality, sent_at):
+    # Paces frames at the source rate (fps 0 = as fast as possible), the
+    # way a camera would deliver them
+    frame_id = 0
+    start = time.perf_counter()
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            continue
+        sent_at[frame_id] = time.perf_counter()
+        await websocket.send(FRAME_HEADER.pack(frame_id) + encoded.tobytes())
+        frame_id += 1
+        if fps:
+            await asyncio.sleep(max(0.0, start + frame_id / fps - time.perf_counter()))
+        else:
+            await asyncio.sleep(0)
+    return frame_id
+
+
+async def receive_results(websocket, sent_at, latencies, state, verbose):
+    async for message in websocket:
+        result = json.loads(message)
+        if "error" in result:
+            print(f"❌ Frame {result.get('frame_id')}: {result['error']}")
+            continue
+        frame_id = result["frame_id"]
+        latencies.append(time.perf_counter() - sent_at.pop(frame_id, time.perf_counter()))
+        state["results"] += 1
+        state["dropped"] = result["dropped"]
+        if verbose:
+            faces = ", ".join(f"#{face['track_id']} {face['person_name']} ({face['confidence']:.2f})"
+                              for face in result["faces"])
+            print(f"🎞️ Frame {frame_id}: {faces or 'no faces'}")
+
+
+async def run(args):
+    source = int(args.source) if args.source.isdigit() else args.source
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        print(f"❌ Could not open video source {args.source}")
+        return
+    fps = args.fps if args.fps is not None else (capture.get(cv2.CAP_PROP_FPS) or 0)
+
+    sent_at = {}
+    latencies = []
+    state = {"results": 0, "dropped": 0}
+    url = f"{args.url}?detect_every={args.detect_every}"
+    async with websockets.connect(url, max_size=None) as websocket:
+        receiver = asyncio.create_task(receive_results(websocket, sent_at, latencies, state, not args.quiet))
+        sent = await send_frames(websocket, capture, fps, args.quality, sent_at)
+        # Give the server a moment to answer the frames still in flight
+        deadline = time.perf_counter() + args.drain
+        while state["results"] + state["dropped"] < sent and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        receiver.cancel()
+    capture.release()
+
+    print(f"📊 Sent {sent} frames at {fps:.1f} fps: {state['results']} results, "
+          f"{state['dropped']} dropped by the server as stale")
+    if latencies:
+        latencies_ms = np.array(latencies) * 1000
+        print(f"   - Latency p50 {np.percentile(latencies_ms, 50):.1f} ms, "
+              f"p95 {np.percentile(latencies_ms, 95):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a video file or camera to the /stream endpoint")
+    parser.add_argument("source", help="video file path or camera index")
+    parser.add_argument("--url", default="ws://localhost:5000/stream")
+    parser.add_argument("--fps", type=float, default=None, help="send rate (default: source fps, 0 = unpaced)")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality of the sent frames")
+    parser.add_argument("--detect-every", type=int, default=5, help="frames between full detections")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for results after the last frame")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
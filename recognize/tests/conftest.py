@@ -0,0 +1,52 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# The modules in recognize/ import each other by bare name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import FakeDetector, FakeFaceAnalysis
+
+
+def install_fake_models(monkeypatch):
+    import insightface.app
+    monkeypatch.setattr(insightface.app, "FaceAnalysis", FakeFaceAnalysis)
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    # Stand-in detection/recognition models, so no model download is needed
+    install_fake_models(monkeypatch)
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    # Holds the fake detector until set
+    gate = threading.Event()
+    monkeypatch.setattr(FakeDetector, "gate", gate)
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def recognizer(fake_models, tmp_path):
+    from face_recognition_system import IncrementalFaceRecognition
+    recognizer = IncrementalFaceRecognition(dataset_path=str(tmp_path / "dataset"),
+                                            db_path=str(tmp_path / "faces.db"))
+    yield recognizer
+    recognizer.close()
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    # server.py builds its recognizer at import, in the working directory, so
+    # every test module shares one import and one working directory
+    from fastapi.testclient import TestClient
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("server"))
+        install_fake_models(monkeypatch)
+        import server
+        yield TestClient(server.app)
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class FakeDetector:
+    # Finds (first pixel's blue value % 4) faces in a row across the image.
+    # Tests can set `gate` to a threading.Event to hold detection until it
+    # is set, like a slow model.
+    input_size = (640, 640)
+    gate = None
+
+    def prepare(self, ctx_id, **kwargs):
+        pass
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        if FakeDetector.gate is not None:
+            FakeDetector.gate.wait()
+        height, width = img.shape[:2]
+        count = int(img[0, 0, 0]) % 4
+        boxes = np.array([[width * 0.2 * i + 4, height * 0.1, width * 0.2 * i + width * 0.18, height * 0.6, 0.9]
+                          for i in range(count)], dtype=np.float32).reshape(-1, 5)
+        kps = np.array([[[x + 10, height * 0.2], [x + 30, height * 0.2], [x + 20, height * 0.3],
+                         [x + 12, height * 0.4], [x + 28, height * 0.4]] for x in boxes[:, 0]],
+                       dtype=np.float32).reshape(count, 5, 2)
+        return boxes, kps
+
+
+class FakeRecognizer:
+    # Embeds a crop as a deterministic function of its pixels
+    input_size = (112, 112)
+    taskname = 'recognition'
+
+    def prepare(self, ctx_id, **kwargs):
+        pass
+
+    def get_feat(self, imgs):
+        return np.stack([np.resize(img.astype(np.float32).ravel()[::37], 512) + 1 for img in imgs])
+
+
+class FakeFaceAnalysis:
+    def __init__(self, name='buffalo_l', root='~', allowed_modules=None, providers=None, **kwargs):
+        self.det_model = FakeDetector()
+        self.models = {'detection': self.det_model, 'recognition': FakeRecognizer()}
+
+    def prepare(self, ctx_id=0, det_size=(640, 640), det_thresh=0.5):
+        pass
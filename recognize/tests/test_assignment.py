@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from gallery import FaceGallery, normalize_rows
+from test_gallery import people_matrix
+
+
+@pytest.mark.parametrize("index, options", [("exact", {}), ("ivf", {"min_train_size": 256}),
+                                            ("hnsw", {"ef_construction": 40})])
+@pytest.mark.parametrize("method", ["hungarian", "greedy"])
+def test_search_frames_gives_a_person_to_one_face_per_frame(index, options, method):
+    matrix, labels, names, centers = people_matrix(people=20, samples=30)
+    gallery = FaceGallery(index=index, index_options=options)
+    gallery.attach_base(matrix, labels, names)
+    rng = np.random.default_rng(1)
+    # Two look-alikes of person_5 in frame 0 (the first closer), one in frame 1
+    queries = normalize_rows(centers[[5, 5, 5, 9]] + [[0.0], [0.3], [0.0], [0.0]] * rng.standard_normal((4, 64)))
+    results = gallery.search_frames(queries, frames=[0, 0, 1, 0], threshold=0.5, method=method)
+    assert [name for name, _ in results] == ["person_5", None, "person_5", "person_9"]
+    # The unassigned face keeps its score for callers that report it
+    assert results[1][1] > 0.5
+
+    unconstrained = gallery.search_batch(queries)
+    assert [name for name, _ in unconstrained] == ["person_5", "person_5", "person_5", "person_9"]
+
+
+def test_unknown_frame_assignment_is_rejected(fake_models, tmp_path):
+    from face_recognition_system import IncrementalFaceRecognition
+    with pytest.raises(ValueError):
+        IncrementalFaceRecognition(dataset_path=str(tmp_path / "dataset"), db_path=str(tmp_path / "faces.db"),
+                                   frame_assignment="optimal")
+
+
+def test_process_image_rematches_after_a_correction(recognizer, monkeypatch):
+    axes = np.eye(512, dtype=np.float32)
+    crop = np.zeros((112, 112, 3), dtype=np.uint8)
+    recognizer.add_face_sample("xavier", axes[0], crop, "xavier")
+    # Both faces resemble xavier, the first more; one-to-one matching
+    # leaves the second unnamed until the first turns out to be someone else
+    faces = [{'embedding': 0.70 * axes[0] + np.sqrt(1 - 0.70 ** 2) * axes[1], 'face_img': crop,
+              'bbox': np.array([0, 0, 10, 10]), 'confidence': 0.9},
+             {'embedding': 0.65 * axes[0] + np.sqrt(1 - 0.65 ** 2) * axes[2], 'face_img': crop,
+              'bbox': np.array([20, 0, 30, 10]), 'confidence': 0.9}]
+    monkeypatch.setattr(recognizer, "detect_faces", lambda image_path: (faces, None))
+    answers = iter(["n", "yolanda", "y"])
+    monkeypatch.setattr("builtins.input", lambda *args: next(answers))
+
+    results = recognizer.process_image("frame.jpg", show_images=False)
+    assert [result['person_name'] for result in results] == ["yolanda", "xavier"]
+    assert recognizer.known_faces.counts() == {"xavier": 2, "yolanda": 1}
+
+
+def test_scipy_is_not_imported_at_startup():
+    # scipy.optimize costs about half a second to import; only frames that
+    # need an assignment should pay for it
+    code = "import sys, face_recognition_system; print('scipy.optimize' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parent.parent,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "False"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+
+    async def run_batch(crops):
+        calls.append(list(crops))
+        return [crop * 10 for crop in crops]
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_items=32, max_wait_ms=50)
+        return await asyncio.gather(batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([4, 5, 6]))
+
+    results = asyncio.run(scenario())
+    assert calls == [[1, 2, 3, 4, 5, 6]]
+    # Each request gets back the results for its own crops, in order
+    assert results == [[10, 20], [30], [40, 50, 60]]
+
+
+def test_full_batch_runs_without_waiting():
+    calls = []
+
+    async def run_batch(crops):
+        calls.append(list(crops))
+        return crops
+
+    async def scenario():
+        # A full batch goes out at once instead of after the (long) wait
+        batcher = MicroBatcher(run_batch, max_items=3, max_wait_ms=10000)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([4, 5, 6])), 1.0)
+
+    results = asyncio.run(scenario())
+    assert calls == [[1, 2, 3], [4, 5, 6]]
+    assert results == [[1, 2], [3], [4, 5, 6]]
+
+
+def test_batch_failure_reaches_every_waiter():
+    async def run_batch(crops):
+        raise RuntimeError("model crashed")
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_wait_ms=50)
+        results = await asyncio.gather(batcher.submit([1]), batcher.submit([2, 3]), return_exceptions=True)
+        # The batcher keeps serving after a failed batch
+        batcher.run_batch = lambda crops: asyncio.sleep(0, result=crops)
+        return results, await batcher.submit([4])
+
+    results, after = asyncio.run(scenario())
+    assert len(results) == 2
+    for result in results:
+        assert isinstance(result, RuntimeError)
+        assert str(result) == "model crashed"
+    assert after == [4]
+
+
+def test_empty_submit_skips_the_model():
+    async def run_batch(crops):
+        pytest.fail("run_batch called for an empty request")
+
+    assert asyncio.run(MicroBatcher(run_batch).submit([])) == []
@@ -0,0 +1,84 @@
+import numpy as np
+
+from compaction import GalleryCompactor, rank1_correct
+from gallery import normalize_rows
+from storage import FaceStore
+
+
+def make_store(path, centers, samples, noise, seed, names=None):
+    names = names or [f"person_{person}" for person in range(len(centers))]
+    rng = np.random.default_rng(seed)
+    store = FaceStore(str(path))
+    store.init_schema()
+    with store.batch():
+        for name, center in zip(names, centers):
+            for i in range(samples):
+                embedding = normalize_rows(center + noise * rng.standard_normal(len(center)))[0]
+                store.save_embedding(name, embedding, f"{name}/{i}.jpg")
+    return store
+
+
+def rank1(store, probes, probe_names, threshold):
+    rows = store.load_embeddings()
+    names = np.array([person_name for _, person_name, _ in rows])
+    vectors = normalize_rows(np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows]))
+    people = sorted(set(names))
+    labels = np.array([people.index(name) for name in names])
+    probe_labels = np.array([people.index(name) for name in probe_names])
+    return rank1_correct(probes, probe_labels, vectors, labels, threshold)
+
+
+def test_compaction_keeps_rank1_results(tmp_path):
+    rng = np.random.default_rng(0)
+    # Look-alike people, so rank-1 is not trivially perfect
+    centers = (rng.standard_normal(64) + 0.1 * rng.standard_normal((12, 64))).astype(np.float32)
+    noise = 0.15
+    store = make_store(tmp_path / "faces.db", centers, samples=100, noise=noise, seed=1)
+
+    # Held-out probes: new samples of the same people, never stored
+    probe_people = np.repeat(np.arange(len(centers)), 20)
+    probes = normalize_rows(centers[probe_people] + noise * rng.standard_normal((len(probe_people), 64)))
+    probe_names = [f"person_{person}" for person in probe_people]
+    threshold = 0.6
+    before = rank1(store, probes, probe_names, threshold)
+
+    compactor = GalleryCompactor(store, max_prototypes=8, outliers=2, similarity_threshold=threshold)
+    report = compactor.compact()
+    assert report['applied']
+    assert report['rows_after'] < report['rows_before']
+    assert report['compacted_accuracy'] >= report['raw_accuracy']
+
+    after = rank1(store, probes, probe_names, threshold)
+    assert len(store.load_embeddings()) == report['rows_after']
+    assert after.sum() >= before.sum()
+    # No identity loses held-out probes it was identified on before
+    for person in range(len(centers)):
+        mine = probe_people == person
+        assert after[mine].sum() >= before[mine].sum()
+    store.close()
+
+
+def test_identity_that_would_regress_is_left_uncompacted(tmp_path):
+    # person_0 has two opposite looks that one centroid cannot represent;
+    # person_1 is a single tight cluster
+    axes = np.eye(16, dtype=np.float32)
+    store = make_store(tmp_path / "faces.db", [axes[0], -axes[0], axes[1]], samples=10, noise=0.01, seed=4,
+                       names=["person_0", "person_0", "person_1"])
+    report = GalleryCompactor(store, max_prototypes=1, outliers=0, similarity_threshold=0.6).compact()
+    assert report['skipped_identities'] == ['person_0']
+    assert report['compacted_accuracy'] >= report['raw_accuracy']
+    counts = {}
+    for _, person_name, _ in store.load_embeddings():
+        counts[person_name] = counts.get(person_name, 0) + 1
+    assert counts == {'person_0': 20, 'person_1': 1}
+    store.close()
+
+
+def test_dry_run_leaves_rows_untouched(tmp_path):
+    centers = np.random.default_rng(2).standard_normal((3, 32)).astype(np.float32)
+    store = make_store(tmp_path / "faces.db", centers, samples=60, noise=0.2, seed=3)
+    rows = store.load_embeddings()
+    report = GalleryCompactor(store, max_prototypes=4, outliers=1).compact(dry_run=True)
+    assert not report['applied'] and report['removed'] > 0
+    assert store.load_embeddings() == rows
+    store.close()
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from crop_writer import CropWriter, load_crop, split_reference
+from maintenance import prune_missing_images
+from storage import FaceStore
+
+
+def crop(value):
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    image[::2, ::3] = value
+    return image
+
+
+def test_pack_crops_load_by_digest(tmp_path):
+    writer = CropWriter(tmp_path, pack=True)
+    references = [writer.save(crop(value), "ann", f"img{value}") for value in range(1, 6)]
+    writer.close()
+    data = [load_crop(reference) for reference in references]
+    assert len(set(data)) == 5 and all(item.startswith(b"\xff\xd8") for item in data)
+
+    # Records appended later are found without rereading the whole pack
+    writer = CropWriter(tmp_path, pack=True)
+    later = writer.save(crop(9), "bob", "img9")
+    writer.close()
+    assert load_crop(later).startswith(b"\xff\xd8")
+    assert load_crop(references[0]) == data[0]
+
+
+def test_record_cut_short_is_dropped_before_appending(tmp_path):
+    writer = CropWriter(tmp_path, pack=True)
+    first = writer.save(crop(1), "ann", "img1")
+    second = writer.save(crop(2), "ann", "img2")
+    writer.close()
+    pack_path, _ = split_reference(first)
+    size = pack_path.stat().st_size
+    with open(pack_path, "r+b") as pack:
+        pack.truncate(size - 10)
+
+    writer = CropWriter(tmp_path, pack=True)
+    third = writer.save(crop(3), "ann", "img3")
+    again = writer.save(crop(2), "ann", "img2")
+    writer.close()
+    assert again == second
+    for reference in (first, second, third):
+        assert load_crop(reference).startswith(b"\xff\xd8")
+
+
+def test_prune_checks_pack_records(tmp_path):
+    writer = CropWriter(tmp_path / "dataset", pack=True)
+    kept = writer.save(crop(1), "ann", "img1")
+    writer.close()
+    store = FaceStore(str(tmp_path / "faces.db"))
+    store.init_schema()
+    embedding = np.ones(8, dtype=np.float32)
+    store.save_embedding("ann", embedding, kept)
+    store.save_embedding("ann", embedding, f"{split_reference(kept)[0]}#{'0' * 32}")
+    store.save_embedding("ann", embedding, f"{tmp_path / 'gone.pack'}#{'1' * 32}")
+    # Fresh rows may still have their crop queued in a writer: left alone
+    assert prune_missing_images(store, "/", chunk_size=2, pause=0) == 0
+    with store.transaction() as conn:
+        conn.execute("UPDATE face_embeddings SET created_at = datetime('now', '-1 hour')")
+    store.save_embedding("ann", embedding, tmp_path / "dataset" / "ann" / "queued.jpg")
+    assert prune_missing_images(store, "/", chunk_size=2, pause=0) == 2
+    assert [path for _, path in store.embedding_image_paths()] == [str(kept),
+                                                                   str(tmp_path / "dataset" / "ann" / "queued.jpg")]
+    store.close()
+
+
+def test_appends_reach_the_file_before_the_lock_is_released(tmp_path, monkeypatch):
+    import crop_writer
+    import fcntl
+    pack_path = tmp_path / "faces.pack"
+    sizes = []
+
+    def flock(fd, operation):
+        if operation == fcntl.LOCK_UN:
+            sizes.append(pack_path.stat().st_size)
+        fcntl.flock(fd, operation)
+
+    monkeypatch.setattr(crop_writer, "fcntl", SimpleNamespace(
+        flock=flock, LOCK_SH=fcntl.LOCK_SH, LOCK_EX=fcntl.LOCK_EX, LOCK_UN=fcntl.LOCK_UN))
+    with crop_writer.locked_pack(pack_path, "ab") as pack:
+        pack.write(b"x" * 1000)
+    assert sizes == [1000]
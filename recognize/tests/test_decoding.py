@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+from decoding import DecodedImage, jpeg_size
+
+
+# A bright square on a dark 2560x1920 photo, in full-resolution pixels
+SQUARE = (1200, 400, 1800, 1000)
+
+
+def photo(fmt=".jpg"):
+    image = np.full((1920, 2560, 3), 30, dtype=np.uint8)
+    x1, y1, x2, y2 = SQUARE
+    image[y1:y2, x1:x2] = 220
+    return cv2.imencode(fmt, image)[1].tobytes()
+
+
+class SquareDetector:
+    # Reports the bright region of the image it is given as one face
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        ys, xs = np.nonzero(img[:, :, 0] > 128)
+        x1, y1, x2, y2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        w, h = x2 - x1, y2 - y1
+        kps = np.array([[x1 + 0.3 * w, y1 + 0.4 * h], [x1 + 0.7 * w, y1 + 0.4 * h], [x1 + 0.5 * w, y1 + 0.6 * h],
+                        [x1 + 0.35 * w, y1 + 0.8 * h], [x1 + 0.65 * w, y1 + 0.8 * h]], dtype=np.float32)
+        return np.array([[x1, y1, x2, y2, 0.9]], dtype=np.float32), kps[None]
+
+
+def test_jpeg_size_reads_the_header_only():
+    assert jpeg_size(photo()) == (2560, 1920)
+    assert jpeg_size(photo(".png")) is None
+    assert jpeg_size(b"not an image") is None
+
+
+def test_large_jpeg_is_decoded_reduced():
+    decoded = DecodedImage.decode(photo(), det_size=(640, 640))
+    # 2560x1920 fits 640x640 at 1/4 at most
+    assert decoded.reduced
+    assert decoded.scale == 4.0
+    assert decoded.image.shape == (480, 640, 3)
+    assert decoded._original is None
+    assert decoded.original().shape == (1920, 2560, 3)
+
+
+@pytest.mark.parametrize("data, det_size, scale", [
+    (photo(".png"), (640, 640), 1.0),
+    (photo(), None, 1.0),
+    (photo(), (1280, 1280), 2.0),
+    (photo(), (2560, 2560), 1.0),
+])
+def test_reduction_stops_at_the_detector_size(data, det_size, scale):
+    # Only JPEGs are reduced, and never below what the detector resizes to
+    decoded = DecodedImage.decode(data, det_size=det_size)
+    assert decoded.scale == scale
+    assert decoded.image.shape[:2] == (1920 / scale, 2560 / scale)
+
+
+def test_undecodable_bytes():
+    assert DecodedImage.decode(b"not an image", det_size=(640, 640)) is None
+
+
+def test_boxes_on_reduced_decode_map_back_to_full_resolution(recognizer):
+    recognizer.face_app.det_model = SquareDetector()
+    reduced = DecodedImage.decode(photo(), det_size=(640, 640))
+    full = DecodedImage.decode(photo())
+    assert reduced.reduced and not full.reduced
+
+    [[from_reduced]], [[from_full]] = (recognizer.align_faces_batch([image], crops=True) for image in (reduced, full))
+    # Within one reduced pixel of the square and of a full decode
+    assert from_full['bbox'] == pytest.approx(SQUARE, abs=2)
+    assert from_reduced['bbox'] == pytest.approx(SQUARE, abs=reduced.scale)
+    # The unaligned crop always comes from the full-resolution image
+    x1, y1, x2, y2 = from_reduced['bbox']
+    assert from_reduced['face_img'].shape == (y2 - y1, x2 - x1, 3)
+    assert from_reduced['aligned'].shape == from_full['aligned'].shape == (112, 112, 3)
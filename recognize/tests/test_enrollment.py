@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+import enrollment
+from enrollment import BulkEnroller
+
+
+def write_images(folder, count, faces=1):
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(count)
+    for i in range(count):
+        image = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+        image[0, 0, 0] = 4 * i + faces
+        cv2.imwrite(str(folder / f"img{i}.png"), image)
+
+
+def test_commit_every_must_be_positive(recognizer):
+    with pytest.raises(ValueError):
+        BulkEnroller(recognizer, commit_every=0)
+
+
+def test_failing_image_is_reported_and_retried(recognizer, tmp_path, monkeypatch):
+    write_images(tmp_path / "photos" / "ann", 3)
+    detect = enrollment._detect
+
+    def flaky(recognizer, path):
+        if path.endswith("img1.png"):
+            raise RuntimeError("decoder crashed")
+        return detect(recognizer, path)
+
+    monkeypatch.setattr(enrollment, "_detect", flaky)
+    counts = BulkEnroller(recognizer, workers=0, commit_every=1).run(tmp_path / "photos")
+    assert counts['images'] == 3 and counts['errors'] == 1 and counts['enrolled'] == 2
+
+    # The failed image was not marked processed, so the next run picks it up
+    monkeypatch.setattr(enrollment, "_detect", detect)
+    counts = BulkEnroller(recognizer, workers=0).run(tmp_path / "photos")
+    assert counts['images'] == 1 and counts['enrolled'] == 1
+
+
+def test_review_queue_accept_and_reject(recognizer, tmp_path):
+    write_images(tmp_path / "photos", 2, faces=2)
+    counts = BulkEnroller(recognizer, workers=0).run(tmp_path / "photos")
+    assert counts['review'] == 4
+
+    store = recognizer.store
+    first, second = store.pending_reviews(2)
+    assert store.accept_review(first[0], "bob")
+    assert not store.accept_review(first[0], "bob")
+    assert store.reject_review(second[0])
+    assert len(store.pending_reviews()) == 2
+    assert store._query("SELECT COUNT(*) FROM face_embeddings WHERE person_name = ?", ("bob",), one=True)[0] == 1
+
+
+def test_accepted_review_moves_the_crop_out_of_unknown(recognizer, tmp_path, monkeypatch):
+    import review
+    write_images(tmp_path / "photos", 1, faces=2)
+    BulkEnroller(recognizer, workers=0).run(tmp_path / "photos")
+    recognizer.crop_writer.flush()
+    store = recognizer.store
+    (_, _, face_path, *_), (_, _, second_path, *_) = store.pending_reviews()
+    assert Path(face_path).parent.name == "unknown" and Path(face_path).exists()
+
+    answers = iter(["bob", "q"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    assert review.review_interactively(store, store.pending_reviews())['accepted'] == 1
+
+    moved = Path(recognizer.dataset_path) / "bob" / Path(face_path).name
+    assert moved.exists() and not Path(face_path).exists()
+    assert store._query("SELECT image_path FROM face_embeddings WHERE person_name = ?", ("bob",),
+                        one=True)[0] == str(moved)
+    # Pack crops are shared, so they keep their reference
+    assert review.move_to_person("faces.pack#abc123", "bob") == "faces.pack#abc123"
+    assert Path(second_path).exists()
+
+
+def test_redundant_samples_are_counted_not_enrolled(recognizer, tmp_path):
+    # Two files that differ only outside the face: same crop, same embedding
+    folder = tmp_path / "photos" / "ann"
+    folder.mkdir(parents=True)
+    image = np.random.default_rng(5).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    image[0, 0, 0] = 1
+    cv2.imwrite(str(folder / "a.png"), image)
+    image[-1, -1] = 255 - image[-1, -1]
+    cv2.imwrite(str(folder / "b.png"), image)
+
+    counts = BulkEnroller(recognizer, workers=0).run(tmp_path / "photos")
+    assert counts['enrolled'] == 1 and counts['skipped_redundant'] == 1
+    assert recognizer.known_faces.counts() == {"ann": 1}
+    actions = [action for (action,) in recognizer.store._query("SELECT action FROM training_log ORDER BY id")]
+    assert actions == ["BULK_ENROLLED", "SKIPPED_REDUNDANT"]
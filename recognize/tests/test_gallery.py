@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from gallery import FaceGallery, normalize_rows
+from snapshot import EmbeddingSnapshot
+
+
+def people_matrix(people=40, samples=50, dim=64, noise=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((people, dim)).astype(np.float32)
+    labels = np.repeat(np.arange(people, dtype=np.int32), samples)
+    matrix = normalize_rows(centers[labels] + noise * rng.standard_normal((len(labels), dim)))
+    return matrix, labels, [f"person_{i}" for i in range(people)], centers
+
+
+def test_attach_base_larger_than_initial_capacity():
+    matrix, labels, names, centers = people_matrix()
+    assert len(matrix) > 1024
+    gallery = FaceGallery()
+    gallery.attach_base(matrix, labels, names)
+    assert gallery.size == len(matrix)
+    assert np.array_equal(gallery.labels, labels)
+    gallery.add("newcomer", np.ones(matrix.shape[1], dtype=np.float32))
+    assert gallery.search(centers[7])[0] == "person_7"
+    assert gallery.search(np.ones(matrix.shape[1]))[0] == "newcomer"
+
+
+@pytest.mark.parametrize("index, options", [("ivf", {"min_train_size": 256}), ("hnsw", {"ef_construction": 40})])
+def test_saved_index_matches_rebuilt_index(tmp_path, index, options):
+    matrix, labels, names, centers = people_matrix(people=20, samples=30)
+    snapshot = EmbeddingSnapshot(tmp_path)
+    snapshot.save(matrix, labels, names, watermark=len(matrix))
+    loaded = snapshot.load()
+
+    built = FaceGallery(index=index, index_options=options)
+    built.attach_base(loaded['matrix'], loaded['labels'], loaded['names'])
+    snapshot.save_index(loaded, index, options, built.index.state())
+
+    state = snapshot.load_index(loaded, index, options)
+    assert state is not None
+    assert snapshot.load_index(loaded, index, {**options, "seed": 1}) is None
+    restored = FaceGallery(index=index, index_options=options)
+    restored.attach_base(loaded['matrix'], loaded['labels'], loaded['names'], index_state=state)
+
+    queries = normalize_rows(centers)
+    assert np.array_equal(built.index.search(queries, k=5)[1], restored.index.search(queries, k=5)[1])
+
+    # A new snapshot invalidates the saved index
+    snapshot.save(matrix, labels, names, watermark=len(matrix) + 1)
+    assert snapshot.load_index(snapshot.load(), index, options) is None
+
+
+def test_ivf_retrains_as_the_gallery_grows():
+    matrix, labels, names, centers = people_matrix(people=40, samples=40)
+    gallery = FaceGallery(index="ivf", index_options={"min_train_size": 256, "retrain_growth": 2.0})
+    index = gallery.index
+    gallery.add_many([names[label] for label in labels[:300]], matrix[:300])
+    assert index.trained_size == 300
+    assert len(index.centroids) == int(4 * np.sqrt(300))
+
+    # Rows below the growth factor are assigned to the existing lists...
+    gallery.add_many([names[label] for label in labels[300:599]], matrix[300:599])
+    assert index.trained_size == 300
+    # ...and reaching it retrains with lists for the larger gallery
+    gallery.add(names[labels[599]], matrix[599])
+    assert index.trained_size == 600
+    assert len(index.centroids) == int(4 * np.sqrt(600))
+
+    gallery.add_many([names[label] for label in labels[600:]], matrix[600:])
+    assignment = index.state()["assignment"]
+    # Every row is in exactly the list of its closest centroid
+    assert np.array_equal(assignment, np.argmax(gallery.matrix @ index.centroids.T, axis=1))
+    assert gallery.search(centers[11])[0] == "person_11"
+
+
+def test_ivf_with_fixed_nlist_is_not_retrained():
+    matrix, labels, names, _ = people_matrix(people=20, samples=40)
+    gallery = FaceGallery(index="ivf", index_options={"min_train_size": 100, "nlist": 16})
+    gallery.add_many([names[label] for label in labels[:100]], matrix[:100])
+    centroids = gallery.index.centroids
+    gallery.add_many([names[label] for label in labels[100:]], matrix[100:])
+    assert gallery.index.centroids is centroids
+    assert len(gallery.index.state()["assignment"]) == len(matrix)
+
+
+def test_identities_over_attached_base_match_added_rows():
+    matrix, labels, names, centers = people_matrix(people=30, samples=40)
+    attached = FaceGallery()
+    attached.attach_base(matrix[:900], labels[:900], names)
+    attached.add_many([names[label] for label in labels[900:]], matrix[900:])
+    added = FaceGallery()
+    added.add_many([names[label] for label in labels], matrix)
+
+    assert attached._base_members is None and attached._base_sums_pending
+    assert np.allclose(attached.centroids, added.centroids, atol=1e-5)
+    queries = centers[[3, 17, 29]]
+    for aggregate in ("centroid", "max", "top_m_mean"):
+        assert ([[name for name, _ in found] for found in attached.search_identities(queries, aggregate=aggregate)]
+                == [[name for name, _ in found] for found in added.search_identities(queries, aggregate=aggregate)])
+    assert np.array_equal(np.sort(attached.member_rows(17)), np.flatnonzero(labels == 17))
+
+
+@pytest.mark.parametrize("aggregate", ["centroid", "max"])
+def test_names_without_samples_are_not_ranked(aggregate):
+    # "ghost" has a name but no rows; its zero centroid would score 0 and
+    # beat both real people for a query facing away from them
+    matrix = np.eye(4, dtype=np.float32)[:2]
+    gallery = FaceGallery()
+    gallery.attach_base(matrix, np.array([0, 1], dtype=np.int32), ["ann", "bob", "ghost"])
+    [found] = gallery.search_identities(-matrix.sum(axis=0, keepdims=True), k=3, aggregate=aggregate)
+    assert sorted(name for name, _ in found) == ["ann", "bob"]
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from inference_pool import InferencePool, PoolSaturated
+from test_server import png
+
+
+@pytest.fixture
+def small_pool(client, monkeypatch):
+    import server
+    pool = InferencePool(server.recognizer, workers=1, max_queue=1, timeout=5.0)
+    monkeypatch.setattr(server, "inference_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_full_queue_is_rejected(recognizer, gate):
+    pool = InferencePool(recognizer, workers=1, max_queue=1, timeout=5.0)
+
+    async def scenario():
+        detect = lambda: recognizer.detect_faces(png_array(), face_app=pool.face_app())
+        running = asyncio.ensure_future(pool.run(detect))
+        queued = asyncio.ensure_future(pool.run(detect))
+        await asyncio.sleep(0.05)
+        assert pool.inflight == 2
+        with pytest.raises(PoolSaturated):
+            await pool.run(detect)
+        gate.set()
+        await asyncio.gather(running, queued)
+        # Slots come back once jobs finish
+        await pool.run(detect)
+        assert pool.inflight == 0
+
+    asyncio.run(scenario())
+    pool.shutdown()
+
+
+def test_expired_deadline_keeps_the_slot_until_the_job_ends(recognizer, gate):
+    pool = InferencePool(recognizer, workers=1, max_queue=0, timeout=0.1)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(lambda: recognizer.detect_faces(png_array(), face_app=pool.face_app()))
+        # The timed-out job is still running and still holds its slot
+        assert pool.inflight == 1
+        with pytest.raises(PoolSaturated):
+            await pool.run(lambda: None)
+        gate.set()
+
+    asyncio.run(scenario())
+    wait_for(lambda: pool.inflight == 0)
+    pool.shutdown()
+
+
+def test_server_answers_503_when_saturated(client, small_pool, gate):
+    import server
+
+    # Fill both slots from a loop of our own; the request batcher is bound to
+    # one event loop, so concurrent TestClient calls can't do it
+    async def fill():
+        detect = lambda: server.recognizer.detect_faces(png_array(), face_app=small_pool.face_app())
+        await asyncio.gather(small_pool.run(detect), small_pool.run(detect))
+
+    filler = threading.Thread(target=asyncio.run, args=(fill(),))
+    filler.start()
+    wait_for(lambda: small_pool.inflight == 2)
+
+    response = client.post("/recognize", files={"file": ("c.png", png(1, value=13), "image/png")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    gate.set()
+    filler.join()
+    wait_for(lambda: small_pool.inflight == 0)
+
+
+def test_server_answers_504_past_the_deadline(client, small_pool, gate):
+    small_pool.timeout = 0.1
+    response = client.post("/recognize", files={"file": ("a.png", png(1, value=14), "image/png")})
+    assert response.status_code == 504
+    gate.set()
+    wait_for(lambda: small_pool.inflight == 0)
+
+
+def png_array():
+    import numpy as np
+    image = np.full((240, 320, 3), 90, dtype=np.uint8)
+    image[0, 0, 0] = 1
+    return image
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from gallery import FaceGallery, normalize_rows
+from quantization import quantize, quantized_scores
+from test_gallery import people_matrix
+
+
+def split_gallery(matrix, labels, names, precision, rerank=32, base_rows=600):
+    # Rows before base_rows in the base segment, the rest added to the tail
+    gallery = FaceGallery(precision=precision, rerank=rerank)
+    codes, scales = quantize(matrix[:base_rows], precision) if precision != "float32" else (None, None)
+    gallery.attach_base(matrix[:base_rows], labels[:base_rows], names, codes, scales)
+    gallery.add_many([names[label] for label in labels[base_rows:]], matrix[base_rows:])
+    return gallery
+
+
+@pytest.mark.parametrize("precision, atol", [("float16", 2e-3), ("int8", 3e-2)])
+def test_quantized_scores_approximate_float32(precision, atol):
+    matrix = normalize_rows(np.random.default_rng(0).standard_normal((2500, 64)))
+    queries = matrix[:7]
+    codes, scales = quantize(matrix, precision)
+    out = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    # Several chunks plus a partial one
+    quantized_scores(queries, codes, scales, out, chunk_rows=1024)
+    assert np.allclose(out, queries @ matrix.T, atol=atol)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_approximate_scores_cover_base_and_tail(precision):
+    matrix, labels, names, _ = people_matrix(people=20, samples=50)
+    gallery = split_gallery(matrix, labels, names, precision)
+    queries = matrix[[3, 599, 600, 999]]
+    approximate = gallery.approximate_scores(queries)
+    assert approximate.shape == (4, len(matrix))
+    assert np.allclose(approximate, queries @ matrix.T, atol=3e-2)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+@pytest.mark.parametrize("rerank", [32, 2])
+def test_quantized_search_ranks_like_float32(precision, rerank):
+    matrix, labels, names, centers = people_matrix(people=20, samples=50)
+    exact = split_gallery(matrix, labels, names, "float32")
+    quantized = split_gallery(matrix, labels, names, precision, rerank=rerank)
+    # Probes near rows in both segments
+    rng = np.random.default_rng(3)
+    queries = normalize_rows(matrix[[10, 400, 650, 990]] + 0.05 * rng.standard_normal((4, matrix.shape[1])))
+    k = 5
+    expected_scores, expected_ids = exact.index.search(queries, k)
+    scores, ids = quantized.index.search(queries, k)
+    # Re-ranked scores are full precision, so they match exactly for the
+    # rows found; with rerank < k at least k candidates are still scored
+    assert np.array_equal(ids[:, 0], expected_ids[:, 0])
+    assert np.allclose(scores[:, 0], expected_scores[:, 0], atol=1e-5)
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, expected_ids)])
+    assert overlap >= 0.8
+    assert np.allclose(scores, np.einsum('qkd,qd->qk', matrix[ids], queries), atol=1e-5)
+    assert [name for name, _ in quantized.search_batch(centers[[0, 19]])] == ["person_0", "person_19"]
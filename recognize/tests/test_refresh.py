@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_recognizer(fake_models, tmp_path):
+    from face_recognition_system import IncrementalFaceRecognition
+    recognizers = []
+
+    def make():
+        recognizer = IncrementalFaceRecognition(dataset_path=str(tmp_path / "dataset"),
+                                                db_path=str(tmp_path / "faces.db"))
+        recognizers.append(recognizer)
+        return recognizer
+    yield make
+    for recognizer in recognizers:
+        recognizer.close()
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+
+
+def add(recognizer, name, seed):
+    crop = np.zeros((112, 112, 3), dtype=np.uint8)
+    assert recognizer.add_face_sample(name, embedding(seed), crop, f"{name}_{seed}") is not None
+    recognizer.store.flush()
+
+
+def test_refresh_skips_rows_added_locally(make_recognizer):
+    writer, reader = make_recognizer(), make_recognizer()
+    # The first refresh only catches up; no full reload is needed
+    assert reader.refresh_gallery() == 0
+
+    add(writer, "ann", 1)
+    add(writer, "ann", 2)
+    add(reader, "bob", 3)
+    assert writer.refresh_gallery() == 1
+    assert reader.refresh_gallery() == 2
+    for recognizer in (writer, reader):
+        assert recognizer.known_faces.size == 3
+        assert recognizer.known_faces.counts() == {"ann": 2, "bob": 1}
+        assert recognizer.refresh_gallery() == 0
+
+    # Matching is by name and embedding: the same embedding under another name is new
+    add(writer, "cat", 3)
+    assert writer.refresh_gallery() == 0 and reader.refresh_gallery() == 1
+    assert writer.known_faces.counts() == reader.known_faces.counts() == {"ann": 2, "bob": 1, "cat": 1}
+
+
+def test_reload_swaps_in_a_fresh_gallery(make_recognizer):
+    recognizer = make_recognizer()
+    add(recognizer, "ann", 1)
+    old = recognizer.known_faces
+    recognizer.reload_gallery()
+    assert recognizer.known_faces is not old
+    assert recognizer.known_faces.counts() == {"ann": 1}
+    assert recognizer.refresh_gallery() == 0
+    assert recognizer.known_faces.search(embedding(1))[0] == "ann"
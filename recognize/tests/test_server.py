@@ -0,0 +1,170 @@
+import io
+import time
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+
+def png(faces, value=100):
+    # The fake detector finds image[0, 0, 0] % 4 faces; PNG keeps that pixel exact
+    image = np.full((240, 320, 3), value, dtype=np.uint8)
+    image[0, 0, 0] = faces
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def zip_of(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_batch_reports_undecodable_files_in_place(client):
+    response = client.post("/recognize/batch", files=[
+        ("files", ("two.png", png(2), "image/png")),
+        ("files", ("broken.png", b"not an image", "image/png")),
+        ("files", ("none.png", png(0), "image/png")),
+    ])
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["filename"] for result in results] == ["two.png", "broken.png", "none.png"]
+    assert len(results[0]["results"]) == 2
+    assert results[1] == {"filename": "broken.png", "error": "Invalid image file"}
+    assert results[2]["results"] == []
+
+
+def test_batch_expands_zip_archives(client):
+    archive = zip_of({"a.png": png(1), "nested/b.png": png(3), "bad.png": b"\x89PNG garbage"})
+    response = client.post("/recognize/batch", files=[("files", ("upload.zip", archive, "application/zip"))])
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["filename"] for result in results] == ["a.png", "nested/b.png", "bad.png"]
+    assert [len(result.get("results", [])) for result in results] == [1, 3, 0]
+    assert results[2]["error"] == "Invalid image file"
+
+
+def test_batch_rejects_corrupt_zip(client):
+    response = client.post("/recognize/batch", files=[("files", ("upload.zip", b"PK not a zip", "application/zip"))])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid zip archive"
+
+
+@pytest.mark.parametrize("det_size", [100, 650, 2048])
+def test_batch_rejects_bad_det_size(client, det_size):
+    response = client.post(f"/recognize/batch?det_size={det_size}",
+                           files=[("files", ("a.png", png(1), "image/png"))])
+    assert response.status_code == 400
+
+
+def test_repeated_upload_is_served_from_cache(client):
+    import server
+    image = png(2, value=70)
+    first = client.post("/recognize", files={"file": ("a.png", image, "image/png")})
+    hits = server.recognizer.detection_cache.hits
+    second = client.post("/recognize/batch", files=[("files", ("a.png", image, "image/png")),
+                                                    ("files", ("b.png", image, "image/png"))])
+    assert server.recognizer.detection_cache.hits == hits + 2
+    assert second.json()["results"][0]["results"] == first.json()["results"]
+
+
+def test_uploads_are_cached_apart_from_full_decodes(client, tmp_path):
+    # Uploads may be decoded reduced; a full-resolution detection of the
+    # same file must not be served their results
+    import server
+    from detection_cache import content_hash
+    image = png(1, value=74)
+    client.post("/recognize", files={"file": ("a.png", image, "image/png")})
+    cache = server.recognizer.detection_cache
+    assert cache.contains(content_hash(image), server.recognizer.detection_config(reduced_decode=True))
+    assert not cache.contains(content_hash(image), server.recognizer.detection_config())
+
+    path = tmp_path / "a.png"
+    path.write_bytes(image)
+    hits = cache.hits
+    server.recognizer.detect_faces(str(path))
+    assert cache.hits == hits
+
+
+def test_top_k_candidates(client):
+    import server
+    server.recognizer.add_face_sample("ann", np.ones(512, dtype=np.float32), np.zeros((112, 112, 3), np.uint8), "ann")
+    response = client.post("/recognize?top_k=2", files={"file": ("a.png", png(1, value=30), "image/png")})
+    assert response.status_code == 200
+    [face] = response.json()["results"]
+    assert [candidate["person_name"] for candidate in face["candidates"]] == ["ann"]
+
+
+def test_batch_never_gives_one_person_to_two_faces(client):
+    # Identical faces in one image: only one of them may take the identity
+    import server
+    faces, _ = server.recognizer.detect_faces(cv2.imdecode(np.frombuffer(png(3, 50), np.uint8), cv2.IMREAD_COLOR))
+    server.recognizer.add_face_sample("ann", faces[0]['embedding'], faces[0]['face_img'], "ann")
+    response = client.post("/recognize/batch", files=[("files", ("a.png", png(3, 50), "image/png")),
+                                                      ("files", ("b.png", png(3, 50), "image/png"))])
+    names = [[face["person_name"] for face in result["results"]] for result in response.json()["results"]]
+    assert [sorted(image_names) for image_names in names] == [["ann", "unknown", "unknown"]] * 2
+
+
+@pytest.mark.parametrize("limit, value", [("ZIP_MAX_ENTRIES", 2), ("ZIP_MAX_ENTRY_BYTES", 10_000),
+                                          ("ZIP_MAX_TOTAL_BYTES", 60_000)])
+def test_batch_rejects_oversized_zip(client, monkeypatch, limit, value):
+    import server
+    monkeypatch.setattr(server, limit, value)
+    # A small image plus two 48 KB entries
+    archive = zip_of({"a.png": png(1), "b.raw": b"\0" * 48_000, "c.raw": b"\0" * 48_000})
+    response = client.post("/recognize/batch", files=[("files", ("upload.zip", archive, "application/zip"))])
+    assert response.status_code == 413
+
+
+def frame(frame_id, faces=1):
+    from server import FRAME_HEADER
+    return FRAME_HEADER.pack(frame_id) + png(faces, value=120)
+
+
+def test_stream_returns_tracked_faces(client):
+    with client.websocket_connect("/stream?detect_every=1") as websocket:
+        track_ids = []
+        for frame_id in (1, 2):
+            websocket.send_bytes(frame(frame_id))
+            result = websocket.receive_json()
+            assert result["frame_id"] == frame_id
+            assert result["dropped"] == 0
+            [face] = result["faces"]
+            track_ids.append(face["track_id"])
+        # The same face keeps its track across frames
+        assert track_ids[0] == track_ids[1]
+
+        websocket.send_bytes(frame(3)[:4])
+        assert "error" in websocket.receive_json()
+        websocket.send_bytes(frame(4)[:8] + b"not an image")
+        assert websocket.receive_json() == {"frame_id": 4, "error": "Invalid image"}
+
+
+def test_stream_drops_frames_that_went_stale(client, gate, monkeypatch):
+    # While frame 1 is held in detection, frames 2-4 arrive; only the newest
+    # waits in the slot and the others are counted as dropped
+    import server
+    offered = []
+    offer = server.StreamSession.offer
+    monkeypatch.setattr(server.StreamSession, "offer",
+                        lambda session, message: (offer(session, message), offered.append(message)))
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    with client.websocket_connect("/stream") as websocket:
+        websocket.send_bytes(frame(1))
+        wait_for(lambda: server.inference_pool.inflight == 1)
+        for frame_id in (2, 3, 4):
+            websocket.send_bytes(frame(frame_id))
+        wait_for(lambda: len(offered) == 4)
+        gate.set()
+        first, second = websocket.receive_json(), websocket.receive_json()
+    assert (first["frame_id"], first["dropped"]) == (1, 2)
+    assert (second["frame_id"], second["dropped"]) == (4, 2)
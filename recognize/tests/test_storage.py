@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from storage import FaceStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FaceStore(str(tmp_path / "faces.db"))
+    store.init_schema()
+    yield store
+    store.close()
+
+
+def embedding_count(store):
+    return store._query("SELECT COUNT(*) FROM face_embeddings", one=True)[0]
+
+
+def test_batch_commits_on_success(store):
+    with store.batch():
+        store.save_embedding("ann", np.ones(8), "ann/1.jpg")
+        store.mark_processed("photo.jpg", "abc")
+        assert embedding_count(store) == 0
+    assert embedding_count(store) == 1
+    assert store.load_processed()
+
+
+def test_batch_that_raises_commits_nothing(store):
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.save_embedding("ann", np.ones(8), "ann/1.jpg")
+            with store.batch():
+                store.log_action("photo.jpg", "ann", "NEW_PERSON")
+            raise RuntimeError("image failed halfway")
+    assert embedding_count(store) == 0
+    assert store._query("SELECT COUNT(*) FROM training_log", one=True)[0] == 0
+
+    # The store is usable afterwards and later writes are not mixed with the dropped ones
+    store.save_embedding("bob", np.ones(8), "bob/1.jpg")
+    assert [name for _, name, _ in store.load_embeddings()] == ["bob"]
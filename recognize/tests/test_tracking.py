@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from tracking import FaceTracker, iou_matrix
+
+
+class ScriptedRecognizer:
+    # Detections come from `boxes` (set per frame); every embedded crop
+    # matches `match` with `similarity`
+    similarity_threshold = 0.4
+
+    def __init__(self):
+        self.boxes = []
+        self.match = ("alice", 0.9)
+        self.embedded = []
+
+    def align_faces_batch(self, frames, face_app=None, crops=True):
+        return [[{'bbox': np.array(box, dtype=np.float32), 'aligned': index}
+                 for index, box in enumerate(self.boxes)]]
+
+    def embed_crops(self, crops, face_app=None):
+        self.embedded.append(list(crops))
+        return [np.zeros(4, dtype=np.float32) for _ in crops]
+
+    def find_frame_matches(self, embeddings):
+        return [self.match for _ in embeddings]
+
+
+@pytest.fixture
+def scripted():
+    return ScriptedRecognizer()
+
+
+def frame():
+    return np.zeros((240, 320, 3), dtype=np.uint8)
+
+
+def test_iou_matrix():
+    ious = iou_matrix([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+    assert ious.shape == (1, 3)
+    assert ious[0] == pytest.approx([1.0, 50 / 150, 0.0])
+
+
+def test_detections_keep_their_track_by_iou(scripted):
+    tracker = FaceTracker(scripted, detect_every=1)
+    scripted.boxes = [[10, 10, 50, 50], [100, 100, 140, 140]]
+    first = {tuple(track.bbox): track.id for track in tracker.process(frame())}
+
+    # Both faces moved a little and came back in the other order
+    scripted.boxes = [[104, 102, 144, 142], [12, 11, 52, 51]]
+    second = {tuple(track.bbox): track.id for track in tracker.process(frame())}
+    assert second[(104, 102, 144, 142)] == first[(100, 100, 140, 140)]
+    assert second[(12, 11, 52, 51)] == first[(10, 10, 50, 50)]
+
+    # A face far from any track starts a new one
+    scripted.boxes = [[200, 10, 240, 50]]
+    third = tracker.process(frame())
+    assert [track.id for track in third] == [max(first.values()) + 1]
+
+
+def test_unmatched_tracks_expire_after_max_missed(scripted):
+    tracker = FaceTracker(scripted, detect_every=1, max_missed=2)
+    scripted.boxes = [[10, 10, 50, 50]]
+    track = tracker.process(frame())[0]
+
+    scripted.boxes = []
+    for missed in (1, 2):
+        # Missed tracks are kept, but not reported
+        assert tracker.process(frame()) == []
+        assert tracker.tracks == [track] and track.missed == missed
+    tracker.process(frame())
+    assert tracker.tracks == []
+
+
+def test_confident_tracks_are_not_re_embedded(scripted):
+    tracker = FaceTracker(scripted, detect_every=1, reembed_below=0.5)
+    scripted.boxes = [[10, 10, 50, 50]]
+    track = tracker.process(frame())[0]
+    assert track.identity == ("alice", pytest.approx(0.9))
+    assert len(scripted.embedded) == 1
+
+    # 0.9 decays to 0.81: still confident, the old identity is kept
+    tracker.confidence_decay = 0.9
+    tracker.process(frame())
+    assert len(scripted.embedded) == 1
+    assert tracker.embeddings == 1
+
+    # 0.81 decays to 0.405, below reembed_below
+    tracker.confidence_decay = 0.5
+    tracker.process(frame())
+    assert len(scripted.embedded) == 2
+    assert tracker.embeddings == 2
+
+
+def test_detection_runs_every_n_frames(scripted):
+    tracker = FaceTracker(scripted, detect_every=3)
+    scripted.boxes = [[10, 10, 50, 50]]
+    textured = np.random.default_rng(0).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    for _ in range(6):
+        tracks = tracker.process(textured)
+        assert len(tracks) == 1
+    # Frames in between follow the face with optical flow instead
+    assert tracker.detections == 2
+    assert tracks[0].bbox == pytest.approx([10, 10, 50, 50], abs=0.5)
+
+
+def test_unknown_votes_compete_with_names(scripted):
+    tracker = FaceTracker(scripted, detect_every=1, confidence_decay=0.0)
+    scripted.boxes = [[10, 10, 50, 50]]
+    scripted.match = ("alice", 0.2)
+    track = tracker.process(frame())[0]
+    assert track.identity[0] is None
@@ -0,0 +1,165 @@
+import itertools
+
+import cv2
+import numpy as np
+
+from assignment import greedy_assignment
+
+
+def iou_matrix(boxes_a, boxes_b):
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+
+class Track:
+    _ids = itertools.count(1)
+
+    def __init__(self, bbox):
+        self.id = next(Track._ids)
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.votes = {}
+        self.scores = {}
+        self.identity_confidence = 0.0
+        self.missed = 0
+        self.hits = 1
+
+    def observe(self, name, similarity, vote_decay, threshold):
+        # Temporally smoothed identity: older votes fade by vote_decay per
+        # observation; "unknown" (None) competes like any other identity.
+        for key in self.votes:
+            self.votes[key] *= vote_decay
+        weight = similarity if name is not None else max(threshold - similarity, 0.05)
+        self.votes[name] = self.votes.get(name, 0.0) + weight
+        previous = self.scores.get(name, similarity)
+        self.scores[name] = 0.5 * previous + 0.5 * similarity
+        self.identity_confidence = similarity if name is not None else 1.0 - similarity
+
+    @property
+    def identity(self):
+        if not self.votes:
+            return None, 0.0
+        name = max(self.votes, key=self.votes.get)
+        return name, self.scores.get(name, 0.0)
+
+
+class FaceTracker:
+    # Runs full detection every `detect_every` frames (or as soon as a track
+    # is lost), propagates boxes with sparse optical flow in between, and
+    # only re-embeds a track once its identity confidence has decayed below
+    # `reembed_below`.
+    def __init__(self, recognizer, detect_every=5, iou_threshold=0.3, max_missed=5,
+                 vote_decay=0.7, confidence_decay=0.95, reembed_below=0.5):
+        self.recognizer = recognizer
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.vote_decay = vote_decay
+        self.confidence_decay = confidence_decay
+        self.reembed_below = reembed_below
+        self.tracks = []
+        self.frame_index = 0
+        self.detections = 0
+        self.embeddings = 0
+        self._prev_gray = None
+        self._lost = False
+
+    def process(self, frame, face_app=None):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        run_detection = (self.frame_index % self.detect_every == 0 or self._lost
+                         or not self.tracks or self._prev_gray is None)
+
+        for track in self.tracks:
+            track.identity_confidence *= self.confidence_decay
+
+        if run_detection:
+            self._detect(frame, face_app)
+        else:
+            self._propagate(self._prev_gray, gray)
+
+        self._prev_gray = gray
+        self.frame_index += 1
+        return [track for track in self.tracks if track.missed == 0]
+
+    def _propagate(self, prev_gray, gray):
+        points = []
+        owners = []
+        for index, track in enumerate(self.tracks):
+            x1, y1, x2, y2 = track.bbox
+            # A small grid over the inner part of the box is cheaper and more
+            # stable than corner detection on low-texture faces
+            xs = np.linspace(x1 + 0.2 * (x2 - x1), x2 - 0.2 * (x2 - x1), 4)
+            ys = np.linspace(y1 + 0.2 * (y2 - y1), y2 - 0.2 * (y2 - y1), 4)
+            grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+            points.append(grid)
+            owners.extend([index] * len(grid))
+        if not points:
+            return
+
+        points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        owners = np.asarray(owners)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        status = status.reshape(-1).astype(bool)
+        shifts = (moved - points).reshape(-1, 2)
+
+        for index, track in enumerate(self.tracks):
+            good = (owners == index) & status
+            if good.sum() < 4:
+                track.missed += 1
+                self._lost = True
+                continue
+            dx, dy = np.median(shifts[good], axis=0)
+            track.bbox += np.array([dx, dy, dx, dy], dtype=np.float32)
+
+    def _detect(self, frame, face_app):
+        faces = self.recognizer.align_faces_batch([frame], face_app=face_app, crops=False)[0]
+        self.detections += 1
+        self._lost = False
+
+        boxes = [face_data['bbox'] for face_data in faces]
+        pairs = greedy_assignment(iou_matrix([track.bbox for track in self.tracks], boxes), self.iou_threshold)
+        matched_tracks = {row for row, _ in pairs}
+        matched_faces = {col for _, col in pairs}
+
+        observed = []
+        for row, col in pairs:
+            track = self.tracks[row]
+            track.bbox = np.asarray(boxes[col], dtype=np.float32)
+            track.missed = 0
+            track.hits += 1
+            observed.append((track, faces[col]))
+
+        survivors = []
+        for index, track in enumerate(self.tracks):
+            if index not in matched_tracks:
+                track.missed += 1
+            if track.missed <= self.max_missed:
+                survivors.append(track)
+        self.tracks = survivors
+
+        for col, face_data in enumerate(faces):
+            if col not in matched_faces:
+                track = Track(face_data['bbox'])
+                self.tracks.append(track)
+                observed.append((track, face_data))
+
+        to_embed = [(track, face_data) for track, face_data in observed
+                    if track.identity_confidence < self.reembed_below]
+        if not to_embed:
+            return
+        embeddings = self.recognizer.embed_crops([face_data['aligned'] for _, face_data in to_embed], face_app)
+        matches = self.recognizer.find_frame_matches(embeddings)
+        self.embeddings += len(to_embed)
+        threshold = self.recognizer.similarity_threshold
+        for (track, _), (best_match, similarity) in zip(to_embed, matches):
+            name = best_match if similarity > threshold else None
+            track.observe(name, similarity, self.vote_decay, threshold)
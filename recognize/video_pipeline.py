@@ -0,0 +1,200 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from metrics import Histogram
+
+
+STAGE_LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class LatestFrameSlot:
+    # Single-slot hand-off for live sources: a new frame replaces any frame
+    # the next stage has not picked up yet, so latency never accumulates.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while self._item is None and not self._closed:
+                self._cond.wait()
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class BoundedFrameQueue:
+    # Lossless hand-off for files: the producer blocks when the consumer
+    # falls behind instead of dropping frames.
+    def __init__(self, maxsize, stop_event):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = stop_event
+        self.dropped = 0
+
+    def put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self):
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return None
+
+    def close(self):
+        # Once stopped, consumers notice the stop event instead
+        self.put(None)
+
+
+class VideoPipeline:
+    # Capture, inference and output run as separate stages so decode stalls
+    # and inference stalls overlap instead of adding up. Capture and
+    # inference run on background threads; output (drawing, imshow, writers)
+    # runs on the calling thread because HighGUI wants the main thread.
+    def __init__(self, recognizer, source, tracker=None, live=None, queue_size=8):
+        self.recognizer = recognizer
+        self.source = source
+        self.tracker = tracker
+        self.live = live if live is not None else self._is_live(source)
+        self.queue_size = queue_size
+        self.cap = cv2.VideoCapture(source)
+        self._stop = threading.Event()
+
+        self.capture_latency = Histogram("video_capture_ms", STAGE_LATENCY_BUCKETS, "Frame read/decode time")
+        self.inference_latency = Histogram("video_inference_ms", STAGE_LATENCY_BUCKETS, "Per-frame recognition time")
+        self.output_latency = Histogram("video_output_ms", STAGE_LATENCY_BUCKETS, "Per-frame render/write time")
+        self.end_to_end_latency = Histogram("video_end_to_end_ms", STAGE_LATENCY_BUCKETS, "Capture to output latency")
+        self.frames = {"capture": 0, "inference": 0, "output": 0}
+        self.started_at = None
+        self.finished_at = None
+        self.dropped = 0
+
+    @staticmethod
+    def _is_live(source):
+        if isinstance(source, int):
+            return True
+        return str(source).isdigit() or str(source).lower().startswith(("rtsp://", "http://", "https://"))
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    @property
+    def fps(self):
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        return fps if fps and fps > 0 else 25.0
+
+    def _make_channel(self):
+        return LatestFrameSlot() if self.live else BoundedFrameQueue(self.queue_size, self._stop)
+
+    def stop(self):
+        self._stop.set()
+
+    def _capture(self, frames):
+        frame_id = 0
+        try:
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                captured = time.perf_counter()
+                self.capture_latency.observe((captured - started) * 1000)
+                self.frames["capture"] += 1
+                frames.put((frame_id, captured, frame))
+                frame_id += 1
+        finally:
+            frames.close()
+
+    def _infer(self, frames, results):
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                frame_id, captured, frame = item
+                started = time.perf_counter()
+                annotations = self.recognizer._annotate_frame(frame, self.tracker)
+                self.inference_latency.observe((time.perf_counter() - started) * 1000)
+                self.frames["inference"] += 1
+                results.put((frame_id, captured, frame, annotations))
+        finally:
+            results.close()
+
+    def run(self, output):
+        # output(frame_id, frame, annotations) is called for every processed
+        # frame in order; returning False stops the pipeline.
+        frames = self._make_channel()
+        results = self._make_channel()
+        self.started_at = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._capture, args=(frames,), name="video-capture", daemon=True),
+            threading.Thread(target=self._infer, args=(frames, results), name="video-inference", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    break
+                frame_id, captured, frame, annotations = item
+                started = time.perf_counter()
+                keep_going = output(frame_id, frame, annotations)
+                finished = time.perf_counter()
+                self.output_latency.observe((finished - started) * 1000)
+                self.end_to_end_latency.observe((finished - captured) * 1000)
+                self.frames["output"] += 1
+                if keep_going is False:
+                    break
+        finally:
+            self._stop.set()
+            frames.close()
+            results.close()
+            for thread in threads:
+                thread.join(timeout=5)
+            self.cap.release()
+            self.finished_at = time.perf_counter()
+            self.dropped = frames.dropped + results.dropped
+
+        return self.stats()
+
+    def stats(self):
+        end = self.finished_at or time.perf_counter()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        stages = {
+            "capture": self.capture_latency.snapshot(),
+            "inference": self.inference_latency.snapshot(),
+            "output": self.output_latency.snapshot(),
+            "end_to_end": self.end_to_end_latency.snapshot(),
+        }
+        return {
+            "live": self.live,
+            "elapsed_seconds": elapsed,
+            "frames": dict(self.frames),
+            "dropped_frames": self.dropped,
+            "throughput_fps": {stage: count / elapsed if elapsed else 0.0 for stage, count in self.frames.items()},
+            "mean_latency_ms": {stage: snapshot["mean"] for stage, snapshot in stages.items()},
+        }